@@ -1,21 +1,28 @@
 import streamlit as st
 import sqlite3
 import os
+import html
+import tempfile
 import uuid
-from datetime import date, datetime
-from PIL import Image
+import zipfile
+from datetime import date, datetime, timedelta
 import pandas as pd
 import altair as alt
-from passlib.hash import bcrypt
 
-# ================== 공통 상수/경로 ==================
-DB_PATH = "diary.db"
-MEDIA_DIR = "media"
-IMG_DIR = os.path.join(MEDIA_DIR, "images")
-AUD_DIR = os.path.join(MEDIA_DIR, "audio")
-os.makedirs(IMG_DIR, exist_ok=True)
-os.makedirs(AUD_DIR, exist_ok=True)
+from diary_db import (DB_PATH, EMOTIONS, EMO_KEYS, SNIPPET_START, SNIPPET_END, get_daily_stats,
+                      get_monthly_stats, get_mood_counts, parse_tags)
+from diary_auth import AuthBusy, AuthService, LoginThrottled, client_address, load_secret
+from diary_import import IMPORT_BATCH, ImportAborted, import_entries
+from diary_media import BadImage, UploadTooLarge
+from diary_repo import MEDIA_DIR, DiaryRepository
+from diary_shard import SHARD_COUNT, SHARD_DIR
+from diary_stats import StatsWorker
+from diary_static import MEDIA_URL, MediaServer
+from diary_trash import TRASH_RETENTION_DAYS, TrashPurger
+from instrument import begin_run, debug_sidebar, span, timed
+from diary_backup import BACKUP_DIR, SnapshotScheduler, compressed_snapshot, list_snapshots
 
+# ================== 공통 상수/경로 ==================
 APP_TITLE = "EMOJI_0 나의 일기장"
 
 # 기본 팔레트(라임색 제외)
@@ -30,227 +37,23 @@ BASE_PALETTE = {
     "text_dark":"#E9E9E9"
 }
 
-# 감정 라벨(라벨은 이모지 포함, 저장은 key로)
-EMOTIONS = [
-    {"key": "happy",   "label": "EMOJI_1 행복"},
-    {"key": "calm",    "label": "EMOJI_2 평온"},
-    {"key": "neutral", "label": "EMOJI_3 보통"},
-    {"key": "sad",     "label": "EMOJI_4 우울"},
-    {"key": "anxious", "label": "EMOJI_5 불안"},
-    {"key": "drive",   "label": "EMOJI_6 의욕"},
-]
+# 감정 목록(EMOTIONS)은 가져오기 검증과 같이 쓰도록 diary_db 에 있음
 EMO_KEY_TO_LABEL = {e["key"]: e["label"] for e in EMOTIONS}
 EMO_LABELS = [e["label"] for e in EMOTIONS]
-EMO_KEYS = [e["key"] for e in EMOTIONS]
-
-# ================== DB ==================
-def make_conn(db_path: str):
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.text_factory = str
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
-
-def init_db():
-    conn = make_conn(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            name TEXT,
-            password_hash TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS entries(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            d TEXT,
-            mood TEXT,
-            mood_score INTEGER,
-            tags TEXT,
-            content TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            updated_at TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS files(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            entry_id INTEGER,
-            kind TEXT,
-            path TEXT,
-            original_name TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(entry_id) REFERENCES entries(id) ON DELETE CASCADE
-        )
-    """)
-    # 사용자 테마 설정 저장 테이블
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS user_settings(
-            user_id INTEGER PRIMARY KEY,
-            theme TEXT,               -- 'light' or 'dark'
-            primary TEXT,             -- 포인트 컬러
-            bg_style TEXT,            -- 'pastel' or 'matte'
-            font_scale TEXT,          -- 'sm'/'md'/'lg'
-            updated_at TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    conn.commit()
-    return conn
-
-# 사용자
-def create_user(conn, email, name, password_plain):
-    c = conn.cursor()
-    pw_hash = bcrypt.hash(password_plain)
-    c.execute("INSERT INTO users(email, name, password_hash) VALUES(?, ?, ?)",
-              (email, name, pw_hash))
-    conn.commit()
-    # 기본 테마 설정도 같이 생성
-    upsert_user_settings(conn, c.lastrowid, theme="light", primary=BASE_PALETTE["primary"],
-                         bg_style="pastel", font_scale="md")
-    return c.lastrowid
-
-def get_user_by_email(conn, email):
-    c = conn.cursor()
-    c.execute("SELECT id, email, name, password_hash FROM users WHERE email = ?", (email,))
-    return c.fetchone()
-
-# 일기
-def insert_entry(conn, user_id, d, mood_key, mood_score, tags, content):
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO entries(user_id, d, mood, mood_score, tags, content, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, d, mood_key, mood_score, tags, content, datetime.utcnow().isoformat()))
-    conn.commit()
-    return c.lastrowid
-
-def update_entry(conn, entry_id, user_id, d, mood_key, mood_score, tags, content):
-    c = conn.cursor()
-    c.execute("""
-        UPDATE entries
-        SET d=?, mood=?, mood_score=?, tags=?, content=?, updated_at=?
-        WHERE id=? AND user_id=?
-    """, (d, mood_key, mood_score, tags, content, datetime.utcnow().isoformat(), entry_id, user_id))
-    conn.commit()
-
-def delete_entry(conn, entry_id, user_id):
-    c = conn.cursor()
-    c.execute("DELETE FROM entries WHERE id=? AND user_id=?", (entry_id, user_id))
-    conn.commit()
-
-def get_entries(conn, user_id, q=None, mood_key=None, tag=None):
-    c = conn.cursor()
-    base = "SELECT id, d, mood, mood_score, tags, content, created_at FROM entries WHERE user_id=?"
-    params = [user_id]
-    if q:
-        base += " AND (content LIKE ? OR tags LIKE ?)"
-        params += [f"%{q}%", f"%{q}%"]
-    if mood_key:
-        base += " AND mood = ?"
-        params.append(mood_key)
-    if tag:
-        base += " AND tags LIKE ?"
-        params.append(f"%{tag}%")
-    base += " ORDER BY d DESC, id DESC"
-    c.execute(base, params)
-    return c.fetchall()
-
-# 파일
-def insert_file(conn, entry_id, kind, path, original_name):
-    c = conn.cursor()
-    c.execute("INSERT INTO files(entry_id, kind, path, original_name) VALUES (?, ?, ?, ?)",
-              (entry_id, kind, path, original_name))
-    conn.commit()
-
-def get_files(conn, entry_id, user_id):
-    c = conn.cursor()
-    c.execute("""
-        SELECT f.kind, f.path, f.original_name
-        FROM files f
-        JOIN entries e ON e.id = f.entry_id
-        WHERE f.entry_id=? AND e.user_id=?
-        ORDER BY f.id ASC
-    """, (entry_id, user_id))
-    return c.fetchall()
-
-def delete_files_of_entry(conn, entry_id, user_id):
-    files = get_files(conn, entry_id, user_id)
-    for _, path, _ in files:
-        if os.path.exists(path):
-            try:
-                os.remove(path)
-            except Exception:
-                pass
-    c = conn.cursor()
-    c.execute("""
-        DELETE FROM files
-        WHERE entry_id IN (SELECT id FROM entries WHERE id=? AND user_id=?)
-    """, (entry_id, user_id))
-    conn.commit()
-
-def save_uploaded_images(files):
-    saved = []
-    for f in files:
-        ext = os.path.splitext(f.name)[1].lower() or ".jpg"
-        fname = f"{uuid.uuid4().hex}{ext}"
-        fpath = os.path.join(IMG_DIR, fname)
-        image = Image.open(f).convert("RGB")
-        image.save(fpath, quality=90)
-        saved.append((fpath, f.name))
-    return saved
-
-def save_uploaded_audios(files):
-    saved = []
-    for f in files:
-        ext = os.path.splitext(f.name)[1].lower() or ".mp3"
-        fname = f"{uuid.uuid4().hex}{ext}"
-        fpath = os.path.join(AUD_DIR, fname)
-        with open(fpath, "wb") as out:
-            out.write(f.read())
-        saved.append((fpath, f.name))
-    return saved
-
-def get_entries_with_files(conn, user_id, mood_key=None, q=None, tag=None):
-    rows = get_entries(conn, user_id, q=q, mood_key=mood_key, tag=tag)
-    data = []
-    c = conn.cursor()
-    for r in rows:
-        eid = r[0]
-        c.execute("SELECT kind, path, original_name FROM files WHERE entry_id=? ORDER BY id ASC", (eid,))
-        fs = c.fetchall()
-        data.append((r, fs))
-    return data
-
-# ================== 사용자 설정(테마) ==================
-def get_user_settings(conn, user_id):
-    c = conn.cursor()
-    c.execute("""
-        SELECT theme, primary, bg_style, font_scale
-        FROM user_settings WHERE user_id=?
-    """, (user_id,))
-    row = c.fetchone()
-    if not row:
-        return {"theme":"light", "primary":BASE_PALETTE["primary"], "bg_style":"pastel", "font_scale":"md"}
-    return {"theme":row[0], "primary":row[1], "bg_style":row[2], "font_scale":row[3]}
-
-def upsert_user_settings(conn, user_id, theme, primary, bg_style, font_scale):
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO user_settings(user_id, theme, primary, bg_style, font_scale, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            theme=excluded.theme,
-            primary=excluded.primary,
-            bg_style=excluded.bg_style,
-            font_scale=excluded.font_scale,
-            updated_at=excluded.updated_at
-    """, (user_id, theme, primary, bg_style, font_scale, datetime.utcnow().isoformat()))
-    conn.commit()
+
+# ================== 백그라운드 작업 ==================
+# 정기 스냅샷(프로세스당 하나)
+@st.cache_resource
+def start_snapshot_scheduler():
+    if repo.shard_dir:
+        return None     # 샤드 모드에서는 diary.db 가 없다(스냅샷은 파일 하나만 뜸)
+    scheduler = SnapshotScheduler(repo.db_path, BACKUP_DIR)
+    scheduler.start()
+    return scheduler
+
+@timed("save_uploads")
+def save_uploads(img_files, aud_files):
+    return repo.save_uploads(img_files, aud_files)
 
 # ================== 유틸 ==================
 def label_to_key(label: str) -> str:
@@ -264,6 +67,12 @@ def label_to_key(label: str) -> str:
 def key_to_label(key: str) -> str:
     return EMO_KEY_TO_LABEL.get(key, "EMOJI_7 보통")
 
+def snippet_html(snippet: str) -> str:
+    # 본문은 이스케이프하고 검색어 강조 표시만 <mark> 로 바꾼다
+    return (html.escape(snippet)
+            .replace(SNIPPET_START, "<mark>")
+            .replace(SNIPPET_END, "</mark>"))
+
 def build_css(theme: str, primary: str, bg_style: str, font_scale: str):
     # 글꼴 크기 스케일
     font_map = {"sm":"14px", "md":"16px", "lg":"18px"}
@@ -317,6 +126,7 @@ def build_css(theme: str, primary: str, bg_style: str, font_scale: str):
 
 # ================== 앱 시작/세션 ==================
 st.set_page_config(page_title=APP_TITLE, page_icon="EMOJI_8", layout="centered")
+begin_run("diary")
 st.title(APP_TITLE)
 
 if "user" not in st.session_state:
@@ -324,7 +134,102 @@ if "user" not in st.session_state:
 if "authed" not in st.session_state:
     st.session_state.authed = False
 
-conn = init_db()
+# 데이터 계층(연결 관리자 + 미디어 작업자)은 프로세스당 한 번만 열고 모든 세션이 공유
+@st.cache_resource
+def get_repo():
+    return DiaryRepository(DB_PATH, MEDIA_DIR, shard_dir=SHARD_DIR, shard_count=SHARD_COUNT).open()
+
+repo = get_repo()
+db = repo.db     # 샤드 모드에서는 사용자/로그인용 디렉터리 DB
+start_snapshot_scheduler()
+
+# 첨부는 브라우저가 캐시할 수 있는 서명 URL 로 따로 내보냄(다시 그릴 때 바이트를 보내지 않음).
+# 브라우저에서 닿는 주소(DIARY_MEDIA_URL)를 줬을 때만 쓰고, 아니면 예전처럼 파일을 직접 넘긴다.
+@st.cache_resource
+def start_media_server():
+    if not MEDIA_URL:
+        return None
+    try:
+        return MediaServer(repo.blob_dir, load_secret()).start()
+    except OSError:
+        return None     # 포트를 못 열면 예전처럼 파일을 직접 넘김
+
+media_server = start_media_server()
+
+def media_src(path, download_name=None):
+    url = media_server.url_for(path, download_name) if media_server else None
+    return url or path
+
+# 휴지통 비우기와 참조 끊긴 파일 정리는 요청 처리와 따로 백그라운드에서
+@st.cache_resource
+def start_trash_purger():
+    purger = TrashPurger(repo.all_dbs)
+    purger.start()
+    return purger
+
+purger = start_trash_purger()
+
+# 통계 탭: 읽기 연결에서 집계하고 차트까지 만들어 둔다(스크립트 스레드에서는 그리기만)
+def build_stats(db, user_id, today, primary):
+    mood_counts = pd.DataFrame(get_mood_counts(db, user_id), columns=["mood", "횟수"])
+    if mood_counts.empty:
+        return []
+    mood_counts["감정"] = mood_counts["mood"].map(key_to_label)
+    mood_counts = mood_counts.groupby("감정", as_index=False)["횟수"].sum()
+    charts = [alt.Chart(mood_counts).mark_bar(cornerRadiusTopLeft=6, cornerRadiusTopRight=6).encode(
+        x=alt.X("감정:N", sort="-y", title="감정"),
+        y=alt.Y("횟수:Q", title="작성 수"),
+        color=alt.Color("감정:N", scale=alt.Scale(range=[BASE_PALETTE["primary"], BASE_PALETTE["accent"], BASE_PALETTE["mint"], "#FF9EBB", "#C6B6F3", "#88D5D1"]))
+    )]
+
+    by_month = pd.DataFrame(get_monthly_stats(db, user_id), columns=["월", "count", "score_sum"])
+    charts.append(alt.Chart(by_month).mark_line(point=True, strokeWidth=3, color=primary).encode(
+        x=alt.X("월:N", title="월"),
+        y=alt.Y("count:Q", title="작성 수")
+    ))
+
+    # 최근 30일 평균 감정 강도
+    since = (date.fromisoformat(today) - timedelta(days=29)).isoformat()
+    daily = pd.DataFrame(get_daily_stats(db, user_id, since), columns=["날짜", "count", "score_sum"])
+    if not daily.empty:
+        daily["평균 강도"] = daily["score_sum"] / daily["count"]
+        charts.append(alt.Chart(daily).mark_line(point=True, strokeWidth=2, color=BASE_PALETTE["accent"]).encode(
+            x=alt.X("날짜:T", title="최근 30일"),
+            y=alt.Y("평균 강도:Q", title="평균 감정 강도", scale=alt.Scale(domain=[0, 5]))
+        ))
+    return charts
+
+@st.cache_resource
+def get_stats_worker():
+    return StatsWorker(repo.db_for, build_stats)
+
+stats_worker = get_stats_worker()
+
+# bcrypt 작업자 풀과 로그인 제한 기록도 모든 세션이 공유
+@st.cache_resource
+def get_auth():
+    return AuthService(db, load_secret(), register_user=repo.create_user)
+
+auth = get_auth()
+
+def client_ip():
+    # X-Forwarded-For 는 DIARY_TRUSTED_PROXY_HOPS 를 설정했을 때만 본다. 모르면 None(IP 별 제한 없음)
+    try:
+        return client_address(getattr(st.context, "ip_address", None), st.context.headers.get("X-Forwarded-For"))
+    except Exception:
+        return None
+
+def sign_in(user):
+    st.session_state.user = {"id": user[0], "email": user[1], "name": user[2]}
+    st.session_state.authed = True
+
+# 새로고침해도 주소의 세션 토큰으로 다시 로그인(비밀번호 검증 없이 서명만 확인)
+if not st.session_state.authed and "s" in st.query_params:
+    resumed = auth.resume(st.query_params["s"])
+    if resumed:
+        sign_in(resumed)
+    else:
+        del st.query_params["s"]
 
 # ================== 인증 뷰 ==================
 def auth_view():
@@ -336,20 +241,21 @@ def auth_view():
         password = st.text_input("비밀번호", type="password", key="login_pw")
         col1, col2 = st.columns(2)
         if col1.button("로그인", type="primary", use_container_width=True, key="login_btn"):
-            user = get_user_by_email(conn, (email or "").strip())
-            ok = False
-            if user:
-                try:
-                    ok = bcrypt.verify(password, user[3])
-                except Exception:
-                    ok = False
-            if ok:
-                st.session_state.user = {"id": user[0], "email": user[1], "name": user[2]}
-                st.session_state.authed = True
-                st.success("환영합니다!")
-                st.rerun()
+            user = None
+            try:
+                user = auth.login((email or "").strip(), password or "", client_ip())
+            except LoginThrottled as e:
+                st.error(f"로그인 실패가 너무 많습니다. {e}")
+            except AuthBusy as e:
+                st.warning(str(e))
             else:
-                st.error("이메일 또는 비밀번호가 올바르지 않습니다.")
+                if user:
+                    sign_in(user)
+                    st.query_params["s"] = auth.issue_token(user)
+                    st.success("환영합니다!")
+                    st.rerun()
+                else:
+                    st.error("이메일 또는 비밀번호가 올바르지 않습니다.")
         if col2.button("초기화", use_container_width=True, key="login_reset"):
             st.rerun()
 
@@ -373,17 +279,19 @@ def auth_view():
                     st.warning("약관에 동의해 주세요.")
                 else:
                     try:
-                        create_user(conn, email_s.strip(), (name_s or "").strip(), pw1)
+                        auth.register(email_s.strip(), (name_s or "").strip(), pw1)
                         st.success("회원가입이 완료되었습니다. 상단의 '로그인' 탭에서 로그인해 주세요.")
                         for k in ["email_s", "name_s", "pw1", "pw2", "tos_agree"]:
                             if k in st.session_state:
                                 del st.session_state[k]
                     except sqlite3.IntegrityError:
                         st.error("이미 존재하는 이메일입니다.")
+                    except AuthBusy as e:
+                        st.warning(str(e))
 
 # ================== 테마 설정 사이드바 ==================
 def theme_sidebar(user_id):
-    settings = get_user_settings(conn, user_id)
+    settings = repo.get_settings(user_id)
 
     with st.sidebar:
         st.markdown("설정")
@@ -417,12 +325,12 @@ def theme_sidebar(user_id):
 
         colA, colB = st.columns(2)
         if colA.button("저장", type="primary", use_container_width=True, key="save_theme_btn"):
-            upsert_user_settings(conn, user_id, theme=theme, primary=primary,
+            repo.save_settings(user_id, theme=theme, primary=primary,
                                  bg_style=bg_style, font_scale=font_names[font_sel])
             st.success("테마가 저장되고 적용되었습니다.")
             st.rerun()
         if colB.button("리셋", use_container_width=True, key="reset_theme_btn"):
-            upsert_user_settings(conn, user_id, theme="light", primary=BASE_PALETTE["primary"],
+            repo.save_settings(user_id, theme="light", primary=BASE_PALETTE["primary"],
                                  bg_style="pastel", font_scale="md")
             st.info("기본 테마로 돌아갔습니다.")
             st.rerun()
@@ -430,6 +338,7 @@ def theme_sidebar(user_id):
         st.markdown("---")
 
 # ================== 메인 뷰 ==================
+@timed("main_view")
 def main_view():
     user = st.session_state.user
 
@@ -437,8 +346,10 @@ def main_view():
     with st.sidebar:
         st.markdown(f"안녕하세요, {user.get('name') or user['email']}님!")
         if st.button("로그아웃", key="logout_btn"):
+            auth.logout(user["id"])     # 주소나 기록에 남은 토큰도 더는 쓸 수 없게
             st.session_state.user = None
             st.session_state.authed = False
+            st.query_params.clear()
             st.rerun()
         st.markdown("---")
 
@@ -446,7 +357,7 @@ def main_view():
     theme_sidebar(user["id"])
 
     # 현재 사용자 테마 로드 후 CSS 적용
-    s = get_user_settings(conn, user["id"])
+    s = repo.get_settings(user["id"])
     st.markdown(build_css(theme=s["theme"], primary=s["primary"],
                           bg_style=s["bg_style"], font_scale=s["font_scale"]),
                 unsafe_allow_html=True)
@@ -454,7 +365,7 @@ def main_view():
     tab_write, tab_list, tab_stats, tab_backup = st.tabs(["작성하기", "목록/검색", "통계", "백업"])
 
     # 작성하기
-    with tab_write:
+    with tab_write, span("tab.write"):
         st.subheader("오늘의 일기 작성")
         c1, c2 = st.columns(2)
         d = c1.date_input("날짜", value=date.today(), key="write_date")
@@ -462,6 +373,11 @@ def main_view():
         mood_key = label_to_key(mood_label)
         mood_score = st.slider("감정 강도(선택)", 1, 5, 3, key="write_score")
         tags = st.text_input("태그 (쉼표로 구분)", placeholder="공부, 개발, 일상", key="write_tags")
+        # 자주 쓴 태그 자동완성: 마지막으로 입력 중인 단어로 시작하는 태그를 추천
+        typed = parse_tags(tags)
+        last = tags.rsplit(",", 1)[-1].strip().lstrip("#") if tags and not tags.rstrip().endswith(",") else ""
+        suggestions = [t for t, _ in repo.suggest_tags(user["id"], prefix=last) if t not in typed]
+        picked = st.multiselect("자주 쓰는 태그", suggestions, key="write_tag_picks") if suggestions else []
         content = st.text_area("내용", height=200, placeholder="오늘 있었던 일들을 적어보세요...", key="write_content")
 
         st.markdown("첨부 파일")
@@ -470,29 +386,42 @@ def main_view():
 
         if st.button("저장", type="primary", use_container_width=True, key="save_entry_btn"):
             if (content and content.strip()) or img_files or aud_files:
-                eid = insert_entry(conn, user["id"], d.isoformat(), mood_key, mood_score, tags, content)
-                if img_files:
-                    for fpath, oname in save_uploaded_images(img_files):
-                        insert_file(conn, eid, "image", fpath, oname)
-                if aud_files:
-                    for fpath, oname in save_uploaded_audios(aud_files):
-                        insert_file(conn, eid, "audio", fpath, oname)
-                st.success("일기가 저장되었습니다!")
-                st.rerun()
+                if picked:
+                    tags = ", ".join(parse_tags(", ".join([tags] + picked)))
+                try:
+                    images, audios = save_uploads(img_files, aud_files)
+                except (UploadTooLarge, BadImage) as e:
+                    st.error(str(e))
+                except OSError as e:
+                    st.error(f"첨부 파일을 저장하지 못했습니다: {e}")
+                else:
+                    repo.save_entry(user["id"], d.isoformat(), mood_key, mood_score, tags, content, images, audios)
+                    st.success("일기가 저장되었습니다!")
+                    st.rerun()
             else:
                 st.warning("내용 또는 첨부 파일을 추가해 주세요.")
 
     # 목록/검색
-    with tab_list:
+    with tab_list, span("tab.list"):
         st.subheader("목록/검색")
         with st.expander("검색/필터", expanded=True):
             q = st.text_input("키워드 검색", placeholder="내용 또는 태그", key="filter_q")
             c1, c2 = st.columns(2)
             mood_filter_label = c1.selectbox("감정 필터", ["(전체)"] + EMO_LABELS, key="filter_mood_label")
-            tag_f = c2.text_input("태그 포함", placeholder="예: 개발", key="filter_tag")
+            tag_f = c2.text_input("태그", placeholder="예: 개발", key="filter_tag")
+            tag_prefix = c2.checkbox("태그 앞부분 일치(개발 → 개발자)", key="filter_tag_prefix")
+            tag_f = tag_f.strip().lstrip("#") if tag_f else None
             mood_val = None if mood_filter_label == "(전체)" else label_to_key(mood_filter_label)
 
-        items = get_entries_with_files(conn, user["id"], mood_key=mood_val, q=q, tag=tag_f if tag_f else None)
+        # 한 번에 PAGE_SIZE 개만 불러와 그린다. 필터가 바뀌면 첫 페이지로.
+        # 검색어가 있으면 관련도(BM25) 순으로 보여주고 일치 구간을 강조
+        filter_sig = (q, mood_val, tag_f, tag_prefix)
+        if st.session_state.get("list_filter") != filter_sig:
+            st.session_state.list_filter = filter_sig
+            st.session_state.list_cursors = [None]
+        cursors = st.session_state.list_cursors
+        items, snippets, next_cursor = repo.entries_page(user["id"], q=q, mood_key=mood_val,
+                                                        tag=tag_f, tag_prefix=tag_prefix, cursor=cursors[-1])
 
         if not items:
             st.info("일기가 없거나 조건에 맞는 결과가 없어요.")
@@ -502,29 +431,54 @@ def main_view():
                 st.markdown('<div class="card">', unsafe_allow_html=True)
                 st.write(f"{d_} · <span class='emotion-badge'>{mood_label_saved}</span> · 강도 {score_}/5", unsafe_allow_html=True)
                 if tags_:
-                    for t in [t.strip() for t in tags_.split(",") if t.strip()]:
+                    for t in parse_tags(tags_):
                         st.markdown(f"<span class='chip'>#{t}</span>", unsafe_allow_html=True)
-                if content_:
+                if id_ in snippets:
+                    st.markdown(f"<div>{snippet_html(snippets[id_])}</div>", unsafe_allow_html=True)
+                    with st.expander("전체 내용"):
+                        st.write(content_)
+                elif content_:
                     st.write(content_)
 
                 img_cols = st.columns(3)
                 img_i = 0
-                for kind, path, oname in files_:
+                for kind, path, oname, thumb, preview in files_:
                     if kind == "image":
                         if img_i < 3:
                             with img_cols[img_i % 3]:
-                                st.image(path, use_column_width=True)
+                                # 격자에는 썸네일만, 원본은 눌렀을 때만 불러옴
+                                if st.session_state.get(f"orig_{id_}_{img_i}", False):
+                                    st.image(media_src(preview or path), use_column_width=True)
+                                    orig_url = media_src(path, oname)
+                                    if orig_url != path:
+                                        st.link_button("원본 받기", orig_url)
+                                    else:
+                                        with open(path, "rb") as fh:
+                                            st.download_button("원본 받기", data=fh.read(),
+                                                               file_name=oname, key=f"orig_dl_{id_}_{img_i}")
+                                else:
+                                    st.image(media_src(thumb or path), use_column_width=True)
+                                st.checkbox("크게 보기", key=f"orig_{id_}_{img_i}")
                             img_i += 1
                     elif kind == "audio":
-                        st.audio(path)
+                        st.audio(media_src(path))
+
+                # 비슷한 일기는 펼쳤을 때만 계산
+                if st.checkbox("비슷한 일기", key=f"sim_{id_}"):
+                    related = repo.related_entries(user["id"], id_)
+                    if not related:
+                        st.caption("비슷한 일기가 아직 없어요.")
+                    for (r_id, r_d, r_mood, _, _, r_content, _), r_score in related:
+                        r_text = (r_content or "").strip().replace("\n", " ")
+                        st.caption(f"{r_d} · {key_to_label(r_mood)} · {r_text[:40]}"
+                                   + ("…" if len(r_text) > 40 else "") + f" · 유사도 {r_score:.0%}")
 
                 e1, e2 = st.columns([1,1])
                 if e1.button("수정", key=f"edit_{id_}"):
                     st.session_state[f"editing_{id_}"] = True
                 if e2.button("삭제", key=f"del_{id_}"):
-                    delete_files_of_entry(conn, id_, user["id"])
-                    delete_entry(conn, id_, user["id"])
-                    st.success("삭제되었습니다.")
+                    repo.delete_entry(id_, user["id"])
+                    st.success("휴지통으로 옮겼습니다.")
                     st.rerun()
 
                 if st.session_state.get(f"editing_{id_}", False):
@@ -539,7 +493,7 @@ def main_view():
                     ed_c = st.text_area("내용", value=content_ or "", key=f"ed_c_{id_}")
                     s1, s2 = st.columns(2)
                     if s1.button("저장", key=f"save_{id_}"):
-                        update_entry(conn, id_, user["id"], ed_d.isoformat(), ed_key, ed_s, ed_t, ed_c)
+                        repo.update_entry(id_, user["id"], ed_d.isoformat(), ed_key, ed_s, ed_t, ed_c)
                         st.session_state[f"editing_{id_}"] = False
                         st.success("수정되었습니다.")
                         st.rerun()
@@ -548,45 +502,132 @@ def main_view():
                         st.info("취소했습니다.")
                 st.markdown('</div>', unsafe_allow_html=True)
 
+        if len(cursors) > 1 or next_cursor is not None:
+            p1, p2, p3 = st.columns([1, 1, 1])
+            if len(cursors) > 1 and p1.button("← 최근 일기", key="page_prev", use_container_width=True):
+                cursors.pop()
+                st.rerun()
+            p2.caption(f"{len(cursors)} 페이지")
+            if next_cursor is not None and p3.button("더 보기 →", key="page_next", use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+
+        with st.expander("비슷한 일기 찾기"):
+            sim_text = st.text_area("이런 내용의 일기", key="sim_text", placeholder="문장이나 낱말을 적어 보세요")
+            if st.button("찾기", key="sim_find") and sim_text.strip():
+                hits = repo.find_similar(user["id"], sim_text)
+                if not hits:
+                    st.info("비슷한 일기를 찾지 못했어요.")
+                for (r_id, r_d, r_mood, _, r_tags, r_content, _), r_score in hits:
+                    r_text = (r_content or "").strip().replace("\n", " ")
+                    st.write(f"{r_d} · {key_to_label(r_mood)} · {r_text[:60]}"
+                             + ("…" if len(r_text) > 60 else "") + f" · 유사도 {r_score:.0%}")
+
+        trash = repo.trash(user["id"])
+        with st.expander(f"휴지통 ({len(trash)})"):
+            st.caption(f"지운 일기는 {TRASH_RETENTION_DAYS}일 동안 보관된 뒤 자동으로 완전히 삭제됩니다.")
+            for id_, d_, mood_key_saved, tags_, content_, deleted_at in trash:
+                t1, t2, t3 = st.columns([4, 1, 1])
+                preview_text = (content_ or "").strip().replace("\n", " ")
+                t1.write(f"{d_} · {key_to_label(mood_key_saved)} · {preview_text[:40]}"
+                         + ("…" if len(preview_text) > 40 else ""))
+                if t2.button("복원", key=f"restore_{id_}"):
+                    repo.restore_entry(id_, user["id"])
+                    st.rerun()
+                if t3.button("영구 삭제", key=f"purge_{id_}"):
+                    repo.purge_entry(id_, user["id"])
+                    purger.wake()
+                    st.rerun()
+
     # 통계
-    with tab_stats:
+    with tab_stats, span("tab.stats"):
         st.subheader("감정 통계")
-        df = pd.read_sql_query("SELECT d, mood, mood_score FROM entries WHERE user_id=?", conn, params=(user["id"],))
-        if df.empty:
+        # 작업 스레드가 만든 마지막 결과를 바로 그린다. 데이터가 바뀌었으면 뒤에서 다시 계산 중.
+        charts, fresh = stats_worker.get(user["id"], date.today().isoformat(), s["primary"])
+        if charts is None:
+            st.info("통계를 계산하는 중이에요. 잠시 후 다시 열어 주세요.")
+        elif not charts:
             st.info("통계를 보여줄 데이터가 아직 없어요.")
         else:
-            df["mood_label"] = df["mood"].map(key_to_label)
-            mood_counts = df["mood_label"].value_counts().reset_index()
-            mood_counts.columns = ["감정", "횟수"]
-            chart = alt.Chart(mood_counts).mark_bar(cornerRadiusTopLeft=6, cornerRadiusTopRight=6).encode(
-                x=alt.X("감정:N", sort="-y", title="감정"),
-                y=alt.Y("횟수:Q", title="작성 수"),
-                color=alt.Color("감정:N", scale=alt.Scale(range=[BASE_PALETTE["primary"], BASE_PALETTE["accent"], BASE_PALETTE["mint"], "#FF9EBB", "#C6B6F3", "#88D5D1"]))
-            )
-            st.altair_chart(chart, use_container_width=True)
-
-            df["d"] = pd.to_datetime(df["d"])
-            by_month = df.groupby(df["d"].dt.to_period("M")).size().reset_index(name="count")
-            by_month["월"] = by_month["d"].astype(str)
-            line = alt.Chart(by_month).mark_line(point=True, strokeWidth=3, color=s["primary"]).encode(
-                x=alt.X("월:N", title="월"),
-                y=alt.Y("count:Q", title="작성 수")
-            )
-            st.altair_chart(line, use_container_width=True)
+            if not fresh:
+                st.caption("최근 변경을 반영하는 중이에요.")
+            for chart in charts:
+                st.altair_chart(chart, use_container_width=True)
 
     # 백업
-    with tab_backup:
+    with tab_backup, span("tab.backup"):
         st.subheader("백업")
-        st.caption("데이터베이스 파일은 로컬에 저장됩니다. 아래 버튼으로 DB를 내려받을 수 있어요.")
-        if os.path.exists(DB_PATH):
-            with open(DB_PATH, "rb") as f:
-                st.download_button("DB 백업 다운로드(diary_backup.db)", data=f,
-                                   file_name="diary_backup.db", mime="application/octet-stream")
+        if repo.shard_dir:
+            # 스냅샷은 DB 파일 하나만 뜬다. 샤드 모드의 데이터는 여러 파일에 나뉘어 있어 아직 지원하지 않음
+            st.info("샤드 모드에서는 앱에서 백업을 만들 수 없어요. 디렉터리와 샤드 파일을 함께 백업해 주세요.")
         else:
-            st.info("DB 파일이 아직 생성되지 않았습니다. 먼저 일기를 한 번 저장해 보세요.")
+            st.caption("쓰는 중에도 한 시점의 DB 스냅샷을 떠서 압축해 내려받을 수 있어요.")
+            if st.button("백업 파일 만들기", key="make_backup_btn"):
+                old_path = st.session_state.get("backup_path")
+                if old_path and os.path.exists(old_path):
+                    os.remove(old_path)
+                with st.spinner("스냅샷을 만드는 중..."):
+                    st.session_state.backup_path = compressed_snapshot(
+                        repo.db_path, tempfile.gettempdir(),
+                        name=f"diary-backup-{uuid.uuid4().hex}.db.gz")
+            backup_path = st.session_state.get("backup_path")
+            if backup_path and os.path.exists(backup_path):
+                with open(backup_path, "rb") as f:
+                    st.download_button(f"DB 백업 다운로드(diary_backup.db.gz, {os.path.getsize(backup_path) / 1e6:.1f}MB)",
+                                       data=f, file_name="diary_backup.db.gz", mime="application/gzip")
+
+            snaps = list_snapshots(BACKUP_DIR)
+            if snaps:
+                latest = datetime.fromtimestamp(os.path.getmtime(snaps[-1])).strftime("%Y-%m-%d %H:%M")
+                st.caption(f"자동 스냅샷 {len(snaps)}개 보관 중 · 최근 {latest} ({BACKUP_DIR}/)")
+
+        st.markdown("---")
+        st.subheader("일기 가져오기")
+        st.caption("다른 일기 앱에서 내보낸 JSON Lines/CSV(열: d, mood, mood_score, tags, content, files)와 "
+                   "첨부 파일을 묶은 zip 을 올려 주세요. 중간에 끊겨도 같은 파일을 다시 올리면 이어서 가져옵니다.")
+        src_file = st.file_uploader("일기 파일", type=["jsonl", "json", "csv"], key="import_src")
+        media_zip = st.file_uploader("첨부 파일 zip(선택)", type=["zip"], key="import_media")
+        batch_size = st.number_input("한 번에 저장할 일기 수", 50, 5000, IMPORT_BATCH, step=50, key="import_batch")
+        if src_file and st.button("가져오기", type="primary", key="import_btn"):
+            with tempfile.TemporaryDirectory() as work:
+                src_path = os.path.join(work, "source" + os.path.splitext(src_file.name)[1].lower())
+                with open(src_path, "wb") as out:
+                    out.write(src_file.getbuffer())
+                media_dir = None
+                result = None
+                try:
+                    if media_zip:
+                        media_dir = os.path.join(work, "media")
+                        with zipfile.ZipFile(media_zip) as zf:
+                            zf.extractall(media_dir)
+                except (zipfile.BadZipFile, OSError) as e:
+                    st.error(f"첨부 파일 zip 을 풀지 못했습니다: {e}")
+                else:
+                    bar = st.progress(0.0, text="가져오는 중...")
+                    try:
+                        result = import_entries(
+                            repo.db_for(user["id"]), user["id"], src_path, media_dir, int(batch_size),
+                            pool=repo.media_pool, staging_dir=repo.staging_dir,
+                            progress=lambda done, total: bar.progress(done / total if total else 1.0,
+                                                                      text=f"{done}/{total}"))
+                    except ImportAborted as e:
+                        st.error(f"가져오기를 멈췄습니다. {e}")
+                        st.info(f"{e.committed}번째 기록까지는 저장되었습니다. 문제를 고친 뒤 같은 파일을 "
+                                "다시 올리면 저장된 부분은 건너뛰고 이어서 가져옵니다.")
+                    except Exception as e:
+                        st.error(f"가져오기에 실패했습니다: {e}")
+                        st.info("이미 저장된 묶음은 그대로 남아 있어, 같은 파일을 다시 올리면 이어서 가져옵니다.")
+            if result:
+                st.success(f"일기 {result['imported']}개, 첨부 {result['files']}개를 가져왔습니다."
+                           + (f" (이전에 가져온 {result['skipped']}개는 건너뜀)" if result["skipped"] else ""))
+                if result["errors"]:
+                    st.warning(f"{len(result['errors'])}개 기록은 형식 오류로 건너뛰었습니다.")
+                    st.dataframe(pd.DataFrame(result["errors"], columns=["순번", "사유"]), hide_index=True)
 
 # ================== 라우팅 ==================
 if not st.session_state.authed or not st.session_state.user:
     auth_view()
 else:
     main_view()
+
+debug_sidebar(st, "diary")
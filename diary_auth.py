@@ -0,0 +1,233 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import bcrypt
+
+from diary_db import (change_password_hash, create_user, get_session_gen, get_user_by_email, get_user_by_id,
+                      revoke_sessions, update_password_hash)
+
+# ================== 공통 상수 ==================
+BCRYPT_ROUNDS = int(os.environ.get("DIARY_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = 2           # 동시에 도는 bcrypt 작업 수
+MAX_PENDING = 16           # 대기 중인 해시 작업이 이보다 많으면 바로 거절
+SECRET_PATH = ".diary_secret"
+TOKEN_TTL_S = 7 * 24 * 3600
+
+# (시도 창 길이, 창 안에서 허용하는 실패 수)
+THROTTLE_WINDOW_S = 15 * 60
+MAX_FAILS_PER_EMAIL = 5
+MAX_FAILS_PER_IP = 30
+THROTTLE_PRUNE_EVERY = 1000    # 실패를 이만큼 기록할 때마다 창이 지난 키를 모두 지운다
+THROTTLE_MAX_KEYS = 100_000    # 기억하는 키 수 상한. 넘으면 가장 오래 실패가 없던 키부터 잊는다
+# 앞에 둔 리버스 프록시 수. 0 이면 X-Forwarded-For 를 믿지 않는다(누구나 바꿔 보낼 수 있음).
+TRUSTED_PROXY_HOPS = int(os.environ.get("DIARY_TRUSTED_PROXY_HOPS", "0"))
+
+class AuthError(Exception):
+    pass
+
+class AuthBusy(AuthError):
+    pass
+
+class LoginThrottled(AuthError):
+    def __init__(self, retry_after):
+        super().__init__(f"{int(retry_after) + 1}초 뒤에 다시 시도해 주세요.")
+        self.retry_after = retry_after
+
+def load_secret(path=SECRET_PATH):
+    # 환경 변수가 없으면 처음 한 번 만들어 파일로 보관
+    env = os.environ.get("DIARY_SECRET")
+    if env:
+        return env.encode()
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    key = secrets.token_bytes(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+# ================== 로그인 제한 ==================
+def client_address(peer, forwarded_for=None, trusted_hops=TRUSTED_PROXY_HOPS):
+    """로그인 제한에 쓸 접속 주소. 모르면 None.
+
+    trusted_hops 개의 프록시 뒤라면 X-Forwarded-For 에서 가장 바깥 프록시가 붙인 주소
+    (오른쪽에서 trusted_hops 번째)를 쓴다. 그보다 왼쪽 값은 클라이언트가 마음대로 넣을 수 있다.
+    """
+    if trusted_hops > 0 and forwarded_for:
+        hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+        if len(hops) >= trusted_hops:
+            return hops[-trusted_hops]
+    return peer or None
+
+class LoginThrottle:
+    """키(이메일, IP)별로 최근 window_s 안의 실패 시각을 세는 슬라이딩 윈도.
+
+    다시 오지 않는 키(무작위 이메일로 찔러 보는 경우)가 쌓이지 않도록 prune_every 번 실패를
+    기록할 때마다 전체를 정리하고, 그래도 max_keys 를 넘으면 가장 오래 조용했던 키를 버린다.
+    """
+
+    def __init__(self, window_s=THROTTLE_WINDOW_S, prune_every=THROTTLE_PRUNE_EVERY, max_keys=THROTTLE_MAX_KEYS):
+        self.window_s = window_s
+        self.prune_every = prune_every
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._fails = OrderedDict()     # 키 -> 실패 시각 deque (마지막으로 실패한 키가 끝)
+        self._since_prune = 0
+
+    def _trim(self, key, now):
+        q = self._fails.get(key)
+        if q is None:
+            return ()
+        while q and now - q[0] > self.window_s:
+            q.popleft()
+        if not q:
+            del self._fails[key]
+        return q
+
+    def _prune(self, now):
+        for key in list(self._fails):
+            self._trim(key, now)
+        while len(self._fails) > self.max_keys:
+            self._fails.popitem(last=False)
+
+    def retry_after(self, key, limit):
+        now = time.monotonic()
+        with self._lock:
+            q = self._trim(key, now)
+            if len(q) < limit:
+                return 0
+            return self.window_s - (now - q[len(q) - limit])
+
+    def record_failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            q = self._fails.get(key)
+            if q is None:
+                q = self._fails[key] = deque()
+            else:
+                self._fails.move_to_end(key)
+            q.append(now)
+            self._since_prune += 1
+            if self._since_prune >= self.prune_every or len(self._fails) > self.max_keys:
+                self._since_prune = 0
+                self._prune(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._fails.pop(key, None)
+
+# ================== 인증 ==================
+class AuthService:
+    """비밀번호 해시/검증을 정해진 수의 작업자 스레드에서 처리하는 인증 서비스.
+
+    bcrypt 는 계산 중 GIL 을 놓으므로 다른 세션의 스크립트는 계속 돈다.
+    로그인이 몰려도 동시에 도는 bcrypt 는 HASH_WORKERS 개, 대기는 MAX_PENDING 개까지다.
+    """
+
+    def __init__(self, db, secret, rounds=BCRYPT_ROUNDS,
+                 workers=HASH_WORKERS, max_pending=MAX_PENDING, token_ttl_s=TOKEN_TTL_S, register_user=None):
+        self.db = db
+        # 샤드 모드에서는 저장소가 디렉터리와 샤드에 사용자를 만든다
+        self.register_user = register_user or (lambda email, name, pw_hash: create_user(db, email, name, pw_hash))
+        self.secret = secret
+        self.token_ttl_s = token_ttl_s
+        # 설정보다 약한 해시는 로그인 때 다시 만든다
+        self.hasher = bcrypt.using(rounds=rounds, min_desired_rounds=rounds)
+        self.throttle = LoginThrottle()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # 없는 이메일도 같은 시간이 걸리도록 검증에 쓰는 해시
+        self._dummy_hash = self.hasher.hash(secrets.token_hex(8))
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusy("로그인 요청이 많습니다. 잠시 후 다시 시도해 주세요.")
+        fut = self._pool.submit(fn, *args)
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def _verify(self, password, pw_hash):
+        try:
+            return self.hasher.verify(password, pw_hash)
+        except (ValueError, TypeError):
+            return False
+
+    def register(self, email, name, password):
+        pw_hash = self._submit(self.hasher.hash, password).result()
+        return self.register_user(email, name, pw_hash)
+
+    def login(self, email, password, ip=None):
+        """성공하면 (id, email, name, password_hash), 틀리면 None.
+
+        제한에 걸리면 LoginThrottled, 대기열이 꽉 차면 AuthBusy 를 던진다.
+        ip 를 모르면(None) IP 별 제한은 건너뛰고 계정별 제한만 쓴다
+        (모든 방문자가 한 칸을 나눠 쓰면 남의 실패로 모두가 막힌다).
+        """
+        email_key = "email:" + email.lower()
+        ip_key = "ip:" + ip if ip else None
+        wait_s = max(self.throttle.retry_after(email_key, MAX_FAILS_PER_EMAIL),
+                     self.throttle.retry_after(ip_key, MAX_FAILS_PER_IP) if ip_key else 0)
+        if wait_s > 0:
+            raise LoginThrottled(wait_s)
+
+        user = get_user_by_email(self.db, email)
+        ok = self._submit(self._verify, password, user[3] if user else self._dummy_hash).result()
+        if not (user and ok):
+            self.throttle.record_failure(email_key)
+            if ip_key:
+                self.throttle.record_failure(ip_key)
+            return None
+        self.throttle.reset(email_key)
+        if self.hasher.needs_update(user[3]):
+            # 응답은 기다리지 않고 뒤에서 새 비용으로 다시 해시
+            try:
+                fut = self._submit(self.hasher.hash, password)
+                fut.add_done_callback(
+                    lambda f: f.exception() is None and update_password_hash(self.db, user[0], f.result(), user[3]))
+            except AuthBusy:
+                pass
+        return user
+
+    def change_password(self, user_id, password):
+        # 새 해시를 저장하고 이 사용자의 기존 세션 토큰을 모두 끊는다(계속 쓰려면 issue_token 으로 새로 받음)
+        pw_hash = self._submit(self.hasher.hash, password).result()
+        change_password_hash(self.db, user_id, pw_hash)
+
+    # ================== 세션 토큰 ==================
+    # "<user_id>:<세대>:<만료 시각>.<서명>" (base64url). 로그인 직후 뒤에서 다시 해시해도
+    # 토큰이 깨지지 않도록 서명에는 비밀번호 해시를 섞지 않는다. 대신 users.session_gen 을
+    # 넣어 두고, 로그아웃/비밀번호 변경 때 세대를 올려 이전 토큰(주소에 남은 것 포함)을 무효로 한다.
+    def _sign(self, payload):
+        mac = hmac.new(self.secret, payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac).rstrip(b"=").decode()
+
+    def issue_token(self, user):
+        payload = f"{user[0]}:{get_session_gen(self.db, user[0])}:{int(time.time()) + self.token_ttl_s}"
+        body = base64.urlsafe_b64encode(payload.encode()).rstrip(b"=").decode()
+        return f"{body}.{self._sign(payload)}"
+
+    def resume(self, token):
+        # 유효한 토큰이면 사용자 행, 아니면 None (bcrypt 검증 없이)
+        try:
+            body, sig = token.split(".", 1)
+            payload = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)).decode()
+            user_id, gen, exp = (int(x) for x in payload.split(":"))
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if exp < time.time() or not hmac.compare_digest(sig, self._sign(payload)):
+            return None
+        if get_session_gen(self.db, user_id) != gen:
+            return None     # 로그아웃했거나 비밀번호가 바뀜
+        return get_user_by_id(self.db, user_id)
+
+    def logout(self, user_id):
+        # 이 사용자에게 발급한 모든 세션 토큰을 끊는다
+        revoke_sessions(self.db, user_id)
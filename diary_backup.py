@@ -0,0 +1,336 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+from diary_db import DB_PATH, TRACKED_TABLES, init_db, make_conn, sync_entry_tags
+
+# ================== 공통 상수 ==================
+BACKUP_DIR = "backups"
+STEP_PAGES = 1024                  # backup() 한 번에 복사할 페이지 수
+KEEP_SNAPSHOTS = 7                 # 정기 스냅샷 보관 개수
+SNAPSHOT_INTERVAL_S = 6 * 3600     # 정기 스냅샷 간격
+SNAPSHOT_PREFIX = "diary-"
+SNAPSHOT_SUFFIX = ".db.gz"
+
+CHAIN_DIR = os.path.join(BACKUP_DIR, "chain")   # 전체 백업 + 증분 백업 묶음
+OVERLAP_S = 60     # 직전 워터마크보다 이만큼 앞부터 다시 내보냄(커밋이 늦은 쓰기 대비)
+
+# ================== 스냅샷 ==================
+def _pin(src):
+    # 읽기 트랜잭션을 열어 이후 읽기를 한 시점으로 고정(WAL 이라 쓰기는 막지 않음)
+    src.execute("BEGIN")
+    src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+def _copy_pinned(src, dest_path, step_pages=STEP_PAGES, progress=None):
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=step_pages, progress=progress)
+    finally:
+        dst.close()
+
+def snapshot(db_path, dest_path, step_pages=STEP_PAGES, progress=None):
+    """db_path 의 한 시점 내용을 dest_path 에 SQLite 파일로 복사한다.
+
+    먼저 읽기 트랜잭션을 열어 시점을 고정하므로, 복사 도중 다른 세션이
+    써도 처음부터 다시 복사하지 않는다. WAL 모드라 쓰기는 막히지 않고,
+    아직 체크포인트되지 않은 WAL 내용도 스냅샷에 포함된다.
+    """
+    # 없는 경로를 열면 sqlite3 가 빈 DB 를 새로 만들어 데이터 없는 "백업"이 된다
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"백업할 DB 가 없습니다: {db_path}")
+    src = sqlite3.connect(db_path)
+    try:
+        _pin(src)
+        _copy_pinned(src, dest_path, step_pages, progress)
+        src.rollback()
+    finally:
+        src.close()
+    return dest_path
+
+def compressed_snapshot(db_path=DB_PATH, out_dir=BACKUP_DIR, name=None):
+    # 임시 파일에 스냅샷을 뜬 뒤 gzip 으로 묶어 out_dir 에 둔다. 최종 경로를 돌려준다.
+    os.makedirs(out_dir, exist_ok=True)
+    name = name or SNAPSHOT_PREFIX + datetime.now().strftime("%Y%m%d-%H%M%S") + SNAPSHOT_SUFFIX
+    final_path = os.path.join(out_dir, name)
+    raw_path = final_path + ".tmp-db"
+    gz_path = final_path + ".tmp"
+    try:
+        snapshot(db_path, raw_path)
+        with open(raw_path, "rb") as src, gzip.open(gz_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(gz_path, final_path)
+    finally:
+        for p in (raw_path, gz_path):
+            if os.path.exists(p):
+                os.remove(p)
+    return final_path
+
+def list_snapshots(out_dir=BACKUP_DIR):
+    # 오래된 것부터
+    if not os.path.isdir(out_dir):
+        return []
+    names = sorted(n for n in os.listdir(out_dir)
+                   if n.startswith(SNAPSHOT_PREFIX) and n.endswith(SNAPSHOT_SUFFIX))
+    return [os.path.join(out_dir, n) for n in names]
+
+def rotate_snapshots(out_dir=BACKUP_DIR, keep=KEEP_SNAPSHOTS):
+    removed = []
+    for path in list_snapshots(out_dir)[:-keep or None]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+# ================== 정기 스냅샷 ==================
+class SnapshotScheduler(threading.Thread):
+    """interval_s 마다 압축 스냅샷을 만들고 최근 keep 개만 남기는 백그라운드 스레드."""
+
+    def __init__(self, db_path=DB_PATH, out_dir=BACKUP_DIR,
+                 interval_s=SNAPSHOT_INTERVAL_S, keep=KEEP_SNAPSHOTS):
+        super().__init__(name="diary-snapshots", daemon=True)
+        self.db_path = db_path
+        self.out_dir = out_dir
+        self.interval_s = interval_s
+        self.keep = keep
+        self.last_error = None
+        self._stop_event = threading.Event()
+
+    def _due_in(self):
+        snaps = list_snapshots(self.out_dir)
+        if not snaps:
+            return 0
+        return max(0, self.interval_s - (time.time() - os.path.getmtime(snaps[-1])))
+
+    def run(self):
+        while not self._stop_event.wait(self._due_in()):
+            try:
+                compressed_snapshot(self.db_path, self.out_dir)
+                rotate_snapshots(self.out_dir, self.keep)
+                self.last_error = None
+            except Exception as e:
+                # 다음 주기에 다시 시도
+                self.last_error = e
+                if self._stop_event.wait(min(self.interval_s, 300)):
+                    break
+
+    def stop(self):
+        self._stop_event.set()
+
+# ================== 증분 백업 ==================
+# CHAIN_DIR 에 0000-full-....zip, 0001-incr-....zip 처럼 순서대로 쌓인다.
+# full: diary.db 스냅샷 + 모든 미디어 / incr: 워터마크 이후 바뀐 행, 삭제 기록, 새 미디어
+# 모든 묶음의 manifest.json 에 until(다음 증분의 워터마크)이 기록된다.
+def list_chain(chain_dir=CHAIN_DIR):
+    if not os.path.isdir(chain_dir):
+        return []
+    return [os.path.join(chain_dir, n) for n in sorted(os.listdir(chain_dir)) if n.endswith(".zip")]
+
+def read_manifest(path):
+    with zipfile.ZipFile(path) as z:
+        return json.loads(z.read("manifest.json"))
+
+def _shift(ts, seconds):
+    return (datetime.fromisoformat(ts) + timedelta(seconds=seconds)).isoformat()
+
+def _media_arcname(path):
+    return "media_files/" + path.replace(os.sep, "/").lstrip("/")
+
+def _export_changes(src, since):
+    # 워터마크 이후 바뀐 행(JSON Lines)과 삭제 기록, 함께 담을 미디어 경로
+    lines, media = [], []
+    for table, _ in TRACKED_TABLES:
+        cur = src.execute(f"SELECT * FROM {table} WHERE updated_at > ?", (since,))
+        cols = [d[0] for d in cur.description]
+        for row in cur:
+            rec = dict(zip(cols, row))
+            lines.append(json.dumps({"t": table, "r": rec}, ensure_ascii=False))
+            if table == "blobs":
+                media.append(rec["path"])
+    tombs = [json.dumps({"t": t, "k": k, "at": at}, ensure_ascii=False) for t, k, at in src.execute(
+        "SELECT tbl, row_key, deleted_at FROM tombstones WHERE deleted_at > ? ORDER BY rowid", (since,))]
+    return lines, tombs, media
+
+def backup_chain(db_path=DB_PATH, chain_dir=CHAIN_DIR, full=False):
+    """체인에 백업 묶음 하나를 추가하고 (경로, manifest) 를 돌려준다.
+
+    체인이 비어 있거나 full=True 면 전체 백업, 아니면 직전 묶음 이후의 증분이다.
+    """
+    os.makedirs(chain_dir, exist_ok=True)
+    chain = list_chain(chain_dir)
+    last = read_manifest(chain[-1]) if chain else None
+    kind = "full" if full or last is None else "incr"
+    seq = last["seq"] + 1 if last else 0
+    until = datetime.utcnow().isoformat()
+    since = _shift(last["until"], -OVERLAP_S) if kind == "incr" else None
+
+    final_path = os.path.join(chain_dir, f"{seq:04d}-{kind}-{until[:19].replace(':', '')}.zip")
+    tmp_path = final_path + ".tmp"
+    # 없는 경로를 열면 sqlite3 가 빈 DB 를 새로 만들어 데이터 없는 "백업"이 된다
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"백업할 DB 가 없습니다: {db_path}")
+    src = sqlite3.connect(db_path)
+    try:
+        _pin(src)
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as z:
+            counts = {}
+            if kind == "full":
+                db_tmp = tmp_path + "-db"
+                try:
+                    _copy_pinned(src, db_tmp)
+                    z.write(db_tmp, "diary.db")
+                finally:
+                    if os.path.exists(db_tmp):
+                        os.remove(db_tmp)
+                media = [r[0] for r in src.execute("SELECT path FROM blobs")]
+            else:
+                lines, tombs, media = _export_changes(src, since)
+                z.writestr("changes.jsonl", "\n".join(lines))
+                z.writestr("tombstones.jsonl", "\n".join(tombs))
+                counts = {"rows": len(lines), "tombstones": len(tombs)}
+            counts["media"] = 0
+            for path in media:
+                if os.path.exists(path):
+                    # 이미지/음성은 이미 압축된 형식이라 다시 압축하지 않음
+                    z.write(path, _media_arcname(path), compress_type=zipfile.ZIP_STORED)
+                    counts["media"] += 1
+            manifest = {"kind": kind, "seq": seq, "since": since, "until": until, "counts": counts}
+            z.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False))
+        os.replace(tmp_path, final_path)
+    finally:
+        src.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if kind == "full":
+        # 전체 백업보다 오래된 삭제 기록은 더 이상 필요 없음
+        conn = make_conn(db_path)
+        try:
+            conn.execute("DELETE FROM tombstones WHERE deleted_at < ?", (_shift(until, -OVERLAP_S),))
+            conn.commit()
+        finally:
+            conn.close()
+    return final_path, manifest
+
+def _upsert(conn, table, key, rec):
+    # 겹쳐서 다시 내보낸(같은 updated_at) 행은 건드리지 않음
+    if table == "blobs":
+        rec = {k: v for k, v in rec.items() if k != "refcount"}   # 참조 수는 files 트리거가 다시 셈
+    cols = list(rec)
+    updates = ", ".join(f'"{c}"=excluded."{c}"' for c in cols if c != key)
+    conn.execute(f"""
+        INSERT INTO {table}({", ".join(f'"{c}"' for c in cols)})
+        VALUES ({", ".join("?" * len(cols))})
+        ON CONFLICT({key}) DO UPDATE SET {updates}
+        WHERE excluded.updated_at IS NOT {table}.updated_at
+    """, [rec[c] for c in cols])
+
+def _apply_increment(conn, z, target_dir):
+    keys = dict(TRACKED_TABLES)
+    changes = [json.loads(line) for line in z.read("changes.jsonl").decode().splitlines() if line]
+    tombs = [json.loads(line) for line in z.read("tombstones.jsonl").decode().splitlines() if line]
+    conn.execute("BEGIN")
+    try:
+        for table, key in TRACKED_TABLES:
+            for ch in changes:
+                if ch["t"] == table:
+                    _upsert(conn, table, key, ch["r"])
+                    if table == "entries":
+                        # 휴지통에 있는 일기는 태그 색인에 넣지 않음
+                        tags = None if ch["r"].get("deleted_at") else ch["r"]["tags"]
+                        sync_entry_tags(conn, ch["r"]["id"], ch["r"]["user_id"], tags)
+        # 지운 뒤 같은 키로 다시 생긴 행(같은 내용의 미디어 등)은 지우지 않음
+        revived = {(ch["t"], ch["r"][keys[ch["t"]]]): ch["r"]["updated_at"] for ch in changes}
+        # 자식부터 지움(files -> blobs -> entries -> ...)
+        for table, key in reversed(TRACKED_TABLES):
+            for tb in tombs:
+                if tb["t"] == table and revived.get((table, tb["k"]), "") <= tb["at"]:
+                    conn.execute(f"DELETE FROM {table} WHERE {key}=?", (tb["k"],))
+                    if table == "blobs":
+                        path = os.path.join(target_dir, tb["k"])
+                        if os.path.exists(path):
+                            os.remove(path)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _extract_media(z, target_dir):
+    for name in z.namelist():
+        if name.startswith("media_files/"):
+            dest = os.path.join(target_dir, *name[len("media_files/"):].split("/"))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with z.open(name) as src, open(dest, "wb") as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+
+def restore_chain(target_dir, chain_dir=CHAIN_DIR, upto=None):
+    """마지막 전체 백업 + 그 뒤 증분들을 차례로 적용해 target_dir 에 되살린다.
+
+    target_dir/diary.db 와 (DB 에 기록된 상대 경로대로) 미디어 파일이 만들어진다.
+    upto 를 주면 그 seq 까지만 적용한다. 적용한 묶음 경로 목록을 돌려준다.
+    """
+    chain = [(p, read_manifest(p)) for p in list_chain(chain_dir)]
+    if upto is not None:
+        chain = [(p, m) for p, m in chain if m["seq"] <= upto]
+    fulls = [i for i, (_, m) in enumerate(chain) if m["kind"] == "full"]
+    if not fulls:
+        raise FileNotFoundError(f"{chain_dir} 에 전체 백업이 없습니다.")
+    chain = chain[fulls[-1]:]
+    for (_, prev), (path, m) in zip(chain, chain[1:]):
+        if m["seq"] != prev["seq"] + 1:
+            raise ValueError(f"체인이 끊겼습니다: {prev['seq']} 다음이 {m['seq']} ({path})")
+
+    db_out = os.path.join(target_dir, "diary.db")
+    if os.path.exists(db_out):
+        raise FileExistsError(f"{db_out} 이 이미 있습니다.")
+    os.makedirs(target_dir, exist_ok=True)
+    with zipfile.ZipFile(chain[0][0]) as z:
+        with z.open("diary.db") as src, open(db_out, "wb") as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+        _extract_media(z, target_dir)
+    conn = init_db(make_conn(db_out))
+    try:
+        for path, _ in chain[1:]:
+            with zipfile.ZipFile(path) as z:
+                _extract_media(z, target_dir)
+                _apply_increment(conn, z, target_dir)
+    finally:
+        conn.close()
+    return [p for p, _ in chain]
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="diary.db 백업 도구")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_snap = sub.add_parser("snapshot", help="압축 스냅샷 한 개 만들기")
+    p_snap.add_argument("--out", default=BACKUP_DIR)
+    p_snap.add_argument("--keep", type=int, default=KEEP_SNAPSHOTS)
+    for name, help_ in (("full", "체인에 전체 백업 추가"), ("incr", "체인에 증분 백업 추가")):
+        p = sub.add_parser(name, help=help_)
+        p.add_argument("--chain", default=CHAIN_DIR)
+    p_restore = sub.add_parser("restore", help="전체 + 증분 백업을 차례로 적용해 복원")
+    p_restore.add_argument("target", help="복원할 폴더(diary.db 와 media 가 생김)")
+    p_restore.add_argument("--chain", default=CHAIN_DIR)
+    p_restore.add_argument("--upto", type=int, help="이 seq 까지만 적용")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "snapshot":
+        path = compressed_snapshot(args.db, args.out)
+        rotate_snapshots(args.out, args.keep)
+        print(f"스냅샷 저장: {path} ({os.path.getsize(path):,} bytes)")
+    elif args.cmd in ("full", "incr"):
+        path, manifest = backup_chain(args.db, args.chain, full=args.cmd == "full")
+        print(f"{manifest['kind']} 백업 #{manifest['seq']}: {path} {manifest['counts']}")
+    elif args.cmd == "restore":
+        applied = restore_chain(args.target, args.chain, args.upto)
+        print(f"{len(applied)}개 묶음을 적용해 {args.target} 에 복원했습니다.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
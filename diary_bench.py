@@ -0,0 +1,296 @@
+import hashlib
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from diary_db import (
+    BLOB_DIR, EMO_KEYS, DiaryDB, blob_path,
+    get_daily_stats, get_entries, get_entries_page, get_entries_with_files, get_files,
+    get_monthly_stats, get_mood_counts, get_user_settings, insert_entry, search_entries, suggest_tags,
+    upsert_user_settings,
+)
+
+# ================== 공통 상수 ==================
+SEED = 2025
+GEN_BATCH = 5000            # 생성기가 한 트랜잭션에 넣는 일기 수
+DEFAULT_USERS = 5
+DEFAULT_SIZES = "100,1000,10000"    # 사용자 한 명당 일기 수
+DEFAULT_ROUNDS = 30
+REGRESSION_RATIO = 1.20     # compare: 중앙값이 이만큼 느려지면 회귀로 본다
+CONCURRENT_WRITERS = 16     # 동시에 저장하는 세션 수(쓰기 스레드의 묶음 커밋 확인용)
+
+# ================== 합성 데이터 ==================
+WHEN = ["아침에", "점심에", "오후에", "저녁에", "밤늦게", "퇴근길에", "주말에", "오랜만에"]
+WHO = ["혼자", "친구와", "가족과", "동생이랑", "동료들과", "엄마랑", "강아지와"]
+WHERE = ["카페에서", "도서관에서", "공원에서", "집에서", "회사 근처에서", "한강에서", "시장에서", "학교에서"]
+WHAT = ["책을 읽었다", "커피를 마셨다", "산책을 했다", "코딩 공부를 했다", "영화를 봤다",
+        "떡볶이를 먹었다", "운동을 했다", "일기를 밀려 썼다", "방 청소를 했다", "사진을 찍었다",
+        "오래 이야기를 나눴다", "발표 준비를 했다"]
+FEEL = ["기분이 좋았다.", "조금 피곤했다.", "마음이 편안했다.", "괜히 우울했다.", "내일이 기대된다.",
+        "생각보다 괜찮았다.", "걱정이 좀 됐다.", "뿌듯했다.", "시간이 빨리 갔다."]
+TAGS = ["일상", "공부", "개발", "운동", "가족", "친구", "여행", "음식", "회사", "독서",
+        "영화", "음악", "산책", "카페", "건강", "감사", "목표", "회고", "취미", "사진"]
+
+def _sentence(rng):
+    return f"{rng.choice(WHEN)} {rng.choice(WHO)} {rng.choice(WHERE)} {rng.choice(WHAT)}. {rng.choice(FEEL)}"
+
+def _tags(rng):
+    # 앞쪽 태그일수록 자주 나오게(지프 분포 비슷하게)
+    k = rng.choice([0, 1, 1, 2, 2, 3])
+    return ", ".join(dict.fromkeys(TAGS[min(int(rng.paretovariate(1.2)) - 1, len(TAGS) - 1)]
+                                   for _ in range(k)))
+
+def generate(db_path, users, entries_per_user, seed=SEED, blob_dir=BLOB_DIR,
+             attach_ratio=0.2, blob_pool=500, days=3 * 365):
+    """db_path 를 users 명 × entries_per_user 개의 일기로 채운다(같은 시드면 같은 데이터).
+
+    첨부는 files/blobs 행만 만들고 실제 파일은 만들지 않는다. 사용자 id 목록을 돌려준다.
+    """
+    rng = random.Random(seed)
+    db = DiaryDB(db_path, blob_dir=blob_dir, cache_bytes=0)
+    try:
+        with db.writer() as conn:
+            conn.executemany(
+                "INSERT INTO blobs(path, sha256, size) VALUES (?, ?, ?)",
+                [(blob_path(blob_dir, sha, rng.choice([".webp", ".webp", ".m4a"])), sha,
+                  rng.randint(20_000, 2_000_000))
+                 for sha in (hashlib.sha256(f"{seed}:{i}".encode()).hexdigest() for i in range(blob_pool))])
+            blobs = [r[0] for r in conn.execute("SELECT path FROM blobs")]
+            start_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+            conn.executemany("INSERT INTO users(email, name, password_hash) VALUES (?, ?, ?)",
+                             [(f"bench{start_id + i}@example.com", f"사용자{start_id + i}", "!")
+                              for i in range(1, users + 1)])
+            user_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE id > ? ORDER BY id", (start_id,))]
+
+        first_day = date.today() - timedelta(days=days)
+        pending = [(uid, n) for uid in user_ids for n in range(entries_per_user)]
+        for i in range(0, len(pending), GEN_BATCH):
+            with db.writer() as conn:
+                base = conn.execute("""
+                    SELECT MAX(COALESCE((SELECT MAX(id) FROM entries), 0),
+                               COALESCE((SELECT seq FROM sqlite_sequence WHERE name='entries'), 0))
+                """).fetchone()[0]
+                entries, tags, files = [], [], []
+                for j, (uid, _) in enumerate(pending[i:i + GEN_BATCH], 1):
+                    eid = base + j
+                    tag_s = _tags(rng)
+                    d = (first_day + timedelta(days=rng.randrange(days))).isoformat()
+                    content = " ".join(_sentence(rng) for _ in range(rng.randint(1, 6)))
+                    entries.append((eid, uid, d, rng.choice(EMO_KEYS), rng.randint(1, 5), tag_s, content,
+                                    datetime.utcnow().isoformat()))
+                    tags += [(eid, uid, t) for t in tag_s.split(", ") if t]
+                    if rng.random() < attach_ratio:
+                        for _ in range(rng.randint(1, 3)):
+                            path = rng.choice(blobs)
+                            image = not path.endswith(".m4a")
+                            files.append((eid, "image" if image else "audio", path,
+                                          f"IMG_{rng.randint(1000, 9999)}.jpg" if image else "녹음.m4a",
+                                          path if image else None, path if image else None))
+                conn.executemany("""
+                    INSERT INTO entries(id, user_id, d, mood, mood_score, tags, content, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, entries)
+                conn.executemany("INSERT INTO entry_tags(entry_id, user_id, tag) VALUES (?, ?, ?)", tags)
+                conn.executemany("""
+                    INSERT INTO files(entry_id, kind, path, original_name, thumb_path, preview_path)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, files)
+        with db.writer() as conn:
+            conn.execute("ANALYZE")
+    finally:
+        db.close()
+    return user_ids
+
+# ================== 측정 ==================
+def _probe_args(db, user_id):
+    # 실제 데이터에 맞춘 인자(첨부가 있는 일기, 자주 쓰는 태그, 중간 커서)
+    with db.reader() as conn:
+        with_file = conn.execute("""
+            SELECT f.entry_id FROM files f JOIN entries e ON e.id = f.entry_id
+            WHERE e.user_id=? LIMIT 1
+        """, (user_id,)).fetchone()
+    page1 = get_entries_page(db, user_id)
+    return {
+        "entry_id": with_file[0] if with_file else 0,
+        "tag": (suggest_tags(db, user_id, limit=1) or [(TAGS[0], 0)])[0][0],
+        "cursor": page1[2],
+        "since": (date.today() - timedelta(days=30)).isoformat(),
+    }
+
+def _concurrent(fn, n=CONCURRENT_WRITERS):
+    # n 개 세션이 한꺼번에 저장 버튼을 누른 상황
+    threads = [threading.Thread(target=fn) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def benchmarks(db, user_id, a):
+    """(이름, 함수) 목록. 이름은 결과 JSON 에서 그대로 비교 키가 된다."""
+    settings = itertools.cycle([("light", "#FF7A9E"), ("dark", "#B39DDB")])
+    return [
+        ("get_entries", lambda: get_entries(db, user_id)),
+        ("get_entries[limit=20]", lambda: get_entries(db, user_id, limit=20)),
+        ("get_entries[mood]", lambda: get_entries(db, user_id, mood_key="calm", limit=20)),
+        ("get_entries[tag]", lambda: get_entries(db, user_id, tag=a["tag"], limit=20)),
+        ("get_entries_page[first]", lambda: get_entries_page(db, user_id)),
+        ("get_entries_page[cursor]", lambda: get_entries_page(db, user_id, cursor=a["cursor"])),
+        ("search_entries[trigram]", lambda: search_entries(db, user_id, "커피를", limit=20)),
+        ("search_entries[short]", lambda: search_entries(db, user_id, "책", limit=20)),
+        ("get_entries_with_files", lambda: get_entries_with_files(db, user_id)),
+        ("get_files", lambda: get_files(db, a["entry_id"], user_id)),
+        ("get_mood_counts", lambda: get_mood_counts(db, user_id)),
+        ("get_monthly_stats", lambda: get_monthly_stats(db, user_id)),
+        ("get_daily_stats[30d]", lambda: get_daily_stats(db, user_id, a["since"])),
+        ("suggest_tags", lambda: suggest_tags(db, user_id, prefix="")),
+        ("get_user_settings", lambda: get_user_settings(db, user_id)),
+        ("upsert_user_settings", lambda: upsert_user_settings(
+            db, user_id, *next(settings), "pastel", "md")),
+        (f"insert_entry[x{CONCURRENT_WRITERS}]", lambda: _concurrent(lambda: insert_entry(
+            db, user_id, a["since"], "calm", 3, "벤치", "동시 저장"))),
+    ]
+
+def _stats(samples):
+    return {
+        "min": min(samples),
+        "max": max(samples),
+        "mean": statistics.fmean(samples),
+        "median": statistics.median(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "rounds": len(samples),
+        "ops": 1 / statistics.fmean(samples) if samples else 0.0,
+    }
+
+def time_call(fn, rounds, warmup=2, min_time=0.0):
+    """fn 을 warmup 번 돌린 뒤 rounds 번(또는 min_time 초를 채울 때까지) 잰 초 단위 목록."""
+    for _ in range(warmup):
+        fn()
+    samples, started = [], time.perf_counter()
+    while len(samples) < rounds or time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+def run(sizes, users=DEFAULT_USERS, rounds=DEFAULT_ROUNDS, seed=SEED, only=None, progress=print):
+    """크기별로 같은 시드의 임시 DB 를 새로 만들어 모든 벤치마크를 재고 결과 목록을 돌려준다.
+
+    읽기 캐시를 끈 DiaryDB 로 재므로 숫자는 SQL 과 파이썬 처리 비용이다.
+    결과 모양은 pytest-benchmark 의 JSON(name/group/params/stats)을 따른다.
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="diary-bench-") as work:
+            db_path = os.path.join(work, "diary.db")
+            t0 = time.perf_counter()
+            user_ids = generate(db_path, users, size, seed=seed, blob_dir=os.path.join(work, "blobs"))
+            progress(f"[{size}] {users}명 × {size}개 생성 {time.perf_counter() - t0:.1f}s")
+            db = DiaryDB(db_path, blob_dir=os.path.join(work, "blobs"), cache_bytes=0)
+            try:
+                uid = user_ids[len(user_ids) // 2]
+                for name, fn in benchmarks(db, uid, _probe_args(db, uid)):
+                    if only and only not in name:
+                        continue
+                    stats = _stats(time_call(fn, rounds))
+                    results.append({
+                        "name": f"{name}[{size}]",
+                        "group": name,
+                        "params": {"entries_per_user": size, "users": users, "seed": seed},
+                        "stats": stats,
+                    })
+                    progress(f"  {name:<28} median {stats['median'] * 1e3:9.3f} ms")
+            finally:
+                db.close()
+    return results
+
+def _commit_info():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True)
+        return {"id": out.stdout.strip(), "dirty": bool(dirty.stdout.strip())}
+    except (OSError, subprocess.CalledProcessError):
+        return {"id": None, "dirty": None}
+
+def save_results(path, results):
+    doc = {
+        "machine_info": {
+            "python_version": platform.python_version(),
+            "sqlite_version": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "commit_info": _commit_info(),
+        "datetime": datetime.utcnow().isoformat(),
+        "benchmarks": results,
+    }
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, indent=2)
+    return doc
+
+def compare(old_path, new_path, ratio=REGRESSION_RATIO):
+    """두 결과 파일의 중앙값을 비교해 (이름, 이전, 이후, 배율, 회귀 여부) 목록을 돌려준다."""
+    def load(p):
+        with open(p, encoding="utf-8") as f:
+            return {b["name"]: b["stats"]["median"] for b in json.load(f)["benchmarks"]}
+    old, new = load(old_path), load(new_path)
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        r = new[name] / old[name] if old[name] else float("inf")
+        rows.append((name, old[name], new[name], r, r >= ratio))
+    return rows
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="diary_db 합성 데이터 생성/벤치마크")
+    parser.add_argument("--seed", type=int, default=SEED)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_gen = sub.add_parser("generate", help="합성 데이터로 DB 채우기")
+    p_gen.add_argument("--db", required=True, help="버려도 되는 DB 경로(운영 diary.db 에 쓰지 말 것)")
+    p_gen.add_argument("--users", type=int, default=DEFAULT_USERS)
+    p_gen.add_argument("--entries", type=int, default=1000, help="사용자 한 명당 일기 수")
+    p_run = sub.add_parser("run", help="크기별 벤치마크 실행")
+    p_run.add_argument("--sizes", default=DEFAULT_SIZES, help="사용자 한 명당 일기 수(쉼표 구분)")
+    p_run.add_argument("--users", type=int, default=DEFAULT_USERS)
+    p_run.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    p_run.add_argument("-k", dest="only", help="이름에 이 문자열이 든 벤치마크만")
+    p_run.add_argument("--out", help="결과 JSON 경로(기본: bench/<커밋 앞 8자리>.json)")
+    p_cmp = sub.add_parser("compare", help="두 결과 JSON 비교")
+    p_cmp.add_argument("old")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--ratio", type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "generate":
+        if os.path.abspath(args.db) == os.path.abspath("diary.db"):
+            parser.error("운영 diary.db 에는 생성할 수 없습니다.")
+        ids = generate(args.db, args.users, args.entries, seed=args.seed)
+        print(f"{args.db}: 사용자 {len(ids)}명 × 일기 {args.entries}개를 만들었습니다.")
+    elif args.cmd == "run":
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        results = run(sizes, args.users, args.rounds, args.seed, args.only)
+        out = args.out or os.path.join("bench", f"{(_commit_info()['id'] or 'local')[:8]}.json")
+        save_results(out, results)
+        print(f"결과 저장: {out}")
+    elif args.cmd == "compare":
+        rows = compare(args.old, args.new, args.ratio)
+        for name, old, new, r, slow in rows:
+            print(f"{'[회귀] ' if slow else '       '}{name:<40} {old * 1e3:9.3f} -> {new * 1e3:9.3f} ms  x{r:.2f}")
+        if any(slow for *_, slow in rows):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,1361 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from queue import Empty, LifoQueue, Queue
+
+from instrument import TracedConnection
+
+# ================== 공통 상수 ==================
+DB_PATH = "diary.db"
+BLOB_DIR = os.path.join("media", "blobs")   # 내용 주소(SHA-256) 미디어 저장소
+BUSY_TIMEOUT_MS = 5000     # 다른 연결이 쓰기 락을 잡고 있을 때 기다리는 시간
+READ_POOL_SIZE = 8         # 재사용할 읽기 연결 수(초과분은 쓰고 닫음)
+PAGE_SIZE = 20             # 목록 한 페이지에 보여줄 일기 수
+CACHE_MAX_BYTES = 64 << 20 # 읽기 캐시 전체(모든 사용자 합계) 메모리 상한
+WRITE_BATCH = 64           # 쓰기 스레드가 한 트랜잭션(커밋 한 번)으로 묶는 최대 쓰기 수
+WRITE_RETRIES = 5          # busy_timeout 을 넘겨도 SQLITE_BUSY 면 다시 시도하는 횟수
+BUSY_BACKOFF_S = 0.05      # 다시 시도 전 대기(시도마다 두 배)
+
+# 감정 라벨(라벨은 이모지 포함, 저장은 key로)
+EMOTIONS = [
+    {"key": "happy",   "label": "EMOJI_1 행복"},
+    {"key": "calm",    "label": "EMOJI_2 평온"},
+    {"key": "neutral", "label": "EMOJI_3 보통"},
+    {"key": "sad",     "label": "EMOJI_4 우울"},
+    {"key": "anxious", "label": "EMOJI_5 불안"},
+    {"key": "drive",   "label": "EMOJI_6 의욕"},
+]
+EMO_KEYS = [e["key"] for e in EMOTIONS]
+
+DEFAULT_SETTINGS = {"theme": "light", "primary": "#FF7A9E", "bg_style": "pastel", "font_scale": "md"}
+
+# ================== 연결 ==================
+def make_conn(db_path: str, read_only: bool = False):
+    # 계측(instrument)이 켜져 있을 때만 쿼리 시간/행 수를 기록하는 연결
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000,
+                           factory=TracedConnection)
+    conn.text_factory = str
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+# ================== 스키마 마이그레이션 ==================
+# PRAGMA user_version 에 마지막으로 적용한 번호를 기록한다.
+# 새 변경은 항상 목록 끝에 번호를 늘려 추가하고, 이미 배포된 단계는 고치지 않는다.
+def _m001_base_schema(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS users(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE,
+            name TEXT,
+            password_hash TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS entries(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            d TEXT,
+            mood TEXT,
+            mood_score INTEGER,
+            tags TEXT,
+            content TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS files(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entry_id INTEGER,
+            kind TEXT,
+            path TEXT,
+            original_name TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(entry_id) REFERENCES entries(id) ON DELETE CASCADE
+        )
+    """)
+    # 사용자 테마 설정 저장 테이블
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_settings(
+            user_id INTEGER PRIMARY KEY,
+            theme TEXT,               -- 'light' or 'dark'
+            "primary" TEXT,           -- 포인트 컬러(예약어라 따옴표 필요)
+            bg_style TEXT,            -- 'pastel' or 'matte'
+            font_scale TEXT,          -- 'sm'/'md'/'lg'
+            updated_at TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+
+def _m002_hot_query_indexes(c):
+    # 목록: WHERE user_id=? ORDER BY d DESC, id DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_entries_user_d ON entries(user_id, d DESC, id DESC)")
+    # 감정 필터: WHERE user_id=? AND mood=? ORDER BY d DESC, id DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_entries_user_mood ON entries(user_id, mood, d DESC, id DESC)")
+    # 첨부: WHERE entry_id=? ORDER BY id
+    c.execute("CREATE INDEX IF NOT EXISTS idx_files_entry ON files(entry_id, id)")
+
+def _m003_entries_fts(c):
+    # 본문/태그 전문 검색. trigram 이라 한국어도 부분 문자열로 찾을 수 있다.
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+            content, tags,
+            content='entries', content_rowid='id',
+            tokenize='trigram'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS entries_fts_ai AFTER INSERT ON entries BEGIN
+            INSERT INTO entries_fts(rowid, content, tags) VALUES (new.id, new.content, new.tags);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS entries_fts_ad AFTER DELETE ON entries BEGIN
+            INSERT INTO entries_fts(entries_fts, rowid, content, tags)
+            VALUES ('delete', old.id, old.content, old.tags);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS entries_fts_au AFTER UPDATE OF content, tags ON entries BEGIN
+            INSERT INTO entries_fts(entries_fts, rowid, content, tags)
+            VALUES ('delete', old.id, old.content, old.tags);
+            INSERT INTO entries_fts(rowid, content, tags) VALUES (new.id, new.content, new.tags);
+        END
+    """)
+    rebuild_fts(c)
+
+def _m004_entry_tags(c):
+    # 쉼표 문자열 대신 태그 한 개당 한 행. 정확/접두어 일치를 인덱스로 찾는다.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS entry_tags(
+            entry_id INTEGER,
+            user_id INTEGER,
+            tag TEXT,
+            PRIMARY KEY(entry_id, tag),
+            FOREIGN KEY(entry_id) REFERENCES entries(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_entry_tags_user_tag ON entry_tags(user_id, tag, entry_id)")
+    # 자동완성용 사용자별 태그 사용 횟수(entry_tags 트리거로 유지)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_tag_counts(
+            user_id INTEGER,
+            tag TEXT,
+            cnt INTEGER NOT NULL,
+            PRIMARY KEY(user_id, tag)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_counts_cnt ON user_tag_counts(user_id, cnt DESC)")
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS entry_tags_ai AFTER INSERT ON entry_tags BEGIN
+            INSERT INTO user_tag_counts(user_id, tag, cnt) VALUES (new.user_id, new.tag, 1)
+            ON CONFLICT(user_id, tag) DO UPDATE SET cnt = cnt + 1;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS entry_tags_ad AFTER DELETE ON entry_tags BEGIN
+            UPDATE user_tag_counts SET cnt = cnt - 1 WHERE user_id=old.user_id AND tag=old.tag;
+            DELETE FROM user_tag_counts WHERE user_id=old.user_id AND tag=old.tag AND cnt <= 0;
+        END
+    """)
+    rows = c.execute("SELECT id, user_id, tags FROM entries WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    c.executemany("INSERT OR IGNORE INTO entry_tags(entry_id, user_id, tag) VALUES (?, ?, ?)",
+                  [(eid, uid, t) for eid, uid, tags in rows for t in parse_tags(tags)])
+
+def _m005_image_derivatives(c):
+    # 목록 격자용 썸네일과 크게 보기용 미리보기 경로(없으면 원본을 그대로 씀)
+    c.execute("ALTER TABLE files ADD COLUMN thumb_path TEXT")
+    c.execute("ALTER TABLE files ADD COLUMN preview_path TEXT")
+
+def _m006_blobs(c):
+    # 디스크의 미디어 파일 하나당 한 행. files 의 세 경로 컬럼이 참조하는 수를 센다.
+    # sha256 이 NULL 인 행은 아직 내용 주소 저장소로 옮기지 않은 기존 파일이다.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS blobs(
+            path TEXT PRIMARY KEY,
+            sha256 TEXT UNIQUE,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(refcount) WHERE refcount <= 0")
+    # 한 행에서 같은 경로가 여러 컬럼에 있어도(작은 이미지) IN 이라 한 번만 센다
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_blobs_ai AFTER INSERT ON files BEGIN
+            UPDATE blobs SET refcount = refcount + 1
+            WHERE path IN (new.path, new.thumb_path, new.preview_path);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_blobs_ad AFTER DELETE ON files BEGIN
+            UPDATE blobs SET refcount = refcount - 1
+            WHERE path IN (old.path, old.thumb_path, old.preview_path);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_blobs_au AFTER UPDATE OF path, thumb_path, preview_path ON files BEGIN
+            UPDATE blobs SET refcount = refcount - 1
+            WHERE path IN (old.path, old.thumb_path, old.preview_path);
+            UPDATE blobs SET refcount = refcount + 1
+            WHERE path IN (new.path, new.thumb_path, new.preview_path);
+        END
+    """)
+    # 기존 파일은 옮기지 않고 참조 수만 채워 둔다(옮기기는 migrate-media)
+    c.execute("""
+        INSERT OR IGNORE INTO blobs(path, refcount)
+        SELECT p, COUNT(*) FROM (
+            SELECT id, path AS p FROM files
+            UNION SELECT id, thumb_path FROM files
+            UNION SELECT id, preview_path FROM files
+        ) WHERE p IS NOT NULL GROUP BY p
+    """)
+
+def _stats_delta(row, sign):
+    # row 는 트리거의 new/old. 일별·월별 요약에 sign(+1/-1) 만큼 반영
+    add = "+" if sign > 0 else "-"
+    stmts = []
+    for table, period in (("mood_daily", f"{row}.d"), ("mood_monthly", f"substr({row}.d, 1, 7)")):
+        stmts.append(f"""
+            INSERT INTO {table}(user_id, period, mood, cnt, score_sum)
+            VALUES ({row}.user_id, {period}, COALESCE({row}.mood, ''), {sign}, {sign} * COALESCE({row}.mood_score, 0))
+            ON CONFLICT(user_id, period, mood) DO UPDATE SET
+                cnt = cnt {add} 1,
+                score_sum = score_sum {add} COALESCE({row}.mood_score, 0);""")
+        if sign < 0:
+            stmts.append(f"""
+            DELETE FROM {table}
+            WHERE user_id={row}.user_id AND period={period} AND mood=COALESCE({row}.mood, '') AND cnt <= 0;""")
+    return "".join(stmts)
+
+def _m007_mood_stats(c):
+    # 통계 탭용 요약. period 는 일별 'YYYY-MM-DD', 월별 'YYYY-MM'
+    for table in ("mood_daily", "mood_monthly"):
+        c.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}(
+                user_id INTEGER NOT NULL,
+                period TEXT NOT NULL,
+                mood TEXT NOT NULL,
+                cnt INTEGER NOT NULL,
+                score_sum INTEGER NOT NULL,
+                PRIMARY KEY(user_id, period, mood)
+            ) WITHOUT ROWID
+        """)
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS entries_stats_ai AFTER INSERT ON entries BEGIN {_stats_delta('new', 1)} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS entries_stats_ad AFTER DELETE ON entries BEGIN {_stats_delta('old', -1)} END")
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS entries_stats_au
+        AFTER UPDATE OF user_id, d, mood, mood_score ON entries BEGIN
+            {_stats_delta('old', -1)}
+            {_stats_delta('new', 1)}
+        END
+    """)
+    for table, period in (("mood_daily", "d"), ("mood_monthly", "substr(d, 1, 7)")):
+        c.execute(f"DELETE FROM {table}")
+        c.execute(f"""
+            INSERT INTO {table}(user_id, period, mood, cnt, score_sum)
+            SELECT user_id, {period}, COALESCE(mood, ''), COUNT(*), SUM(COALESCE(mood_score, 0))
+            FROM entries GROUP BY 1, 2, 3
+        """)
+
+# 증분 백업용 변경 추적. 시각은 entries.updated_at 과 같은 ISO 형식(UTC)
+SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+TRACKED_TABLES = [          # (테이블, 키 컬럼) - 복원 시 이 순서로 다시 넣는다
+    ("users", "id"),
+    ("user_settings", "user_id"),
+    ("entries", "id"),
+    ("blobs", "path"),
+    ("files", "id"),
+]
+
+def _m008_change_tracking(c):
+    # 지운 행의 키를 남겨 증분 백업이 삭제도 옮길 수 있게 한다
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tombstones(
+            tbl TEXT NOT NULL,
+            row_key,
+            deleted_at TEXT NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_deleted ON tombstones(deleted_at)")
+    touch_cols = {
+        "users": "email, name, password_hash",
+        "files": "entry_id, kind, path, original_name, thumb_path, preview_path",
+        "blobs": "sha256, size",
+    }
+    for table, cols in touch_cols.items():
+        key = "path" if table == "blobs" else "id"
+        c.execute(f"ALTER TABLE {table} ADD COLUMN updated_at TEXT")
+        c.execute(f"UPDATE {table} SET updated_at = {SQL_NOW}")
+        # updated_at 을 직접 넣은 경우(백업 복원 등)는 그 값을 그대로 둔다
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_touch_ai AFTER INSERT ON {table}
+            WHEN new.updated_at IS NULL BEGIN
+                UPDATE {table} SET updated_at = {SQL_NOW} WHERE {key} = new.{key};
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_touch_au AFTER UPDATE OF {cols} ON {table}
+            WHEN new.updated_at IS old.updated_at BEGIN
+                UPDATE {table} SET updated_at = {SQL_NOW} WHERE {key} = new.{key};
+            END
+        """)
+    for table, key in TRACKED_TABLES:
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated ON {table}(updated_at)")
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_tombstone AFTER DELETE ON {table} BEGIN
+                INSERT INTO tombstones(tbl, row_key, deleted_at) VALUES ('{table}', old.{key}, {SQL_NOW});
+            END
+        """)
+
+def _m009_import_progress(c):
+    # 대량 가져오기가 (사용자, 원본 파일 내용 해시) 별로 어디까지 커밋했는지 기록
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS import_progress(
+            user_id INTEGER NOT NULL,
+            source_sha256 TEXT NOT NULL,
+            done INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY(user_id, source_sha256),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+
+def _m010_trash(c):
+    # 삭제는 deleted_at 을 채워 휴지통으로 옮기고, 보관 기간이 지나면 정리 작업이 실제로 지운다
+    c.execute("ALTER TABLE entries ADD COLUMN deleted_at TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_entries_trash ON entries(user_id, deleted_at) WHERE deleted_at IS NOT NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_entries_deleted ON entries(deleted_at) WHERE deleted_at IS NOT NULL")
+    # 통계 요약에는 휴지통에 없는 일기만 센다
+    for name in ("entries_stats_ai", "entries_stats_ad", "entries_stats_au"):
+        c.execute(f"DROP TRIGGER IF EXISTS {name}")
+    c.execute(f"""
+        CREATE TRIGGER entries_stats_ai AFTER INSERT ON entries
+        WHEN new.deleted_at IS NULL BEGIN {_stats_delta('new', 1)} END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER entries_stats_ad AFTER DELETE ON entries
+        WHEN old.deleted_at IS NULL BEGIN {_stats_delta('old', -1)} END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER entries_stats_au AFTER UPDATE OF user_id, d, mood, mood_score ON entries
+        WHEN old.deleted_at IS NULL AND new.deleted_at IS NULL BEGIN
+            {_stats_delta('old', -1)}
+            {_stats_delta('new', 1)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER entries_stats_trash AFTER UPDATE OF deleted_at ON entries
+        WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL BEGIN {_stats_delta('old', -1)} END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER entries_stats_restore AFTER UPDATE OF deleted_at ON entries
+        WHEN old.deleted_at IS NOT NULL AND new.deleted_at IS NULL BEGIN {_stats_delta('new', 1)} END
+    """)
+
+def _m011_user_shards(c):
+    # 샤드 모드에서 디렉터리 DB 가 사용자마다 데이터가 든 샤드 파일 이름을 기록한다(단일 DB 면 비어 있음)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_shards(
+            user_id INTEGER PRIMARY KEY,
+            shard TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    # 새 사용자를 나눌 버킷 수. 처음 정한 값을 계속 써야 배정 규칙이 바뀌지 않는다.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS shard_config(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_count INTEGER NOT NULL
+        )
+    """)
+
+def _m012_session_generation(c):
+    # 세션 토큰에 넣어 서명하는 세대 번호. 로그아웃/비밀번호 변경 때 올려 이전 토큰을 모두 무효로 한다.
+    c.execute("ALTER TABLE users ADD COLUMN session_gen INTEGER NOT NULL DEFAULT 0")
+    # 증분 백업이 세대 변경도 옮기도록 updated_at 갱신 대상에 넣는다
+    c.execute("DROP TRIGGER IF EXISTS users_touch_au")
+    c.execute(f"""
+        CREATE TRIGGER users_touch_au AFTER UPDATE OF email, name, password_hash, session_gen ON users
+        WHEN new.updated_at IS old.updated_at BEGIN
+            UPDATE users SET updated_at = {SQL_NOW} WHERE id = new.id;
+        END
+    """)
+
+MIGRATIONS = [
+    (1, _m001_base_schema),
+    (2, _m002_hot_query_indexes),
+    (3, _m003_entries_fts),
+    (4, _m004_entry_tags),
+    (5, _m005_image_derivatives),
+    (6, _m006_blobs),
+    (7, _m007_mood_stats),
+    (8, _m008_change_tracking),
+    (9, _m009_import_progress),
+    (10, _m010_trash),
+    (11, _m011_user_shards),
+    (12, _m012_session_generation),
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """아직 적용되지 않은 마이그레이션을 단계별로 한 트랜잭션씩 적용한다."""
+    current = schema_version(conn)
+    applied = []
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(version)
+    return applied
+
+# 자주 도는 조회와, 그 조회가 타야 하는 인덱스
+HOT_QUERIES = [
+    ("entries_by_user",
+     "SELECT id, d FROM entries WHERE user_id=? AND deleted_at IS NULL ORDER BY d DESC, id DESC",
+     (0,), "idx_entries_user_d"),
+    ("entries_page",
+     "SELECT id, d FROM entries WHERE user_id=? AND deleted_at IS NULL AND (d, id) < (?, ?)"
+     " ORDER BY d DESC, id DESC LIMIT 21",
+     (0, "", 0), "idx_entries_user_d"),
+    ("entries_by_user_mood",
+     "SELECT id, d FROM entries WHERE user_id=? AND mood=? AND deleted_at IS NULL ORDER BY d DESC, id DESC",
+     (0, ""), "idx_entries_user_mood"),
+    ("entries_by_tag",
+     "SELECT entry_id FROM entry_tags WHERE user_id=? AND tag=?",
+     (0, ""), "idx_entry_tags_user_tag"),
+    ("trash_by_user",
+     "SELECT id FROM entries WHERE user_id=? AND deleted_at IS NOT NULL ORDER BY deleted_at DESC",
+     (0,), "idx_entries_trash"),
+    ("files_by_entry",
+     "SELECT kind, path, original_name FROM files WHERE entry_id=? ORDER BY id ASC",
+     (0,), "idx_files_entry"),
+]
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN 으로 HOT_QUERIES 가 기대한 인덱스를 쓰는지 확인한다.
+
+    문제가 있는 조회만 (이름, 계획 문자열 목록) 으로 돌려준다.
+    """
+    problems = []
+    for name, sql, params, index in HOT_QUERIES:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        uses_index = any(index in line for line in plan)
+        sorts = any("TEMP B-TREE" in line for line in plan)
+        if not uses_index or sorts:
+            problems.append((name, plan))
+    return problems
+
+def rebuild_fts(c):
+    # entries 전체를 다시 색인(기존 DB 백필, 복원 직후 등)
+    c.execute("INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')")
+
+def init_db(conn):
+    # WAL: 읽기와 쓰기가 서로를 막지 않도록(설정은 DB 파일에 유지됨)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    if migrate(conn):
+        for name, plan in check_query_plans(conn):
+            warnings.warn(f"{name} 조회가 인덱스를 타지 않습니다: {plan}")
+    return conn
+
+# ================== 읽기 캐시 ==================
+def _approx_size(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        size += sum(_approx_size(o) for o in obj)
+    elif isinstance(obj, dict):
+        size += sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    return size
+
+class QueryCache:
+    """사용자별 데이터 버전을 키에 넣은 LRU 읽기 캐시.
+
+    쓰기가 커밋된 뒤 bump(user_id) 로 그 사용자의 버전을 올리면 이전 결과는
+    더 이상 쓰이지 않는다. 전체 크기가 max_bytes 를 넘으면 오래 안 쓴 것부터 버린다.
+    캐시된 값은 여러 세션이 공유하므로 받은 쪽에서 고치면 안 된다.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._items = OrderedDict()     # (user_id, version, key) -> (value, size)
+        self._bytes = 0
+
+    def version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            for k in [k for k in self._items if k[0] == user_id]:
+                self._bytes -= self._items.pop(k)[1]
+
+    def get_or_load(self, user_id, key, load):
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+            full_key = (user_id, version, key)
+            hit = self._items.get(full_key)
+            if hit is not None:
+                self._items.move_to_end(full_key)
+                self.hits += 1
+                return hit[0]
+            self.misses += 1
+        value = load()
+        size = _approx_size(value)
+        with self._lock:
+            # 읽는 동안 쓰기가 끝났으면 이 결과는 이미 낡았을 수 있으므로 보관하지 않음
+            if size > self.max_bytes or self._versions.get(user_id, 0) != version:
+                return value
+            old = self._items.pop(full_key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[full_key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+        return value
+
+def cached_by_user(fn):
+    # fn(db, user_id, ...) 형태의 읽기 함수 결과를 db.cache 에 보관
+    @functools.wraps(fn)
+    def wrapper(db, user_id, *args, **kwargs):
+        key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+        return db.cache.get_or_load(user_id, key, lambda: fn(db, user_id, *args, **kwargs))
+    return wrapper
+
+class DiaryDB:
+    """프로세스당 하나만 만들어 공유하는 연결 관리자.
+
+    스키마 준비는 생성 시 한 번만 한다. 쓰기 연결은 쓰기 스레드가 가지고,
+    submit/write 로 넣은 쓰기를 대기열에서 꺼내 모인 만큼 한 트랜잭션으로 커밋한다.
+    읽기는 풀에서 빌린 연결을 스레드가 단독으로 쓴다.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, read_pool_size: int = READ_POOL_SIZE,
+                 blob_dir: str = BLOB_DIR, cache_bytes: int = CACHE_MAX_BYTES, cache=None):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        # 샤드들은 캐시 하나를 같이 쓴다(사용자 id 가 전체에서 유일하므로 키가 겹치지 않음)
+        self.cache = cache if cache is not None else QueryCache(cache_bytes)
+        self._write_lock = threading.RLock()
+        self._readers = LifoQueue(maxsize=read_pool_size)
+        self._local = threading.local()
+        self._queue = Queue()
+        # 쓰기 스레드/연결의 시작과 정지, 진행 중인 작업 수(_active)를 지킨다
+        self._life = threading.Lock()
+        self._active = 0
+        self.last_used = time.monotonic()
+        self._write_conn = init_db(make_conn(db_path))
+        self._writer_thread = None
+        self._start_writer()
+
+    # ---- 수명 ----
+    def _start_writer(self):
+        # _life 를 잡은 채로 부른다. release() 뒤 처음 쓰면 연결과 스레드를 다시 연다.
+        if self._writer_thread is None:
+            if self._write_conn is None:
+                self._write_conn = make_conn(self.db_path)
+            self._writer_thread = threading.Thread(target=self._write_loop, name="diary-writer", daemon=True)
+            self._writer_thread.start()
+
+    def _enter(self, start_writer=False):
+        with self._life:
+            if start_writer:
+                self._start_writer()
+            self._active += 1
+            self.last_used = time.monotonic()
+
+    def _leave(self, *_):
+        with self._life:
+            self._active -= 1
+            self.last_used = time.monotonic()
+
+    @property
+    def is_open(self):
+        # 쓰기 스레드가 돌고 있거나 읽기 연결을 들고 있는지
+        return self._writer_thread is not None or not self._readers.empty()
+
+    def _stop(self):
+        # _life 를 잡은 채로, 진행 중인 작업이 없을 때만 부른다
+        if self._writer_thread is not None:
+            self._queue.put(None)
+            self._writer_thread.join()
+            self._writer_thread = None
+            with self._write_lock:
+                self._write_conn.close()
+                self._write_conn = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except Empty:
+                break
+
+    def release(self):
+        """하고 있는 작업이 없으면 쓰기 스레드와 연결을 모두 닫고 True.
+
+        닫은 뒤에도 객체는 그대로 쓸 수 있다(다음 읽기/쓰기 때 다시 연다).
+        샤드를 많이 여는 프로세스가 한동안 안 쓴 샤드의 스레드와 파일을 돌려줄 때 쓴다.
+        """
+        with self._life:
+            if self._active:
+                return False
+            self._stop()
+            return True
+
+    # ---- 쓰기 스레드 ----
+    def submit(self, fn, on_rollback=None):
+        """fn(conn) 을 쓰기 스레드에서 실행하도록 넣고 Future 를 돌려준다.
+
+        Future 는 fn 의 변경이 커밋된 뒤에 fn 의 반환값을 갖는다. fn 이 예외를 던지거나
+        묶인 트랜잭션이 커밋되지 못하면 그 예외를 갖고, 이때 on_rollback() 을 쓰기
+        스레드에서 불러 준다(디스크에 만든 파일 정리 등). fn 은 직접 커밋/롤백하지 않는다.
+        """
+        fut = Future()
+        if threading.current_thread() is self._writer_thread or getattr(self._local, "in_writer", False):
+            # 이미 쓰기 연결을 잡은 스레드에서 부르면 대기열을 거치지 않고 그 트랜잭션에서 실행
+            try:
+                fut.set_result(fn(self._write_conn))
+            except BaseException as e:
+                if on_rollback:
+                    on_rollback()
+                fut.set_exception(e)
+            return fut
+        self._enter(start_writer=True)
+        fut.add_done_callback(self._leave)
+        self._queue.put((fn, on_rollback, fut))
+        return fut
+
+    def write(self, fn, on_rollback=None):
+        return self.submit(fn, on_rollback).result()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, stop = [item], False
+            while len(batch) < WRITE_BATCH:
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch):
+        # 쓰기마다 SAVEPOINT 를 두어, 하나가 실패하면 그 쓰기만 되돌리고 나머지는 같이 커밋한다
+        batch = [op for op in batch if op[2].set_running_or_notify_cancel()]
+        results = []
+        with self._write_lock:
+            conn = self._write_conn
+            try:
+                _retry_busy(lambda: conn.execute("BEGIN IMMEDIATE"))
+                for fn, on_rollback, fut in batch:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        results.append((fut, fn(conn), None))
+                    except BaseException as e:
+                        conn.execute("ROLLBACK TO op")
+                        if on_rollback:
+                            on_rollback()
+                        results.append((fut, None, e))
+                    conn.execute("RELEASE op")
+                _retry_busy(conn.commit)
+            except BaseException as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                # 커밋되지 않았으므로 fn 이 성공했던 쓰기도 실패로 알린다
+                failed = {id(fut): err for fut, _, err in results if err is not None}
+                for fn, on_rollback, fut in batch:
+                    if id(fut) in failed:
+                        fut.set_exception(failed[id(fut)])
+                        continue
+                    if on_rollback:
+                        on_rollback()
+                    fut.set_exception(e)
+                return
+        for fut, value, err in results:
+            if err is None:
+                fut.set_result(value)
+            else:
+                fut.set_exception(err)
+
+    @contextmanager
+    def reader(self):
+        self._enter()
+        try:
+            try:
+                conn = self._readers.get_nowait()
+            except Empty:
+                conn = make_conn(self.db_path, read_only=True)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                try:
+                    self._readers.put_nowait(conn)
+                except Exception:
+                    conn.close()
+        finally:
+            self._leave()
+
+    @contextmanager
+    def writer(self):
+        # 호출한 스레드에서 쓰기 연결을 직접 잡는다. 정리 작업처럼 오래 도는 일괄 처리용이며,
+        # 같은 락을 쓰므로 쓰기 스레드와 번갈아 실행된다.
+        self._enter(start_writer=True)
+        try:
+            with self._write_lock:
+                conn = self._write_conn
+                outer = getattr(self._local, "in_writer", False)
+                self._local.in_writer = True
+                try:
+                    yield conn
+                except BaseException:
+                    conn.rollback()
+                    raise
+                else:
+                    conn.commit()
+                finally:
+                    self._local.in_writer = outer
+        finally:
+            self._leave()
+
+    def close(self):
+        with self._life:
+            self._stop()
+
+def _retry_busy(fn, retries=WRITE_RETRIES):
+    # busy_timeout 동안 기다려도 다른 프로세스가 락을 놓지 않으면 조금 쉬었다가 다시
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            msg = str(e)
+            if attempt == retries or not ("locked" in msg or "busy" in msg):
+                raise
+            time.sleep(BUSY_BACKOFF_S * 2 ** attempt)
+
+# ================== 사용자 ==================
+def create_user(db, email, name, pw_hash, user_id=None):
+    # 비밀번호 해시는 호출하는 쪽(diary_auth)에서 만들어 넘긴다.
+    # user_id 를 주면 그 id 로 만든다(샤드에 디렉터리의 사용자 행을 둘 때).
+    def op(conn):
+        c = conn.execute("INSERT INTO users(id, email, name, password_hash) VALUES(?, ?, ?, ?)",
+                         (user_id, email, name, pw_hash))
+        # 기본 테마 설정도 같은 트랜잭션에서 생성(설정 없는 사용자가 남지 않도록)
+        _upsert_settings(conn, c.lastrowid, **DEFAULT_SETTINGS)
+        return c.lastrowid
+    user_id = db.write(op)
+    db.cache.bump(user_id)
+    return user_id
+
+def get_user_by_email(db, email):
+    with db.reader() as conn:
+        return conn.execute("SELECT id, email, name, password_hash FROM users WHERE email = ?",
+                            (email,)).fetchone()
+
+def get_user_by_id(db, user_id):
+    with db.reader() as conn:
+        return conn.execute("SELECT id, email, name, password_hash FROM users WHERE id = ?",
+                            (user_id,)).fetchone()
+
+def update_password_hash(db, user_id, pw_hash, old_hash):
+    # 같은 비밀번호를 새 비용으로 다시 해시했을 때(세션은 그대로).
+    # 그 사이 비밀번호가 바뀌었으면 old_hash 와 달라서 아무것도 하지 않는다. 바꿨으면 True.
+    return db.write(lambda conn: conn.execute(
+        "UPDATE users SET password_hash=? WHERE id=? AND password_hash=?",
+        (pw_hash, user_id, old_hash)).rowcount) > 0
+
+def change_password_hash(db, user_id, pw_hash):
+    # 비밀번호가 바뀌면 이전에 발급한 세션 토큰도 모두 끊는다
+    db.write(lambda conn: conn.execute(
+        "UPDATE users SET password_hash=?, session_gen=session_gen+1 WHERE id=?", (pw_hash, user_id)))
+
+def get_session_gen(db, user_id):
+    with db.reader() as conn:
+        row = conn.execute("SELECT session_gen FROM users WHERE id=?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+def revoke_sessions(db, user_id):
+    db.write(lambda conn: conn.execute("UPDATE users SET session_gen=session_gen+1 WHERE id=?", (user_id,)))
+
+# ================== 태그 ==================
+def parse_tags(tags):
+    # "공부, #개발,,공부" -> ["공부", "개발"] (순서 유지, 중복 제거)
+    out = []
+    for t in (tags or "").split(","):
+        t = t.strip().lstrip("#").strip()
+        if t and t not in out:
+            out.append(t)
+    return out
+
+def sync_entry_tags(conn, entry_id, user_id, tags):
+    conn.execute("DELETE FROM entry_tags WHERE entry_id=?", (entry_id,))
+    conn.executemany("INSERT INTO entry_tags(entry_id, user_id, tag) VALUES (?, ?, ?)",
+                     [(entry_id, user_id, t) for t in parse_tags(tags)])
+
+def _tag_filter(id_col, user_id, tag, prefix=False):
+    # 정확히 일치하거나(기본) 앞부분이 일치하는 태그를 가진 일기만
+    if prefix:
+        cond, params = "tag >= ? AND tag < ?", [tag, tag + "\U0010ffff"]
+    else:
+        cond, params = "tag = ?", [tag]
+    sql = f" AND {id_col} IN (SELECT entry_id FROM entry_tags WHERE user_id=? AND {cond})"
+    return sql, [user_id] + params
+
+@cached_by_user
+def suggest_tags(db, user_id, prefix="", limit=20):
+    # 자주 쓴 태그 순. entries 를 훑지 않고 user_tag_counts 만 읽는다.
+    with db.reader() as conn:
+        if prefix:
+            rows = conn.execute("""
+                SELECT tag, cnt FROM user_tag_counts
+                WHERE user_id=? AND tag >= ? AND tag < ?
+                ORDER BY cnt DESC, tag LIMIT ?
+            """, (user_id, prefix, prefix + "\U0010ffff", limit)).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT tag, cnt FROM user_tag_counts
+                WHERE user_id=? ORDER BY cnt DESC, tag LIMIT ?
+            """, (user_id, limit)).fetchall()
+    return rows
+
+# ================== 일기 ==================
+def _insert_entry(conn, user_id, d, mood_key, mood_score, tags, content):
+    c = conn.execute("""
+        INSERT INTO entries(user_id, d, mood, mood_score, tags, content, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, d, mood_key, mood_score, tags, content, datetime.utcnow().isoformat()))
+    sync_entry_tags(conn, c.lastrowid, user_id, tags)
+    return c.lastrowid
+
+def insert_entry(db, user_id, d, mood_key, mood_score, tags, content):
+    entry_id = db.write(lambda conn: _insert_entry(conn, user_id, d, mood_key, mood_score, tags, content))
+    db.cache.bump(user_id)
+    return entry_id
+
+def save_entry(db, user_id, d, mood_key, mood_score, tags, content, files=()):
+    """일기와 첨부를 한 트랜잭션(커밋 한 번)으로 저장하고 새 id 를 돌려준다.
+
+    files 는 [(kind, 작업 파일, 원래 이름, 썸네일, 미리보기)]. 중간에 실패하면 일기도
+    첨부도 남지 않고, 작업 파일과 이 트랜잭션이 저장소로 옮긴 파일도 지운다.
+    """
+    def op(conn, moved):
+        entry_id = _insert_entry(conn, user_id, d, mood_key, mood_score, tags, content)
+        conn.executemany(INSERT_FILE_SQL, [(entry_id,) + row for row in store_files(conn, db.blob_dir, files, moved)])
+        return entry_id
+    entry_id = staged_write(db, op, staged_paths(files))
+    db.cache.bump(user_id)
+    return entry_id
+
+def update_entry(db, entry_id, user_id, d, mood_key, mood_score, tags, content):
+    def op(conn):
+        c = conn.execute("""
+            UPDATE entries
+            SET d=?, mood=?, mood_score=?, tags=?, content=?, updated_at=?
+            WHERE id=? AND user_id=? AND deleted_at IS NULL
+        """, (d, mood_key, mood_score, tags, content, datetime.utcnow().isoformat(), entry_id, user_id))
+        if c.rowcount:
+            sync_entry_tags(conn, entry_id, user_id, tags)
+    db.write(op)
+    db.cache.bump(user_id)
+
+def delete_entry(db, entry_id, user_id):
+    # 휴지통으로 옮긴다. 태그 색인에서만 빼고 첨부와 본문은 그대로 둔다.
+    def op(conn):
+        # 시각은 쓰기 스레드에서 잰다(대기열에서 기다린 동안 다른 변경보다 이른 시각이 찍히지 않게)
+        now = datetime.utcnow().isoformat()
+        c = conn.execute("""
+            UPDATE entries SET deleted_at=?, updated_at=?
+            WHERE id=? AND user_id=? AND deleted_at IS NULL
+        """, (now, now, entry_id, user_id))
+        if c.rowcount:
+            conn.execute("DELETE FROM entry_tags WHERE entry_id=?", (entry_id,))
+    db.write(op)
+    db.cache.bump(user_id)
+
+def restore_entry(db, entry_id, user_id):
+    def op(conn):
+        c = conn.execute("""
+            UPDATE entries SET deleted_at=NULL, updated_at=?
+            WHERE id=? AND user_id=? AND deleted_at IS NOT NULL
+        """, (datetime.utcnow().isoformat(), entry_id, user_id))
+        if c.rowcount:
+            tags = conn.execute("SELECT tags FROM entries WHERE id=?", (entry_id,)).fetchone()[0]
+            sync_entry_tags(conn, entry_id, user_id, tags)
+    db.write(op)
+    db.cache.bump(user_id)
+
+def purge_entry(db, entry_id, user_id):
+    # 휴지통의 일기를 바로 지운다. files 는 CASCADE 로 지워지고 트리거가 참조 수를 내리며,
+    # 디스크의 파일은 정리 작업(reclaim_blobs)이 나중에 지운다.
+    db.write(lambda conn: conn.execute("DELETE FROM entries WHERE id=? AND user_id=? AND deleted_at IS NOT NULL",
+                                       (entry_id, user_id)))
+    db.cache.bump(user_id)
+
+def purge_expired(db, before, limit=500):
+    """before(ISO 시각) 전에 휴지통으로 옮긴 일기를 최대 limit 개 지우고 지운 수를 돌려준다."""
+    def op(conn):
+        rows = conn.execute("""
+            SELECT id, user_id FROM entries
+            WHERE deleted_at IS NOT NULL AND deleted_at < ? LIMIT ?
+        """, (before, limit)).fetchall()
+        conn.executemany("DELETE FROM entries WHERE id=?", [(r[0],) for r in rows])
+        return rows
+    rows = db.write(op)
+    for uid in {r[1] for r in rows}:
+        db.cache.bump(uid)
+    return len(rows)
+
+@cached_by_user
+def get_trash(db, user_id):
+    # (id, d, mood, tags, content, deleted_at) 최근에 지운 것부터
+    with db.reader() as conn:
+        return conn.execute("""
+            SELECT id, d, mood, tags, content, deleted_at FROM entries
+            WHERE user_id=? AND deleted_at IS NOT NULL ORDER BY deleted_at DESC
+        """, (user_id,)).fetchall()
+
+def get_entries(db, user_id, q=None, mood_key=None, tag=None, tag_prefix=False,
+                after=None, limit=None):
+    if q:
+        return [row for row, _ in search_entries(db, user_id, q, mood_key=mood_key,
+                                                 tag=tag, tag_prefix=tag_prefix, limit=limit)]
+    base = ("SELECT id, d, mood, mood_score, tags, content, created_at FROM entries"
+            " WHERE user_id=? AND deleted_at IS NULL")
+    params = [user_id]
+    if mood_key:
+        base += " AND mood = ?"
+        params.append(mood_key)
+    if tag:
+        sql, tag_params = _tag_filter("id", user_id, tag, tag_prefix)
+        base += sql
+        params += tag_params
+    if after:
+        # 키셋 페이지네이션: 직전 페이지 마지막 (d, id) 보다 오래된 것부터
+        base += " AND (d, id) < (?, ?)"
+        params += list(after)
+    base += " ORDER BY d DESC, id DESC"
+    if limit:
+        base += " LIMIT ?"
+        params.append(limit)
+    with db.reader() as conn:
+        return conn.execute(base, params).fetchall()
+
+@cached_by_user
+def get_entries_page(db, user_id, q=None, mood_key=None, tag=None, tag_prefix=False,
+                     cursor=None, limit=PAGE_SIZE):
+    """한 페이지 분량의 ([(row, files)], {id: snippet}, 다음 커서) 를 돌려준다.
+
+    날짜순 목록의 커서는 마지막 행의 (d, id), 검색 결과는 순위상의 위치다.
+    다음 커서가 None 이면 마지막 페이지다.
+    """
+    if q:
+        offset = cursor or 0
+        hits = search_entries(db, user_id, q, mood_key=mood_key, tag=tag,
+                              tag_prefix=tag_prefix, limit=limit + 1, offset=offset)
+        next_cursor = offset + limit if len(hits) > limit else None
+    else:
+        rows = get_entries(db, user_id, mood_key=mood_key, tag=tag, tag_prefix=tag_prefix,
+                           after=cursor, limit=limit + 1)
+        hits = [(r, None) for r in rows]
+        next_cursor = (rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    hits = hits[:limit]
+    snippets = {row[0]: snip for row, snip in hits if snip}
+    return attach_files(db, [row for row, _ in hits]), snippets, next_cursor
+
+def get_entries_by_ids(db, user_id, ids):
+    # ids 순서대로 그 사용자의 (휴지통에 없는) 일기 행. 없는 id 는 빠진다.
+    found = {}
+    with db.reader() as conn:
+        for i in range(0, len(ids), IN_BATCH):
+            chunk = list(ids[i:i + IN_BATCH])
+            marks = ",".join("?" * len(chunk))
+            for r in conn.execute(f"""
+                SELECT id, d, mood, mood_score, tags, content, created_at FROM entries
+                WHERE user_id=? AND deleted_at IS NULL AND id IN ({marks})
+            """, [user_id] + chunk):
+                found[r[0]] = r
+    return [found[i] for i in ids if i in found]
+
+# ================== 검색 ==================
+# snippet() 강조 표시. 화면에서 이스케이프한 뒤 태그로 바꿔 끼운다.
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+TRIGRAM_MIN = 3     # trigram 색인은 3글자 이상 검색어만 쓸 수 있음
+
+def _split_terms(q):
+    indexed, short = [], []
+    for t in (q or "").split():
+        (indexed if len(t) >= TRIGRAM_MIN else short).append(t)
+    return indexed, short
+
+def search_entries(db, user_id, q, mood_key=None, tag=None, tag_prefix=False,
+                   limit=None, offset=0):
+    """키워드 검색. BM25 순위대로 (row, snippet) 목록을 돌려준다.
+
+    3글자 이상 검색어는 FTS5 색인으로 찾고 순위를 매긴다. 그보다 짧은 검색어는
+    색인을 쓸 수 없어 LIKE 조건으로 거르며, 이때 snippet 은 None 이다.
+    """
+    indexed, short = _split_terms(q)
+    cols = "e.id, e.d, e.mood, e.mood_score, e.tags, e.content, e.created_at"
+    params = []
+    if indexed:
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in indexed)
+        base = f"""
+            SELECT {cols},
+                   snippet(entries_fts, -1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 16)
+            FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid
+            WHERE entries_fts MATCH ? AND e.user_id=? AND e.deleted_at IS NULL"""
+        params += [match, user_id]
+    else:
+        base = f"SELECT {cols}, NULL FROM entries e WHERE e.user_id=? AND e.deleted_at IS NULL"
+        params.append(user_id)
+    for t in short:
+        base += " AND (e.content LIKE ? OR e.tags LIKE ?)"
+        params += [f"%{t}%", f"%{t}%"]
+    if mood_key:
+        base += " AND e.mood = ?"
+        params.append(mood_key)
+    if tag:
+        sql, tag_params = _tag_filter("e.id", user_id, tag, tag_prefix)
+        base += sql
+        params += tag_params
+    # 태그 일치에 본문보다 높은 가중치
+    base += " ORDER BY bm25(entries_fts, 1.0, 2.0), e.d DESC, e.id DESC" if indexed else " ORDER BY e.d DESC, e.id DESC"
+    if limit:
+        base += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    with db.reader() as conn:
+        return [(r[:7], r[7]) for r in conn.execute(base, params)]
+
+# ================== 미디어 저장소(내용 주소) ==================
+# 같은 내용의 파일은 한 번만 저장한다. 경로는 blob_dir/ab/cd/<sha256>.<ext>
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def blob_path(blob_dir, sha, ext):
+    return os.path.join(blob_dir, sha[:2], sha[2:4], sha + ext)
+
+def put_blob(conn, blob_dir, src_path, moved=None):
+    """작업 파일을 저장소로 옮기고 저장된 경로를 돌려준다.
+
+    같은 내용이 이미 있으면 작업 파일은 지우고 기존 경로를 쓴다.
+    참조 수는 files 트리거가 올리므로 여기서는 0 으로 등록한다.
+    moved 목록을 주면 새로 옮겨 놓은 경로를 넣는다(롤백 때 지울 것).
+    """
+    sha = file_sha256(src_path)
+    row = conn.execute("SELECT path FROM blobs WHERE sha256=?", (sha,)).fetchone()
+    if row:
+        dest = row[0]
+        if os.path.exists(dest):
+            os.remove(src_path)
+            return dest
+    else:
+        dest = blob_path(blob_dir, sha, os.path.splitext(src_path)[1].lower())
+        conn.execute("INSERT INTO blobs(path, sha256, size) VALUES (?, ?, ?)",
+                     (dest, sha, os.path.getsize(src_path)))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(src_path, dest)
+    if moved is not None:
+        moved.append(dest)
+    return dest
+
+def remove_quietly(paths):
+    # 작업 파일 정리용: 없는 경로, 빈 값, 중복은 건너뛰고 지우다 실패해도 넘어간다
+    for p in dict.fromkeys(paths):
+        if p:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+def staged_write(db, fn, staged=()):
+    """fn(conn, moved) 를 쓰기 스레드에서 실행하고, 커밋되면 그 반환값을 돌려준다.
+
+    put_blob(..., moved) 로 옮긴 파일은 커밋되기 전까지 가리키는 행이 없으므로, 롤백되면
+    쓰기 스레드가 (같은 내용이 다시 올라오기 전에) 그 파일들을 지운다. 남은 작업 파일(staged)도 지운다.
+    """
+    moved = []
+    try:
+        return db.write(lambda conn: fn(conn, moved), on_rollback=lambda: remove_quietly(moved))
+    except BaseException:
+        remove_quietly(staged)
+        raise
+
+def _reclaim_unreferenced(conn, limit=None):
+    """참조 수가 0 인 저장소 파일을 지우고 (지운 경로, 되찾은 바이트, [(경로, 오류)]) 를 돌려준다.
+
+    쓰기 트랜잭션 안에서 부르므로 그 사이 같은 내용이 다시 올라와도 put_blob 과 엇갈리지 않는다.
+    지우지 못한 파일은 행을 남겨 다음 번에 다시 시도한다.
+    """
+    sql = "SELECT path, size FROM blobs WHERE refcount <= 0"
+    rows = conn.execute(sql + " LIMIT ?", (limit,)).fetchall() if limit else conn.execute(sql).fetchall()
+    removed, reclaimed, failed = [], 0, []
+    for path, size in rows:
+        try:
+            os.remove(path)
+            reclaimed += size or 0
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            failed.append((path, e))
+            continue
+        removed.append(path)
+    conn.executemany("DELETE FROM blobs WHERE path=?", [(p,) for p in removed])
+    return removed, reclaimed, failed
+
+def reclaim_blobs(db, limit=500):
+    # 정리 작업용. 한 번에 limit 개까지 한 트랜잭션으로 처리
+    with db.writer() as conn:
+        return _reclaim_unreferenced(conn, limit)
+
+def migrate_media(db):
+    """기존(평평한 uuid 이름) 미디어를 내용 주소 저장소로 옮기고 중복을 합친다.
+
+    파일 하나씩 따로 커밋하므로 중간에 멈춰도 다시 실행하면 이어서 진행한다.
+    (옮긴 파일 수, 중복이라 합친 파일 수) 를 돌려준다.
+    """
+    moved = merged = 0
+    with db.reader() as conn:
+        legacy = [r[0] for r in conn.execute("SELECT path FROM blobs WHERE sha256 IS NULL")]
+    for old in legacy:
+        if not os.path.exists(old):
+            continue
+        with db.writer() as conn:
+            sha = file_sha256(old)
+            row = conn.execute("SELECT path FROM blobs WHERE sha256=?", (sha,)).fetchone()
+            if row:
+                new = row[0]
+            else:
+                new = blob_path(db.blob_dir, sha, os.path.splitext(old)[1].lower())
+                conn.execute("INSERT INTO blobs(path, sha256, size) VALUES (?, ?, ?)",
+                             (new, sha, os.path.getsize(old)))
+            for col in ("path", "thumb_path", "preview_path"):
+                conn.execute(f"UPDATE files SET {col}=? WHERE {col}=?", (new, old))
+            if row:
+                merged += 1
+            else:
+                os.makedirs(os.path.dirname(new), exist_ok=True)
+                os.replace(old, new)
+                moved += 1
+            _reclaim_unreferenced(conn)
+    return moved, merged
+
+# ================== 파일 ==================
+FILE_COLS = "kind, path, original_name, thumb_path, preview_path"
+
+INSERT_FILE_SQL = """
+    INSERT INTO files(entry_id, kind, path, original_name, thumb_path, preview_path)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+def staged_paths(files):
+    return [p for f in files for p in (f[1], f[3], f[4]) if p]
+
+def store_files(conn, blob_dir, files, moved=None):
+    """[(kind, 작업 파일, 원래 이름, 썸네일, 미리보기)] 를 저장소로 옮기고 files 행 값(entry_id 제외)을 돌려준다."""
+    rows = []
+    for kind, path, original_name, thumb_path, preview_path in files:
+        # 작은 이미지는 원본/썸네일/미리보기가 같은 파일일 수 있다
+        stored = {p: put_blob(conn, blob_dir, p, moved)
+                  for p in dict.fromkeys([path, thumb_path, preview_path]) if p}
+        rows.append((kind, stored[path], original_name, stored.get(thumb_path), stored.get(preview_path)))
+    return rows
+
+def insert_files(db, entry_id, files):
+    """이미 있는 일기에 첨부 여러 개를 한 트랜잭션으로 붙인다(files 형식은 save_entry 와 같음)."""
+    def op(conn, moved):
+        conn.executemany(INSERT_FILE_SQL, [(entry_id,) + row for row in store_files(conn, db.blob_dir, files, moved)])
+        return conn.execute("SELECT user_id FROM entries WHERE id=?", (entry_id,)).fetchone()
+    owner = staged_write(db, op, staged_paths(files))
+    if owner:
+        db.cache.bump(owner[0])
+
+def insert_file(db, entry_id, kind, path, original_name, thumb_path=None, preview_path=None):
+    # path 들은 작업 파일 경로. 저장소로 옮긴 경로가 files 에 기록된다.
+    insert_files(db, entry_id, [(kind, path, original_name, thumb_path, preview_path)])
+
+def get_files(db, entry_id, user_id):
+    with db.reader() as conn:
+        return conn.execute("""
+            SELECT f.kind, f.path, f.original_name, f.thumb_path, f.preview_path
+            FROM files f
+            JOIN entries e ON e.id = f.entry_id
+            WHERE f.entry_id=? AND e.user_id=? AND e.deleted_at IS NULL
+            ORDER BY f.id ASC
+        """, (entry_id, user_id)).fetchall()
+
+def delete_files_of_entry(db, entry_id, user_id):
+    # 행만 지운다. 참조가 끊긴 디스크의 파일은 정리 작업(reclaim_blobs)이 지운다.
+    db.write(lambda conn: conn.execute("""
+        DELETE FROM files
+        WHERE entry_id IN (SELECT id FROM entries WHERE id=? AND user_id=?)
+    """, (entry_id, user_id)))
+    db.cache.bump(user_id)
+
+@cached_by_user
+def get_entries_with_files(db, user_id, mood_key=None, q=None, tag=None, tag_prefix=False):
+    return attach_files(db, get_entries(db, user_id, q=q, mood_key=mood_key,
+                                        tag=tag, tag_prefix=tag_prefix))
+
+IN_BATCH = 500     # IN (...) 한 번에 넣을 id 수(SQLite 변수 개수 제한 아래로)
+
+def attach_files(db, rows):
+    """일기 행마다 첨부를 붙여 (row, files) 목록으로 돌려준다.
+
+    일기마다 따로 조회하지 않고 entry_id IN (...) 로 한꺼번에 읽어 묶는다.
+    """
+    by_entry = {r[0]: [] for r in rows}
+    ids = list(by_entry)
+    with db.reader() as conn:
+        for i in range(0, len(ids), IN_BATCH):
+            chunk = ids[i:i + IN_BATCH]
+            marks = ",".join("?" * len(chunk))
+            for eid, *f in conn.execute(f"""
+                SELECT entry_id, {FILE_COLS} FROM files
+                WHERE entry_id IN ({marks})
+                ORDER BY entry_id, id
+            """, chunk):
+                by_entry[eid].append(tuple(f))
+    return [(r, by_entry[r[0]]) for r in rows]
+
+# ================== 통계 ==================
+# entries 를 훑지 않고 트리거가 유지하는 요약 테이블만 읽는다
+@cached_by_user
+def get_mood_counts(db, user_id):
+    with db.reader() as conn:
+        return conn.execute("""
+            SELECT mood, SUM(cnt) FROM mood_monthly
+            WHERE user_id=? GROUP BY mood ORDER BY 2 DESC
+        """, (user_id,)).fetchall()
+
+@cached_by_user
+def get_monthly_stats(db, user_id):
+    # (월, 작성 수, 감정 강도 합)
+    with db.reader() as conn:
+        return conn.execute("""
+            SELECT period, SUM(cnt), SUM(score_sum) FROM mood_monthly
+            WHERE user_id=? GROUP BY period ORDER BY period
+        """, (user_id,)).fetchall()
+
+@cached_by_user
+def get_daily_stats(db, user_id, since):
+    # since(포함) 이후의 (날짜, 작성 수, 감정 강도 합)
+    with db.reader() as conn:
+        return conn.execute("""
+            SELECT period, SUM(cnt), SUM(score_sum) FROM mood_daily
+            WHERE user_id=? AND period >= ? GROUP BY period ORDER BY period
+        """, (user_id, since)).fetchall()
+
+# ================== 사용자 설정(테마) ==================
+@cached_by_user
+def get_user_settings(db, user_id):
+    with db.reader() as conn:
+        row = conn.execute("""
+            SELECT theme, "primary", bg_style, font_scale
+            FROM user_settings WHERE user_id=?
+        """, (user_id,)).fetchone()
+    if not row:
+        return dict(DEFAULT_SETTINGS)
+    return {"theme":row[0], "primary":row[1], "bg_style":row[2], "font_scale":row[3]}
+
+def _upsert_settings(conn, user_id, theme, primary, bg_style, font_scale):
+    conn.execute("""
+        INSERT INTO user_settings(user_id, theme, "primary", bg_style, font_scale, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            theme=excluded.theme,
+            "primary"=excluded."primary",
+            bg_style=excluded.bg_style,
+            font_scale=excluded.font_scale,
+            updated_at=excluded.updated_at
+    """, (user_id, theme, primary, bg_style, font_scale, datetime.utcnow().isoformat()))
+
+def upsert_user_settings(db, user_id, theme, primary, bg_style, font_scale):
+    db.write(lambda conn: _upsert_settings(conn, user_id, theme, primary, bg_style, font_scale))
+    db.cache.bump(user_id)
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="diary.db 관리 도구")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("migrate", help="대기 중인 스키마 마이그레이션 적용")
+    sub.add_parser("check-plans", help="자주 쓰는 조회의 실행 계획 점검")
+    sub.add_parser("fts-backfill", help="검색 색인을 entries 전체로 다시 만들기")
+    sub.add_parser("migrate-media", help="기존 미디어 파일을 내용 주소 저장소로 옮기기")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "migrate-media":
+        db = DiaryDB(args.db)
+        try:
+            moved, merged = migrate_media(db)
+        finally:
+            db.close()
+        print(f"{moved}개 파일을 옮기고 중복 {merged}개를 합쳤습니다.")
+        return 0
+
+    conn = make_conn(args.db)
+    try:
+        if args.cmd == "migrate":
+            before = schema_version(conn)
+            init_db(conn)
+            print(f"schema version {before} -> {schema_version(conn)}")
+        elif args.cmd == "check-plans":
+            problems = check_query_plans(conn)
+            for name, plan in problems:
+                print(f"[느림] {name}: {' / '.join(plan)}")
+            if problems:
+                return 1
+            print("모든 조회가 인덱스를 사용합니다.")
+        elif args.cmd == "fts-backfill":
+            init_db(conn)
+            rebuild_fts(conn)
+            conn.commit()
+            n = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            print(f"{n}개 일기를 다시 색인했습니다.")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,287 @@
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date
+
+from diary_db import (
+    DB_PATH, EMO_KEYS, INSERT_FILE_SQL, SQL_NOW, DiaryDB,
+    file_sha256, get_user_by_email, parse_tags, remove_quietly, staged_paths, staged_write, store_files,
+)
+from diary_media import ingest_audio, ingest_image
+
+# ================== 공통 상수 ==================
+IMPORT_BATCH = 500          # 한 트랜잭션(= 한 번의 fsync)에 넣을 일기 수
+DEFAULT_SCORE = 3           # 강도가 없으면 작성 화면의 기본값
+CSV_FILES_SEP = ";"         # CSV 의 files 칸: "a.jpg;b.m4a"
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+AUDIO_EXTS = {".mp3", ".wav", ".m4a", ".ogg"}
+
+class ImportRecordError(ValueError):
+    pass
+
+class ImportAborted(RuntimeError):
+    """묶음을 쓰다 실패해 가져오기를 멈춤(손상된 첨부, DB 오류 등).
+
+    records 는 실패한 기록 순번 (처음, 끝) - 첨부 문제면 그 기록 하나. committed 는 이미
+    커밋된 진행 위치로, 같은 파일로 다시 실행하면 그다음부터 이어서 넣는다.
+    """
+
+    def __init__(self, records, reason, committed=0):
+        first, last = records
+        where = f"{first}번째 기록" if first == last else f"{first}~{last}번째 기록"
+        super().__init__(f"{where}: {reason}")
+        self.records = records
+        self.reason = reason
+        self.committed = committed
+
+# ================== 읽기/검증 ==================
+def read_records(path):
+    """(순번, dict) 를 차례로 돌려준다. 확장자가 .csv 면 CSV, 아니면 JSON Lines.
+
+    순번은 빈 줄을 뺀 1부터의 기록 번호로, 이어서 가져오기의 기준이 된다.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from enumerate(csv.DictReader(f), 1)
+            return
+        n = 0
+        for line in f:
+            if not line.strip():
+                continue
+            n += 1
+            try:
+                rec = json.loads(line)
+            except ValueError as e:
+                rec = ImportRecordError(f"JSON 형식 오류: {e}")
+            yield n, rec
+
+def _media_path(media_dir, rel):
+    # media_dir 밖(../, 절대 경로)을 가리키는 경로는 받지 않는다
+    if not media_dir:
+        raise ImportRecordError(f"첨부 파일 {rel!r} 이 있지만 미디어 폴더를 지정하지 않았습니다.")
+    root = os.path.realpath(media_dir)
+    full = os.path.realpath(os.path.join(root, rel))
+    if os.path.commonpath([root, full]) != root:
+        raise ImportRecordError(f"미디어 폴더 밖의 경로입니다: {rel!r}")
+    if not os.path.isfile(full):
+        raise ImportRecordError(f"첨부 파일이 없습니다: {rel!r}")
+    return full
+
+def normalize_record(rec, media_dir=None):
+    """기록 하나를 검증해 (d, mood, score, tags, content, [(kind, 경로, 이름)]) 로 바꾼다."""
+    if isinstance(rec, Exception):
+        raise rec
+    if not isinstance(rec, dict):
+        raise ImportRecordError("기록은 객체여야 합니다.")
+    raw_d = str(rec.get("d") or rec.get("date") or "").strip()
+    try:
+        d = date.fromisoformat(raw_d[:10]).isoformat()
+    except ValueError:
+        raise ImportRecordError(f"날짜 형식 오류: {raw_d!r} (YYYY-MM-DD)") from None
+
+    mood = str(rec.get("mood") or "").strip().lower()
+    if mood not in EMO_KEYS:
+        raise ImportRecordError(f"알 수 없는 감정: {mood!r} (가능: {', '.join(EMO_KEYS)})")
+
+    raw_score = rec.get("mood_score")
+    try:
+        score = DEFAULT_SCORE if raw_score in (None, "") else int(raw_score)
+    except (TypeError, ValueError):
+        score = 0
+    if not 1 <= score <= 5:
+        raise ImportRecordError(f"감정 강도는 1~5 사이여야 합니다: {raw_score!r}")
+
+    tags = rec.get("tags") or ""
+    tags = ", ".join(parse_tags(", ".join(tags) if isinstance(tags, list) else str(tags)))
+    content = str(rec.get("content") or "")
+
+    files = rec.get("files") or []
+    if isinstance(files, str):
+        files = [p.strip() for p in files.split(CSV_FILES_SEP) if p.strip()]
+    media = []
+    for rel in files:
+        ext = os.path.splitext(rel)[1].lower()
+        kind = "image" if ext in IMAGE_EXTS else "audio" if ext in AUDIO_EXTS else None
+        if kind is None:
+            raise ImportRecordError(f"지원하지 않는 첨부 형식: {rel!r}")
+        media.append((kind, _media_path(media_dir, rel), os.path.basename(rel)))
+    if not content.strip() and not media:
+        raise ImportRecordError("내용과 첨부 파일이 모두 비어 있습니다.")
+    return d, mood, score, tags, content, media
+
+# ================== 쓰기 ==================
+def _ingest(pool, batch, staging_dir):
+    # 묶음의 첨부를 한꺼번에 변환. 실패하면 만든 파일을 지우고 예외를 그대로 던진다
+    futs = []       # (기록 순번, 원래 이름, future)
+    for n, rec in batch:
+        for kind, path, oname in rec[5]:
+            if kind == "image":
+                futs.append((n, oname, pool.submit(ingest_image, path, staging_dir)))
+            else:
+                futs.append((n, oname, pool.submit(_ingest_audio_path, path, staging_dir)))
+    wait([f for _, _, f in futs])
+    done = [f.result() for _, _, f in futs if f.exception() is None]
+    errors = [(n, oname, f.exception()) for n, oname, f in futs if f.exception() is not None]
+    if errors:
+        remove_quietly([p for r in done for p in (r if isinstance(r, tuple) else (r,))])
+        n, oname, e = errors[0]
+        raise ImportAborted((n, n), f"첨부 파일 {oname!r} 을 처리하지 못했습니다 ({e})") from e
+    return iter(done)
+
+def _ingest_audio_path(path, out_dir):
+    with open(path, "rb") as src:
+        return ingest_audio(src, out_dir)
+
+def _write_batch(db, user_id, source_sha, batch, done, pool, staging_dir):
+    """검증된 기록 묶음을 한 트랜잭션으로 넣고 진행 위치(done)를 같이 커밋한다."""
+    staged = _ingest(pool, batch, staging_dir)
+    specs = []      # 일기마다 [(kind, 작업 파일, 원래 이름, 썸네일, 미리보기)]
+    for _, rec in batch:
+        media = []
+        for kind, _, oname in rec[5]:
+            if kind == "image":
+                path, thumb, preview = next(staged)
+            else:
+                path, thumb, preview = next(staged), None, None
+            media.append((kind, path, oname, thumb, preview))
+        specs.append(media)
+    def op(conn, moved):
+        # 쓰기 스레드가 연결을 잡고 있어 id 를 미리 정해 executemany 로 넣을 수 있다
+        base = conn.execute("""
+            SELECT MAX(COALESCE((SELECT MAX(id) FROM entries), 0),
+                       COALESCE((SELECT seq FROM sqlite_sequence WHERE name='entries'), 0))
+        """).fetchone()[0]
+        entries, tags, files = [], [], []
+        for i, ((_, (d, mood, score, tag_s, content, _)), media) in enumerate(zip(batch, specs), 1):
+            eid = base + i
+            entries.append((eid, user_id, d, mood, score, tag_s, content))
+            tags += [(eid, user_id, t) for t in parse_tags(tag_s)]
+            files += [(eid,) + row for row in store_files(conn, db.blob_dir, media, moved)]
+        conn.executemany(f"""
+            INSERT INTO entries(id, user_id, d, mood, mood_score, tags, content, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, {SQL_NOW})
+        """, entries)
+        conn.executemany("INSERT INTO entry_tags(entry_id, user_id, tag) VALUES (?, ?, ?)", tags)
+        conn.executemany(INSERT_FILE_SQL, files)
+        _save_progress(conn, user_id, source_sha, done)
+        return len(entries), len(files)
+    # 롤백되면 저장소로 옮긴 파일과 남은 작업 파일을 같이 지운다
+    counts = staged_write(db, op, [p for media in specs for p in staged_paths(media)])
+    db.cache.bump(user_id)
+    return counts
+
+def _write_batch_or_abort(db, user_id, source_sha, batch, done, pool, staging_dir):
+    # 실패하면 어느 기록에서 멈췄는지와 커밋된 위치를 붙여 ImportAborted 로
+    try:
+        return _write_batch(db, user_id, source_sha, batch, done, pool, staging_dir)
+    except ImportAborted as e:
+        e.committed = import_progress(db, user_id, source_sha)
+        raise
+    except Exception as e:
+        first = batch[0][0] if batch else done
+        raise ImportAborted((first, done), str(e), import_progress(db, user_id, source_sha)) from e
+
+def _save_progress(conn, user_id, source_sha, done):
+    conn.execute(f"""
+        INSERT INTO import_progress(user_id, source_sha256, done, updated_at)
+        VALUES (?, ?, ?, {SQL_NOW})
+        ON CONFLICT(user_id, source_sha256) DO UPDATE SET done=excluded.done, updated_at=excluded.updated_at
+    """, (user_id, source_sha, done))
+
+def import_progress(db, user_id, source_sha):
+    with db.reader() as conn:
+        row = conn.execute("SELECT done FROM import_progress WHERE user_id=? AND source_sha256=?",
+                           (user_id, source_sha)).fetchone()
+    return row[0] if row else 0
+
+def import_entries(db, user_id, source_path, media_dir=None, batch_size=IMPORT_BATCH,
+                   pool=None, staging_dir=None, progress=None):
+    """JSON Lines/CSV 파일의 일기를 batch_size 개씩 한 트랜잭션으로 가져온다.
+
+    묶음마다 진행 위치를 같은 트랜잭션에 기록하므로, 중간에 멈춘 뒤 같은 파일로
+    다시 실행하면 커밋된 기록은 건너뛰고 이어서 넣는다(중복 없음).
+    progress(처리한 수, 전체 수) 는 묶음을 커밋할 때마다 불린다.
+    잘못된 기록은 넣지 않고 (순번, 사유) 목록으로 돌려준다. 묶음을 쓰다 실패하면
+    (손상된 첨부 등) 그 묶음만 되돌리고 ImportAborted 를 던진다.
+    돌려주는 값: {"imported", "files", "skipped", "total", "errors"}
+    """
+    source_sha = file_sha256(source_path)
+    start = import_progress(db, user_id, source_sha)
+    total = sum(1 for _ in read_records(source_path))
+    staging_dir = staging_dir or os.path.join(os.path.dirname(db.blob_dir), "staging")
+    os.makedirs(staging_dir, exist_ok=True)
+    own_pool = pool is None
+    pool = pool or ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 2)))
+
+    result = {"imported": 0, "files": 0, "skipped": min(start, total), "total": total, "errors": []}
+    batch, n = [], start
+    try:
+        if progress:
+            progress(min(start, total), total)
+        for n, rec in read_records(source_path):
+            if n <= start:
+                continue
+            try:
+                batch.append((n, normalize_record(rec, media_dir)))
+            except ImportRecordError as e:
+                result["errors"].append((n, str(e)))
+            if len(batch) >= batch_size:
+                added, nfiles = _write_batch_or_abort(db, user_id, source_sha, batch, n, pool, staging_dir)
+                result["imported"] += added
+                result["files"] += nfiles
+                batch = []
+                if progress:
+                    progress(n, total)
+        if n > start:
+            # 남은 묶음(비어 있어도 잘못된 기록만 있었다면 진행 위치는 기록)
+            added, nfiles = _write_batch_or_abort(db, user_id, source_sha, batch, n, pool, staging_dir)
+            result["imported"] += added
+            result["files"] += nfiles
+        if progress:
+            progress(total, total)
+    finally:
+        if own_pool:
+            pool.shutdown()
+    return result
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="다른 일기 앱에서 내보낸 JSON Lines/CSV 가져오기")
+    parser.add_argument("source", help=".jsonl 또는 .csv (열: d, mood, mood_score, tags, content, files)")
+    parser.add_argument("--user", required=True, help="가져올 계정의 이메일")
+    parser.add_argument("--media", help="files 에 적힌 상대 경로의 기준 폴더")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--batch", type=int, default=IMPORT_BATCH)
+    args = parser.parse_args(argv)
+
+    db = DiaryDB(args.db)
+    try:
+        user = get_user_by_email(db, args.user)
+        if not user:
+            print(f"계정이 없습니다: {args.user}", file=sys.stderr)
+            return 1
+
+        def report(done, total):
+            print(f"\r{done}/{total}", end="", file=sys.stderr, flush=True)
+
+        try:
+            result = import_entries(db, user[0], args.source, args.media, args.batch, progress=report)
+        except ImportAborted as e:
+            print(f"\n가져오기를 멈췄습니다. {e}\n"
+                  f"{e.committed}번째 기록까지는 저장되었고, 같은 명령을 다시 실행하면 이어서 가져옵니다.",
+                  file=sys.stderr)
+            return 1
+    finally:
+        db.close()
+    print(file=sys.stderr)
+    for n, msg in result["errors"]:
+        print(f"[건너뜀] {n}번째 기록: {msg}", file=sys.stderr)
+    print(f"{result['imported']}개 일기, 첨부 {result['files']}개를 가져왔습니다"
+          f" (이전에 가져온 {result['skipped']}개 건너뜀, 오류 {len(result['errors'])}개).")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
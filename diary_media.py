@@ -0,0 +1,144 @@
+import os
+import uuid
+from concurrent.futures import wait
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from diary_db import remove_quietly
+
+class UploadTooLarge(ValueError):
+    pass
+
+class BadImage(ValueError):
+    # 열 수 없거나 깨진 이미지(확장자만 그림인 파일, 너무 큰 픽셀 수 등)
+    pass
+
+# ================== 이미지 규격 ==================
+MAX_EDGE = 2560            # 원본도 긴 변을 이 길이로 제한해서 저장
+PREVIEW_EDGE = 1280        # 크게 보기용
+GRID_EDGE = 360            # 목록 3열 격자용 썸네일
+QUALITY = 82
+
+AUDIO_CHUNK = 1 << 20              # 음성은 1MB 씩 나눠 디스크로 복사
+MAX_AUDIO_BYTES = 200 << 20        # 음성 파일 하나의 최대 크기
+
+# WebP 를 못 쓰는 Pillow 빌드면 JPEG 로 저장
+USE_WEBP = features.check("webp")
+IMG_EXT = ".webp" if USE_WEBP else ".jpg"
+
+def _normalize(image):
+    # 휴대폰 사진의 EXIF 회전 정보를 실제 픽셀에 반영
+    image = ImageOps.exif_transpose(image)
+    keep_alpha = USE_WEBP and (image.mode in ("RGBA", "LA") or "transparency" in image.info)
+    return image.convert("RGBA" if keep_alpha else "RGB")
+
+def _fit(image, edge):
+    if max(image.size) <= edge:
+        return image
+    image = image.copy()
+    image.thumbnail((edge, edge), Image.LANCZOS)
+    return image
+
+def _save(image, path):
+    if USE_WEBP:
+        image.save(path, "WEBP", quality=QUALITY, method=4)
+    else:
+        image.save(path, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+
+def ingest_image(src, out_dir):
+    """업로드 이미지를 규격에 맞게 다시 인코딩하고 파생 이미지를 만든다.
+
+    (원본, 격자 썸네일, 미리보기) 경로를 돌려준다. 원본은 긴 변 MAX_EDGE 이하로
+    줄여 저장하고, 더 작은 크기가 필요 없는 파생본은 원본 경로를 그대로 쓴다.
+    """
+    name = getattr(src, "name", src)
+    try:
+        with Image.open(src) as raw:
+            # 큰 JPEG 은 디코딩 단계에서부터 줄여 읽는다
+            raw.draft("RGB", (MAX_EDGE, MAX_EDGE))
+            image = _fit(_normalize(raw), MAX_EDGE)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise BadImage(f"{os.path.basename(str(name))}: 이미지를 읽을 수 없습니다.") from e
+
+    stem = os.path.join(out_dir, uuid.uuid4().hex)
+    path = stem + IMG_EXT
+    written = [path]
+    try:
+        _save(image, path)
+        derived = []
+        for suffix, edge in (("_preview", PREVIEW_EDGE), ("_grid", GRID_EDGE)):
+            if max(image.size) > edge:
+                image = _fit(image, edge)      # 직전 크기에서 이어서 줄임
+                dpath = stem + suffix + IMG_EXT
+                written.append(dpath)
+                _save(image, dpath)
+                derived.append(dpath)
+            else:
+                derived.append(derived[-1] if derived else path)
+    except BaseException:
+        remove_quietly(written)
+        raise
+    preview_path, grid_path = derived
+    return path, grid_path, preview_path
+
+# ================== 음성 ==================
+def ingest_audio(src, out_dir, max_bytes=MAX_AUDIO_BYTES, chunk_size=AUDIO_CHUNK):
+    """업로드 음성을 통째로 읽지 않고 chunk_size 씩 복사한다. 저장 경로를 돌려준다."""
+    ext = os.path.splitext(src.name)[1].lower() or ".mp3"
+    path = os.path.join(out_dir, uuid.uuid4().hex + ext)
+    written = 0
+    try:
+        with open(path, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"{src.name}: {max_bytes // (1 << 20)}MB 를 넘는 음성 파일입니다.")
+                out.write(chunk)
+    except BaseException:
+        remove_quietly([path])
+        raise
+    return path
+
+# ================== 병렬 처리 ==================
+def process_uploads(pool, images, audios, img_dir, aud_dir):
+    """이미지와 음성을 pool 에서 한꺼번에 처리한다.
+
+    가장 느린 파일이 끝나면 돌아오며 결과 순서는 업로드 순서를 따른다.
+    하나라도 실패하면 이미 만든 파일을 모두 지우고 첫 예외를 다시 던진다.
+    돌려주는 값: ([(원본, 이름, 썸네일, 미리보기)], [(경로, 이름)])
+    """
+    img_futs, aud_futs = [], []
+    try:
+        for f in images or []:
+            img_futs.append((f.name, pool.submit(ingest_image, f, img_dir)))
+        for f in audios or []:
+            aud_futs.append((f.name, pool.submit(ingest_audio, f, aud_dir)))
+    except BaseException:
+        # 제출 도중 실패(풀 종료 등): 이미 넘긴 작업이 끝나길 기다려 만든 파일을 지운다
+        wait([fut for _, fut in img_futs + aud_futs])
+        remove_quietly([p for _, fut in img_futs if fut.exception() is None for p in fut.result()]
+                       + [fut.result() for _, fut in aud_futs if fut.exception() is None])
+        raise
+    wait([fut for _, fut in img_futs + aud_futs])
+
+    saved_images, saved_audios, created, error = [], [], [], None
+    for name, fut in img_futs:
+        if fut.exception() is not None:
+            error = error or fut.exception()
+            continue
+        path, thumb, preview = fut.result()
+        created += [path, thumb, preview]
+        saved_images.append((path, name, thumb, preview))
+    for name, fut in aud_futs:
+        if fut.exception() is not None:
+            error = error or fut.exception()
+            continue
+        created.append(fut.result())
+        saved_audios.append((fut.result(), name))
+    if error is not None:
+        remove_quietly(created)
+        raise error
+    return saved_images, saved_audios
@@ -0,0 +1,191 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import diary_db
+from diary_db import CACHE_MAX_BYTES, DB_PATH, READ_POOL_SIZE, DiaryDB
+from diary_media import process_uploads
+from diary_shard import DEFAULT_SHARD_COUNT, DIRECTORY_NAME, ShardMap
+from diary_similar import RELATED_K, find_similar, related_entries, save_indexes
+
+# ================== 공통 상수 ==================
+MEDIA_DIR = "media"
+MEDIA_WORKERS = min(8, os.cpu_count() or 2)
+
+def _file_specs(images, audios):
+    # save_uploads 결과 -> diary_db 의 첨부 형식 [(kind, 경로, 원래 이름, 썸네일, 미리보기)]
+    return ([("image", path, oname, thumb, preview) for path, oname, thumb, preview in images]
+            + [("audio", path, oname, None, None) for path, oname in audios])
+
+class DiaryRepository:
+    """일기 데이터 계층(DB + 미디어)을 설정과 함께 묶은 저장소.
+
+    만들기만 해서는 아무 I/O 도 하지 않는다. 처음 쓰거나 open() 을 부를 때
+    폴더를 만들고 DB 를 연다(스키마 준비 포함). Streamlit 없이 배치 작업,
+    벤치마크, 작업자 프로세스에서 그대로 쓸 수 있다.
+
+    shard_dir 를 주면 샤드 모드: db 는 사용자/로그인용 디렉터리 DB 이고(db_path 는 쓰지 않음),
+    사용자별 데이터는 db_for(user_id) 가 고르는 샤드 파일에 읽고 쓴다. 환경 변수
+    (DIARY_SHARD_DIR 등)는 여기서 읽지 않는다. 앱처럼 그 설정을 따를 쪽이 넘긴다.
+    """
+
+    def __init__(self, db_path=DB_PATH, media_dir=MEDIA_DIR, blob_dir=None,
+                 read_pool_size=READ_POOL_SIZE, cache_bytes=CACHE_MAX_BYTES,
+                 media_workers=MEDIA_WORKERS, shard_dir="", shard_count=DEFAULT_SHARD_COUNT):
+        self.db_path = os.path.join(shard_dir, DIRECTORY_NAME) if shard_dir else db_path
+        self.media_dir = media_dir
+        # 작업 폴더와 저장소가 같은 디스크에 있어야 작업 파일을 os.replace 로 옮길 수 있다
+        self.blob_dir = blob_dir or os.path.join(media_dir, "blobs")
+        self.staging_dir = os.path.join(media_dir, "staging")   # 업로드를 처리하는 동안만 쓰는 폴더
+        self.read_pool_size = read_pool_size
+        self.cache_bytes = cache_bytes
+        self.media_workers = media_workers
+        self.shard_dir = shard_dir
+        self.shard_count = shard_count
+        self._lock = threading.Lock()
+        self._db = None
+        self._shards = None
+        self._pool = None
+
+    # ---- 수명 ----
+    def open(self):
+        with self._lock:
+            if self._db is None:
+                os.makedirs(self.staging_dir, exist_ok=True)
+                if self.shard_dir:
+                    os.makedirs(self.shard_dir, exist_ok=True)
+                self._db = DiaryDB(self.db_path, self.read_pool_size, self.blob_dir, self.cache_bytes)
+                if self.shard_dir:
+                    self._shards = ShardMap(self._db, self.shard_dir, self.shard_count, self.blob_dir)
+        return self
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else self.open()._db
+
+    def db_for(self, user_id):
+        # 그 사용자의 일기/파일/설정이 든 DB(샤드를 안 쓰면 db 와 같음)
+        db = self.db
+        return self._shards.db_for(user_id) if self._shards is not None else db
+
+    def all_dbs(self):
+        # 휴지통 정리처럼 모든 사용자 데이터를 돌아야 하는 작업용
+        db = self.db
+        return self._shards.open_all() if self._shards is not None else [db]
+
+    @property
+    def media_pool(self):
+        # 업로드 처리용 작업자 풀. Pillow 는 인코딩 중 GIL 을 놓으므로
+        # 스레드만으로도 여러 코어에서 이미지가 동시에 처리된다.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.media_workers, thread_name_prefix="media")
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            save_indexes()
+            if self._shards is not None:
+                self._shards.close()
+                self._shards = None
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- 사용자 ----
+    def create_user(self, email, name, pw_hash):
+        db = self.db
+        if self._shards is not None:
+            return self._shards.create_user(email, name, pw_hash)
+        return diary_db.create_user(db, email, name, pw_hash)
+
+    def get_user_by_email(self, email):
+        return diary_db.get_user_by_email(self.db, email)
+
+    def get_user_by_id(self, user_id):
+        return diary_db.get_user_by_id(self.db, user_id)
+
+    # ---- 일기 ----
+    def insert_entry(self, user_id, d, mood_key, mood_score, tags, content):
+        return diary_db.insert_entry(self.db_for(user_id), user_id, d, mood_key, mood_score, tags, content)
+
+    def save_entry(self, user_id, d, mood_key, mood_score, tags, content, images=(), audios=()):
+        # 일기와 save_uploads 결과를 한 트랜잭션으로 저장(실패하면 작업 파일까지 정리)
+        return diary_db.save_entry(self.db_for(user_id), user_id, d, mood_key, mood_score, tags, content,
+                                   _file_specs(images, audios))
+
+    def update_entry(self, entry_id, user_id, d, mood_key, mood_score, tags, content):
+        diary_db.update_entry(self.db_for(user_id), entry_id, user_id, d, mood_key, mood_score, tags, content)
+
+    def delete_entry(self, entry_id, user_id):
+        # 휴지통으로 옮기기만 한다(바로 끝남). 실제 삭제는 diary_trash 의 정리 작업이 한다.
+        diary_db.delete_entry(self.db_for(user_id), entry_id, user_id)
+
+    def restore_entry(self, entry_id, user_id):
+        diary_db.restore_entry(self.db_for(user_id), entry_id, user_id)
+
+    def purge_entry(self, entry_id, user_id):
+        diary_db.purge_entry(self.db_for(user_id), entry_id, user_id)
+
+    def trash(self, user_id):
+        return diary_db.get_trash(self.db_for(user_id), user_id)
+
+    def entries_page(self, user_id, q=None, mood_key=None, tag=None, tag_prefix=False, cursor=None,
+                     limit=diary_db.PAGE_SIZE):
+        return diary_db.get_entries_page(self.db_for(user_id), user_id, q=q, mood_key=mood_key, tag=tag,
+                                         tag_prefix=tag_prefix, cursor=cursor, limit=limit)
+
+    def get_entries(self, user_id, **filters):
+        return diary_db.get_entries(self.db_for(user_id), user_id, **filters)
+
+    def suggest_tags(self, user_id, prefix="", limit=20):
+        return diary_db.suggest_tags(self.db_for(user_id), user_id, prefix=prefix, limit=limit)
+
+    def related_entries(self, user_id, entry_id, k=RELATED_K):
+        # 글이 비슷한 일기 [(row, 유사도)]. 색인은 DB 파일 옆에 두고 바뀐 일기만 다시 계산한다.
+        return related_entries(self.db_for(user_id), user_id, entry_id, k)
+
+    def find_similar(self, user_id, text, k=RELATED_K):
+        return find_similar(self.db_for(user_id), user_id, text, k)
+
+    # ---- 파일/미디어 ----
+    def save_uploads(self, images, audios):
+        """업로드를 작업 폴더에 변환해 두고 ([(원본, 이름, 썸네일, 미리보기)], [(경로, 이름)]) 를 돌려준다."""
+        self.open()
+        return process_uploads(self.media_pool, images, audios, self.staging_dir, self.staging_dir)
+
+    def attach_saved(self, entry_id, user_id, images, audios):
+        # save_uploads 결과를 이미 있는 일기에 한 트랜잭션으로 붙인다(작업 파일은 저장소로 옮겨짐)
+        diary_db.insert_files(self.db_for(user_id), entry_id, _file_specs(images, audios))
+
+    def get_files(self, entry_id, user_id):
+        return diary_db.get_files(self.db_for(user_id), entry_id, user_id)
+
+    def delete_files_of_entry(self, entry_id, user_id):
+        diary_db.delete_files_of_entry(self.db_for(user_id), entry_id, user_id)
+
+    # ---- 통계 ----
+    def mood_counts(self, user_id):
+        return diary_db.get_mood_counts(self.db_for(user_id), user_id)
+
+    def monthly_stats(self, user_id):
+        return diary_db.get_monthly_stats(self.db_for(user_id), user_id)
+
+    def daily_stats(self, user_id, since):
+        return diary_db.get_daily_stats(self.db_for(user_id), user_id, since)
+
+    # ---- 설정 ----
+    def get_settings(self, user_id):
+        return diary_db.get_user_settings(self.db_for(user_id), user_id)
+
+    def save_settings(self, user_id, theme, primary, bg_style, font_scale):
+        diary_db.upsert_user_settings(self.db_for(user_id), user_id, theme, primary, bg_style, font_scale)
@@ -0,0 +1,284 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from diary_db import BLOB_DIR, DB_PATH, DiaryDB, blob_path, create_user, init_db, make_conn
+
+# ================== 공통 상수 ==================
+# 샤드 모드: 디렉터리 DB 가 사용자 id 를 발급하고, 사용자 데이터는 샤드 파일에 나눠 둔다.
+SHARD_DIR = os.environ.get("DIARY_SHARD_DIR", "")             # 비어 있으면 예전처럼 diary.db 하나
+DEFAULT_SHARD_COUNT = 16
+SHARD_COUNT = int(os.environ.get("DIARY_SHARD_COUNT", DEFAULT_SHARD_COUNT))   # 0 이면 사용자마다 파일 하나
+SHARD_READ_POOL = 2            # 샤드마다 재사용할 읽기 연결 수(샤드가 여러 개라 작게)
+MAX_OPEN_SHARDS = 32           # 쓰기 스레드와 연결을 열어 둘 샤드 수. 넘으면 오래 안 쓴 샤드부터 닫는다
+DIRECTORY_NAME = "directory.db"
+
+def shard_for(user_id, count=SHARD_COUNT):
+    # 새 사용자가 들어갈 샤드 이름. id 를 count 개 버킷으로 나누거나(0 이면) 사용자마다 하나
+    return f"u{user_id}" if count <= 0 else f"{user_id % count:03d}"
+
+def shard_path(shard_dir, name):
+    return os.path.join(shard_dir, f"shard-{name}.db")
+
+def shard_blob_dir(blob_root, name):
+    # 참조 수는 샤드마다 따로 세므로 저장소 폴더도 나눈다(한 샤드의 정리가 다른 샤드 파일을 지우지 않도록)
+    return os.path.join(blob_root, f"shard-{name}")
+
+class ShardMap:
+    """디렉터리 DB(users, user_shards)와 샤드별 DiaryDB 를 묶는다.
+
+    한 사용자의 일기/파일/설정은 모두 한 샤드에 있다. 샤드마다 파일과 쓰기 락이
+    따로라 다른 샤드에 쓰는 사용자끼리는 서로 기다리지 않는다. 샤드는 처음 쓸 때 연다.
+    버킷 수는 디렉터리에 처음 기록된 값을 따른다(count 는 새 디렉터리일 때만 쓰임).
+    """
+
+    def __init__(self, directory, shard_dir, count=SHARD_COUNT, blob_root=BLOB_DIR,
+                 read_pool_size=SHARD_READ_POOL, max_open=MAX_OPEN_SHARDS):
+        self.directory = directory
+        self.shard_dir = shard_dir
+        with directory.writer() as conn:
+            conn.execute("INSERT OR IGNORE INTO shard_config(id, shard_count) VALUES (1, ?)", (count,))
+            self.count = conn.execute("SELECT shard_count FROM shard_config").fetchone()[0]
+        self.blob_root = blob_root
+        self.read_pool_size = read_pool_size
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._routes = {}               # user_id -> 샤드 이름(배정은 바뀌지 않으므로 계속 보관)
+        self._shards = OrderedDict()    # 샤드 이름 -> DiaryDB (최근에 쓴 것이 끝)
+
+    def _open(self, name):
+        with self._lock:
+            db = self._shards.get(name)
+            if db is None:
+                db = DiaryDB(shard_path(self.shard_dir, name), self.read_pool_size,
+                             shard_blob_dir(self.blob_root, name), cache=self.directory.cache)
+                self._shards[name] = db
+            self._shards.move_to_end(name)
+            idle = [d for d in list(self._shards.values())[:-1] if d.is_open]
+        # 사용자마다 파일 하나(count=0)처럼 샤드가 많으면 스레드와 파일이 샤드 수만큼 늘어나므로
+        # 열린 샤드가 max_open 을 넘으면 오래 안 쓴 것부터 닫는다. 객체는 남겨 두므로
+        # 그 샤드를 쓰던 쪽은 그대로 쓰면 되고(다음 사용 때 다시 열림), 작업 중인 샤드는 닫지 않는다.
+        for old in idle[:max(0, len(idle) + 1 - self.max_open)]:
+            old.release()
+        return db
+
+    def shard_of(self, user_id):
+        name = self._routes.get(user_id)
+        if name is None:
+            with self.directory.reader() as conn:
+                row = conn.execute("SELECT shard FROM user_shards WHERE user_id=?", (user_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"샤드가 배정되지 않은 사용자입니다: {user_id}")
+            name = self._routes[user_id] = row[0]
+        return name
+
+    def db_for(self, user_id):
+        return self._open(self.shard_of(user_id))
+
+    def create_user(self, email, name, pw_hash):
+        def op(conn):
+            user_id = conn.execute("INSERT INTO users(email, name, password_hash) VALUES(?, ?, ?)",
+                                   (email, name, pw_hash)).lastrowid
+            shard = shard_for(user_id, self.count)
+            conn.execute("INSERT INTO user_shards(user_id, shard) VALUES (?, ?)", (user_id, shard))
+            return user_id, shard
+        user_id, shard = self.directory.write(op)
+        db = self._open(shard)
+        try:
+            # 샤드 안의 외래 키(CASCADE)용 사용자 행과 기본 설정. 비밀번호 해시는 디렉터리에만 둔다.
+            create_user(db, email, name, None, user_id=user_id)
+        except BaseException:
+            self.directory.write(lambda conn: conn.execute("DELETE FROM users WHERE id=?", (user_id,)))
+            raise
+        self._routes[user_id] = shard
+        return user_id
+
+    def names(self):
+        # 디스크에 있는 샤드 이름
+        if not os.path.isdir(self.shard_dir):
+            return []
+        return sorted(f[len("shard-"):-len(".db")] for f in os.listdir(self.shard_dir)
+                      if f.startswith("shard-") and f.endswith(".db"))
+
+    def open_all(self):
+        # 정리 작업처럼 모든 샤드를 돌아야 할 때
+        return [self._open(name) for name in self.names()]
+
+    def close(self):
+        with self._lock:
+            for db in self._shards.values():
+                db.close()
+            self._shards.clear()
+
+# ================== 기존 diary.db 나누기 ==================
+USER_COLS = "id, email, name, created_at"
+COPY_TABLES = [     # (테이블, 컬럼, 옮길 행 조건) - 사용자 행 다음에 이 순서로 넣는다
+    ("user_settings", 'user_id, theme, "primary", bg_style, font_scale, updated_at',
+     "user_id IN (SELECT user_id FROM moving)"),
+    ("entries", "id, user_id, d, mood, mood_score, tags, content, created_at, updated_at, deleted_at",
+     "user_id IN (SELECT user_id FROM moving)"),
+    ("entry_tags", "entry_id, user_id, tag",
+     "user_id IN (SELECT user_id FROM moving)"),
+    ("import_progress", "user_id, source_sha256, done, updated_at",
+     "user_id IN (SELECT user_id FROM moving)"),
+]
+FILE_COPY_COLS = "id, entry_id, kind, path, original_name, created_at, thumb_path, preview_path, updated_at"
+
+def _link_or_copy(src, dest):
+    if os.path.exists(dest):
+        return True
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)     # 같은 디스크면 공간을 더 쓰지 않는다
+    except FileNotFoundError:
+        return False
+    except OSError:
+        shutil.copy2(src, dest)
+    return True
+
+def _copy_shard(src_path, dest_path, blob_dir, user_ids):
+    """user_ids 의 행을 원본에서 샤드 파일로 한 트랜잭션에 옮기고 (일기 수, 파일 수, 없는 파일 수) 를 돌려준다.
+
+    entries/entry_tags 를 넣을 때 트리거가 검색 색인, 통계 요약, 태그 수를 샤드 안에서 다시 만든다.
+    """
+    # 전에 멈춘 나누기가 남긴 파일은 버리고 새로 만든다(디렉터리가 없으니 아직 쓰인 적 없음)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(dest_path + suffix):
+            os.remove(dest_path + suffix)
+    conn = init_db(make_conn(dest_path))
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (src_path,))
+        conn.execute("CREATE TEMP TABLE moving(user_id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO moving(user_id) VALUES (?)", [(u,) for u in user_ids])
+        conn.execute(f"""
+            INSERT INTO users({USER_COLS})
+            SELECT {USER_COLS} FROM src.users WHERE id IN (SELECT user_id FROM moving)
+        """)
+        for table, cols, cond in COPY_TABLES:
+            conn.execute(f"INSERT INTO {table}({cols}) SELECT {cols} FROM src.{table} WHERE {cond}")
+
+        files = conn.execute(f"""
+            SELECT {FILE_COPY_COLS} FROM src.files
+            WHERE entry_id IN (SELECT id FROM src.entries WHERE user_id IN (SELECT user_id FROM moving))
+        """).fetchall()
+        paths = {p for f in files for p in (f[3], f[6], f[7]) if p}
+        moved, missing = {}, 0
+        for path in paths:
+            sha, size = conn.execute("SELECT sha256, size FROM src.blobs WHERE path=?", (path,)).fetchone()
+            new = blob_path(blob_dir, sha, os.path.splitext(path)[1].lower())
+            if not _link_or_copy(path, new):
+                missing += 1
+            conn.execute("INSERT OR IGNORE INTO blobs(path, sha256, size) VALUES (?, ?, ?)", (new, sha, size))
+            moved[path] = new
+        # 참조 수는 files 트리거가 센다
+        conn.executemany(f"INSERT INTO files({FILE_COPY_COLS}) VALUES ({','.join('?' * 9)})",
+                         [f[:3] + (moved[f[3]],) + f[4:6] + (moved.get(f[6]), moved.get(f[7]), f[8])
+                          for f in files])
+        n_entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return n_entries, len(files), missing
+
+def split_database(src_path=DB_PATH, shard_dir="shards", count=SHARD_COUNT, blob_root=BLOB_DIR):
+    """단일 diary.db 를 디렉터리 DB 와 샤드 파일들로 나눈다.
+
+    원본은 읽기만 한다(스키마가 낡았으면 마이그레이션만 적용). id 는 그대로 유지하고,
+    첨부는 샤드별 저장소 폴더로 하드 링크(안 되면 복사)한다. 나눈 뒤 DIARY_SHARD_DIR 를
+    shard_dir 로 주고 앱을 다시 띄우면 된다.
+    돌려주는 값: {"users", "shards", "entries", "files", "missing"}
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    dir_path = os.path.join(shard_dir, DIRECTORY_NAME)
+    if os.path.exists(dir_path):
+        raise FileExistsError(f"{dir_path} 이 이미 있습니다.")
+    src = init_db(make_conn(src_path))
+    try:
+        if src.execute("SELECT COUNT(*) FROM blobs WHERE sha256 IS NULL").fetchone()[0]:
+            raise ValueError("내용 주소 저장소로 옮기지 않은 미디어가 있습니다. "
+                             "먼저 python diary_db.py migrate-media 를 실행해 주세요.")
+        users = src.execute("""
+            SELECT id, email, name, password_hash, created_at, session_gen FROM users ORDER BY id
+        """).fetchall()
+        seq = src.execute("SELECT seq FROM sqlite_sequence WHERE name='users'").fetchone()
+    finally:
+        src.close()
+
+    by_shard = {}
+    for u in users:
+        by_shard.setdefault(shard_for(u[0], count), []).append(u[0])
+    report = {"users": len(users), "shards": len(by_shard), "entries": 0, "files": 0, "missing": 0}
+    for name, user_ids in by_shard.items():
+        n_entries, n_files, missing = _copy_shard(src_path, shard_path(shard_dir, name),
+                                                  shard_blob_dir(blob_root, name), user_ids)
+        report["entries"] += n_entries
+        report["files"] += n_files
+        report["missing"] += missing
+
+    # 디렉터리는 샤드가 다 만들어진 뒤에 쓴다(중간에 멈추면 디렉터리가 없어 앱이 샤드 모드로 뜨지 않음)
+    tmp_path = dir_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    directory = init_db(make_conn(tmp_path))
+    try:
+        with directory:
+            directory.executemany("INSERT INTO users(id, email, name, password_hash, created_at, session_gen)"
+                                  " VALUES (?, ?, ?, ?, ?, ?)",
+                                  users)
+            directory.executemany("INSERT INTO user_shards(user_id, shard) VALUES (?, ?)",
+                                  [(u, name) for name, user_ids in by_shard.items() for u in user_ids])
+            directory.execute("INSERT INTO shard_config(id, shard_count) VALUES (1, ?)", (count,))
+            # 지워진 사용자의 id 도 다시 쓰지 않도록 발급 위치를 이어받는다
+            if seq:
+                directory.execute("UPDATE sqlite_sequence SET seq=max(seq, ?) WHERE name='users'", seq)
+        directory.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        directory.close()
+    os.replace(tmp_path, dir_path)
+    return report
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="diary.db 샤드 도구")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_split = sub.add_parser("split", help="기존 diary.db 를 디렉터리 + 샤드 파일로 나누기")
+    p_split.add_argument("--db", default=DB_PATH)
+    p_split.add_argument("--out", default=SHARD_DIR or "shards", help="샤드 폴더(DIARY_SHARD_DIR 로 쓸 곳)")
+    p_split.add_argument("--count", type=int, default=SHARD_COUNT, help="버킷 수(0 이면 사용자마다 파일 하나)")
+    p_split.add_argument("--blobs", default=BLOB_DIR, help="미디어 저장소 폴더")
+    p_where = sub.add_parser("where", help="사용자가 든 샤드 파일 보기")
+    p_where.add_argument("user_id", type=int)
+    p_where.add_argument("--dir", default=SHARD_DIR or "shards")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "split":
+        r = split_database(args.db, args.out, args.count, args.blobs)
+        print(f"사용자 {r['users']}명을 샤드 {r['shards']}개로 나눴습니다 · 일기 {r['entries']}개, 첨부 {r['files']}개")
+        if r["missing"]:
+            print(f"디스크에 없어 옮기지 못한 미디어 파일 {r['missing']}개")
+        print(f"이제 DIARY_SHARD_DIR={args.out} 로 앱을 실행하세요.")
+        return 0
+
+    dir_path = os.path.join(args.dir, DIRECTORY_NAME)
+    if not os.path.exists(dir_path):
+        print(f"{dir_path} 이 없습니다. 먼저 split 으로 나눠 주세요.")
+        return 1
+    directory = DiaryDB(dir_path)
+    try:
+        name = ShardMap(directory, args.dir).shard_of(args.user_id)
+    except KeyError as e:
+        print(e.args[0])
+        return 1
+    finally:
+        directory.close()
+    print(shard_path(args.dir, name))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
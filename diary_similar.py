@@ -0,0 +1,292 @@
+import json
+import os
+import re
+import threading
+import time
+import warnings
+import weakref
+import zlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from diary_db import DB_PATH, DiaryDB, cached_by_user, get_entries_by_ids
+
+# ================== 공통 상수 ==================
+NGRAM_MIN, NGRAM_MAX = 2, 3     # 글자 n-gram 길이(띄어쓰기나 조사가 달라도 2~3글자 조각은 겹친다)
+HASH_BITS = 18                  # n-gram 을 2^18 칸에 해시(사전 없이 크기가 고정되고 모델 파일도 필요 없음)
+DIM = 1 << HASH_BITS
+RELATED_K = 5
+MIN_SCORE = 0.05                # 이보다 덜 비슷하면 보여주지 않음
+SAVE_INTERVAL_S = 30            # 바뀐 색인을 디스크에 쓰는 최소 간격
+BLOCK_CACHE = 32                # 메모리에 펼쳐 둘 사용자별 행렬 수
+INDEX_VERSION = 1
+
+_SPACES = re.compile(r"\s+")
+
+def index_path(db_path):
+    # diary.db -> diary.similar.npz (샤드면 shard-003.similar.npz)
+    return os.path.splitext(db_path)[0] + ".similar.npz"
+
+def _grams(text):
+    text = _SPACES.sub(" ", (text or "").lower()).strip()
+    for n in range(NGRAM_MIN, NGRAM_MAX + 1):
+        for i in range(len(text) - n + 1):
+            yield text[i:i + n]
+
+def vectorize(text):
+    """텍스트 -> (해시 칸 int32, 1+log(tf) float32) 희소 벡터. 내용이 없으면 빈 배열."""
+    # crc32 는 프로세스마다 달라지지 않아 저장한 색인을 다시 읽어도 칸이 같다
+    counts = Counter(zlib.crc32(g.encode()) & (DIM - 1) for g in _grams(text))
+    idx = np.fromiter(counts.keys(), np.int32, len(counts))
+    tf = 1 + np.log(np.fromiter(counts.values(), np.float32, len(counts)))
+    return idx, tf.astype(np.float32)
+
+class _Block:
+    """한 사용자의 일기를 CSR 형태로 펼친 행렬. IDF 와 행 길이를 미리 계산해 둔다."""
+
+    def __init__(self, vecs):
+        # vecs: [(entry_id, idx, tf)] - entry_id 순
+        self.ids = np.array([v[0] for v in vecs], np.int64)
+        self.indptr = np.zeros(len(vecs) + 1, np.int64)
+        np.cumsum([len(v[1]) for v in vecs], out=self.indptr[1:])
+        self.indices = np.concatenate([v[1] for v in vecs])
+        tf = np.concatenate([v[2] for v in vecs])
+        df = np.bincount(self.indices, minlength=DIM)
+        self.idf = (np.log((1 + len(vecs)) / (1 + df)) + 1).astype(np.float32)
+        self.weights = tf * self.idf[self.indices]
+        self.norms = np.sqrt(np.add.reduceat(self.weights * self.weights, self.indptr[:-1]))
+
+    def cosine(self, idx, tf):
+        # 질의 벡터를 DIM 칸 배열에 펼쳐 두고 모든 행의 내적을 한 번에 구한다
+        q = np.zeros(DIM, np.float32)
+        q[idx] = tf * self.idf[idx]
+        qn = np.linalg.norm(q[idx])
+        if qn == 0:
+            return np.zeros(len(self.ids), np.float32)
+        dots = np.add.reduceat(self.weights * q[self.indices], self.indptr[:-1])
+        return dots / (self.norms * qn)
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+class SimilarIndex:
+    """한 DB(diary.db 또는 샤드)의 일기별 글자 n-gram TF-IDF 색인.
+
+    일기마다 해시한 n-gram 의 (칸, tf) 희소 벡터만 보관하고, IDF 와 정규화는 사용자별
+    행렬을 펼칠 때 계산한다. entries.updated_at 과 tombstones 로 마지막 동기화 이후 바뀐
+    일기만 다시 계산하며, DB 파일 옆(index_path)에 저장해 다시 시작할 때 처음부터 만들지 않는다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._vecs = {}                 # entry_id -> (user_id, updated_at, idx, tf)
+        self._by_user = {}              # user_id -> {entry_id}
+        self._blocks = OrderedDict()    # user_id -> _Block (LRU)
+        self._mark = None               # 반영한 entries.updated_at 최댓값(None 이면 아직 전체를 안 읽음)
+        self._tomb_mark = ""            # 반영한 tombstones.deleted_at 최댓값
+        self._dirty = False
+        self._saved_at = 0.0
+        self._load()
+
+    def __len__(self):
+        return len(self._vecs)
+
+    # ---- 저장/읽기 ----
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != INDEX_VERSION or meta.get("dim") != DIM \
+                        or meta.get("ngram") != [NGRAM_MIN, NGRAM_MAX]:
+                    return      # 설정이 바뀌었으면 다시 만든다
+                bounds = np.cumsum(data["lengths"])[:-1]
+                for eid, uid, upd, idx, tf in zip(data["entry_ids"].tolist(), data["user_ids"].tolist(),
+                                                  data["updated"].tolist(), np.split(data["indices"], bounds),
+                                                  np.split(data["tf"], bounds)):
+                    self._put(eid, uid, upd, idx, tf)
+                self._mark, self._tomb_mark = meta["mark"], meta["tomb_mark"]
+        except (OSError, ValueError, KeyError) as e:
+            warnings.warn(f"비슷한 일기 색인을 읽지 못해 다시 만듭니다: {self.path}: {e}")
+            self._vecs, self._by_user, self._mark, self._tomb_mark = {}, {}, None, ""
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            items = list(self._vecs.items())
+            meta = {"version": INDEX_VERSION, "dim": DIM, "ngram": [NGRAM_MIN, NGRAM_MAX],
+                    "mark": self._mark, "tomb_mark": self._tomb_mark}
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        arrays = {
+            "meta": np.array(json.dumps(meta)),
+            "entry_ids": np.array([k for k, _ in items], np.int64),
+            "user_ids": np.array([v[0] for _, v in items], np.int64),
+            "updated": np.array([v[1] or "" for _, v in items], dtype=str),
+            "lengths": np.array([len(v[2]) for _, v in items], np.int64),
+            "indices": np.concatenate([v[2] for _, v in items]) if items else np.empty(0, np.int32),
+            "tf": np.concatenate([v[3] for _, v in items]) if items else np.empty(0, np.float32),
+        }
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.path)
+
+    # ---- 동기화 ----
+    def _put(self, eid, uid, updated_at, idx, tf):
+        self._drop(eid)
+        self._vecs[eid] = (uid, updated_at, idx, tf)
+        self._by_user.setdefault(uid, set()).add(eid)
+        self._blocks.pop(uid, None)
+
+    def _drop(self, eid):
+        old = self._vecs.pop(eid, None)
+        if old is not None:
+            self._by_user.get(old[0], set()).discard(eid)
+            self._blocks.pop(old[0], None)
+            self._dirty = True
+
+    def sync(self, db):
+        """마지막 동기화 이후 바뀐 일기를 반영하고 다시 계산한 일기 수를 돌려준다."""
+        with self._lock:
+            with db.reader() as conn:
+                sql = "SELECT id, user_id, content, tags, deleted_at, updated_at FROM entries"
+                rows = (conn.execute(sql).fetchall() if self._mark is None
+                        else conn.execute(sql + " WHERE updated_at >= ?", (self._mark,)).fetchall())
+                tombs = conn.execute("""
+                    SELECT row_key, deleted_at FROM tombstones WHERE deleted_at >= ? AND tbl = 'entries'
+                """, (self._tomb_mark,)).fetchall()
+            changed = 0
+            for eid, uid, content, tags, deleted_at, updated_at in rows:
+                old = self._vecs.get(eid)
+                if old is not None and old[1] == updated_at:
+                    continue
+                if deleted_at is not None:
+                    self._drop(eid)     # 휴지통의 일기는 추천하지 않는다
+                    continue
+                idx, tf = vectorize(f"{content or ''} {tags or ''}")
+                if len(idx):
+                    self._put(eid, uid, updated_at, idx, tf)
+                else:
+                    self._drop(eid)
+                self._dirty = True
+                changed += 1
+            for key, _ in tombs:
+                self._drop(int(key))
+            self._mark = max([r[5] for r in rows if r[5]] + [self._mark or ""])
+            self._tomb_mark = max([t[1] for t in tombs] + [self._tomb_mark])
+            due = self._dirty and time.monotonic() - self._saved_at >= SAVE_INTERVAL_S
+        if due:
+            self.save()
+        return changed
+
+    # ---- 조회 ----
+    def _block(self, user_id):
+        # 호출하는 쪽이 _lock 을 잡고 있어야 한다
+        block = self._blocks.get(user_id)
+        if block is None:
+            ids = sorted(self._by_user.get(user_id, ()))
+            if not ids:
+                return None
+            block = self._blocks[user_id] = _Block([(i, *self._vecs[i][2:]) for i in ids])
+            while len(self._blocks) > BLOCK_CACHE:
+                self._blocks.popitem(last=False)
+        self._blocks.move_to_end(user_id)
+        return block
+
+    def _search(self, user_id, idx, tf, k, exclude=None):
+        with self._lock:
+            block = self._block(user_id)
+        if block is None or not len(idx):
+            return []
+        scores = block.cosine(idx, tf)
+        if exclude is not None:
+            scores[np.searchsorted(block.ids, exclude)] = -1
+        return [(int(block.ids[i]), float(scores[i])) for i in _top_k(scores, k) if scores[i] >= MIN_SCORE]
+
+    def related(self, db, user_id, entry_id, k=RELATED_K):
+        """entry_id 와 비슷한 그 사용자의 일기 [(id, 코사인 유사도)] 높은 순(자기 자신 제외)."""
+        self.sync(db)
+        vec = self._vecs.get(entry_id)
+        if vec is None or vec[0] != user_id:
+            return []
+        return self._search(user_id, vec[2], vec[3], k, exclude=entry_id)
+
+    def similar_to(self, db, user_id, text, k=RELATED_K):
+        self.sync(db)
+        return self._search(user_id, *vectorize(text), k)
+
+# ================== DB 별 색인 ==================
+_INDEXES = weakref.WeakKeyDictionary()     # DiaryDB -> SimilarIndex
+_INDEXES_LOCK = threading.Lock()
+
+def index_for(db):
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(db)
+        if index is None:
+            index = _INDEXES[db] = SimilarIndex(index_path(db.db_path))
+        return index
+
+def save_indexes():
+    # 종료할 때 열려 있는 색인의 아직 안 쓴 변경을 디스크에
+    with _INDEXES_LOCK:
+        indexes = list(_INDEXES.values())
+    for index in indexes:
+        index.save()
+
+def _with_rows(db, user_id, hits):
+    rows = get_entries_by_ids(db, user_id, [i for i, _ in hits])
+    score = dict(hits)
+    return [(row, score[row[0]]) for row in rows]
+
+@cached_by_user
+def related_entries(db, user_id, entry_id, k=RELATED_K):
+    """entry_id 와 글이 비슷한 그 사용자의 일기 [(row, 유사도)] (자기 자신과 휴지통 제외)."""
+    return _with_rows(db, user_id, index_for(db).related(db, user_id, entry_id, k))
+
+@cached_by_user
+def find_similar(db, user_id, text, k=RELATED_K):
+    # 입력한 글과 비슷한 일기 [(row, 유사도)]
+    return _with_rows(db, user_id, index_for(db).similar_to(db, user_id, text, k))
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="비슷한 일기 색인 도구")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("build", help="색인을 DB 와 맞추고 저장(처음이면 전체를 계산)")
+    p_rel = sub.add_parser("related", help="한 일기와 비슷한 일기 보기")
+    p_rel.add_argument("user_id", type=int)
+    p_rel.add_argument("entry_id", type=int)
+    p_rel.add_argument("-k", type=int, default=RELATED_K)
+    args = parser.parse_args(argv)
+
+    db = DiaryDB(args.db)
+    try:
+        index = index_for(db)
+        t0 = time.perf_counter()
+        changed = index.sync(db)
+        print(f"일기 {len(index)}개 색인 · {changed}개 다시 계산 {time.perf_counter() - t0:.2f}s")
+        if args.cmd == "related":
+            t0 = time.perf_counter()
+            hits = index.related(db, args.user_id, args.entry_id, args.k)
+            print(f"top-{args.k} {(time.perf_counter() - t0) * 1e3:.2f}ms")
+            for row, score in _with_rows(db, args.user_id, hits):
+                text = (row[5] or "").replace("\n", " ")
+                print(f"{score:.3f}  #{row[0]} {row[1]}  {text[:50]}")
+        index.save()
+    finally:
+        db.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+
+from diary_db import BLOB_DIR
+
+# ================== 공통 상수 ==================
+# 브라우저가 직접 받아 가는 미디어 주소(DIARY_MEDIA_URL). 브라우저에서 닿는 바깥 주소를
+# 줄 때만 미디어 서버를 쓰고, 없으면 예전처럼 Streamlit 이 파일을 직접 넘긴다.
+MEDIA_HOST = os.environ.get("DIARY_MEDIA_HOST", "127.0.0.1")
+MEDIA_PORT = int(os.environ.get("DIARY_MEDIA_PORT", "8502"))
+MEDIA_URL = os.environ.get("DIARY_MEDIA_URL", "")
+# 주소마다 서명과 만료 시각을 붙인다. 만료는 URL_TTL_S 단위로 맞춰 그 사이에는 주소가 같다(브라우저 캐시 유지).
+URL_TTL_S = 24 * 3600
+# 저장소 파일은 이름이 곧 내용 해시라 바뀌지 않는다. 다만 로그인한 사용자에게만 주므로 공유 캐시에는 두지 않음
+CACHE_CONTROL = f"private, max-age={URL_TTL_S}, immutable"
+COPY_CHUNK = 256 << 10
+
+# /m/[shard-이름/]ab/cd/<sha256><확장자> 만 받는다(저장소 밖 경로로 나갈 수 없음)
+BLOB_URL = re.compile(r"^/m/(?:(shard-[0-9a-z]{1,24})/)?([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[a-z0-9]{1,5})$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("audio/mp4", ".m4a")
+
+def parse_range(header, size):
+    """Range 헤더를 (시작, 끝) 으로. 없으면 None, 만족할 수 없으면 ValueError.
+
+    단일 구간만 다룬다(브라우저의 음성 탐색은 항상 단일 구간).
+    """
+    if not header:
+        return None
+    m = RANGE.match(header.strip())
+    if not m or m.groups() == ("", ""):
+        raise ValueError(header)
+    first, last = m.groups()
+    if first == "":
+        # bytes=-N : 마지막 N 바이트
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+class MediaHandler(BaseHTTPRequestHandler):
+    server_version = "DiaryMedia/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        url = urlsplit(self.path)
+        m = BLOB_URL.match(url.path)
+        if not m or m.group(4)[:2] != m.group(2) or m.group(4)[2:4] != m.group(3):
+            return self._empty(404)
+        query = parse_qs(url.query)
+        if not self.server.verify(url.path[len("/m/"):], query.get("e", [""])[0], query.get("s", [""])[0]):
+            return self._empty(403)
+        shard, d1, d2, sha, ext = m.groups()
+        path = os.path.join(self.server.blob_dir, shard or "", d1, d2, sha + ext)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return self._empty(404)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            etag = f'"{sha}"'
+            if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                return self._empty(304, etag)
+            try:
+                rng = parse_range(self.headers.get("Range"), size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            # If-Range 가 다른 버전을 가리키면 전체를 보낸다(내용 주소라 사실상 항상 같음)
+            if rng and self.headers.get("If-Range", etag) != etag:
+                rng = None
+            start, end = rng or (0, size - 1)
+            length = max(end - start + 1, 0)
+
+            self.send_response(206 if rng else 200)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            if rng:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            name = query.get("dl", [None])[0]
+            if name:
+                # ?dl=원래이름 이면 원본 받기(한글 파일명은 RFC 5987)
+                self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(name)}")
+            self.end_headers()
+            if not body:
+                return
+            f.seek(start)
+            remaining = length
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(COPY_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # 음성 탐색 중 브라우저가 이전 요청을 끊는 것은 정상
+                self.close_connection = True
+
+    def _empty(self, code, etag=None):
+        self.send_response(code)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+class MediaServer:
+    """blob_dir 의 내용 주소 파일을 서명한 URL 로 내주는 작은 HTTP 서버(데몬 스레드).
+
+    URL 에 SHA-256 이 들어가므로 파일마다 한 번만 받고 이후에는 브라우저 캐시를 쓴다.
+    스크립트가 다시 돌아도 미디어 바이트는 Streamlit 웹소켓을 지나지 않는다.
+    url_for 가 만든 주소(secret 으로 서명, URL_TTL_S 뒤 만료)만 받으므로
+    파일 해시를 알아도 그 일기를 그려 받은 적이 없으면 내려받을 수 없다.
+    public_url 은 브라우저에서 닿는 이 서버의 바깥 주소(필수).
+    """
+
+    def __init__(self, blob_dir=BLOB_DIR, secret=b"", host=MEDIA_HOST, port=MEDIA_PORT, public_url=MEDIA_URL):
+        if not secret:
+            raise ValueError("미디어 주소 서명에 쓸 secret 이 필요합니다")
+        self.blob_dir = os.path.abspath(blob_dir)
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self._httpd = None
+        self._thread = None
+
+    def _sign(self, rel, exp):
+        mac = hmac.new(self.secret, f"media:{rel}:{exp}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac).rstrip(b"=").decode()
+
+    def verify(self, rel, exp, sig):
+        # url_for 가 서명했고 아직 만료되지 않은 주소인지
+        try:
+            if int(exp) < time.time():
+                return False
+        except ValueError:
+            return False
+        return hmac.compare_digest(sig, self._sign(rel, exp))
+
+    def start(self):
+        if not self.public_url:
+            raise ValueError("DIARY_MEDIA_URL(브라우저에서 닿는 미디어 주소)이 없습니다")
+        self._httpd = ThreadingHTTPServer((self.host, self.port), MediaHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.blob_dir = self.blob_dir
+        self._httpd.verify = self.verify
+        self.port = self._httpd.server_address[1]
+        self.public_url = self.public_url.rstrip("/")
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="media-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def url_for(self, path, download_name=None):
+        """저장소 파일 경로의 URL. 저장소 밖(옮기기 전 옛 파일)이면 None."""
+        if not path:
+            return None
+        rel = os.path.relpath(os.path.abspath(path), self.blob_dir).replace(os.sep, "/")
+        if not BLOB_URL.match("/m/" + rel):
+            return None
+        exp = (int(time.time()) // URL_TTL_S + 2) * URL_TTL_S   # 최소 하루 뒤, 하루 동안 같은 주소
+        query = {"e": exp, "s": self._sign(rel, exp)}
+        if download_name:
+            query["dl"] = download_name
+        return f"{self.public_url}/m/{rel}?{urlencode(query, quote_via=quote)}"
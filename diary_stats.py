@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# ================== 공통 상수 ==================
+STATS_WORKERS = 2          # 통계 계산 스레드 수
+STATS_FIRST_WAIT_S = 1.0   # 보여줄 결과가 하나도 없을 때만 이만큼 기다려 본다
+
+class StatsWorker:
+    """통계 탭 결과를 작업 스레드에서 만들어 사용자별로 보관하는 계산기.
+
+    build(db, user_id, *params) 는 읽기 연결(query_only)만 쓰는 함수로, 데이터프레임 가공과
+    차트 만들기까지 여기서 끝낸다. get() 은 마지막 결과를 바로 돌려주고, 그 뒤로 사용자의
+    데이터 버전(db.cache.version)이나 params 가 바뀌었으면 백그라운드에서 다시 계산을 건다.
+    스크립트 스레드는 통계를 계산하느라 기다리지 않는다.
+    """
+
+    def __init__(self, db_for, build, workers=STATS_WORKERS):
+        self._db_for = db_for
+        self._build = build
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stats")
+        self._lock = threading.Lock()
+        self._results = {}      # user_id -> (version, params, 결과)
+        self._pending = {}      # user_id -> Future
+        self.last_error = None
+
+    def get(self, user_id, *params, wait=STATS_FIRST_WAIT_S):
+        """(마지막 결과 또는 None, 최신인지). 낡았으면 다시 계산을 걸어 두고 이전 결과를 돌려준다."""
+        db = self._db_for(user_id)
+        version = db.cache.version(user_id)
+        with self._lock:
+            done = self._results.get(user_id)
+            if done is not None and done[:2] == (version, params):
+                return done[2], True
+            future = self._pending.get(user_id)
+            if future is None:
+                future = self._pending[user_id] = self._pool.submit(self._run, db, user_id, version, params)
+        if done is None and wait:
+            # 처음 여는 통계 탭: 잠깐만 기다리고 안 되면 다음 실행에서 보여준다
+            try:
+                future.result(timeout=wait)
+            except FutureTimeout:
+                return None, False
+            return self.get(user_id, *params, wait=0)
+        return (done[2] if done is not None else None), False
+
+    def _run(self, db, user_id, version, params):
+        try:
+            result = self._build(db, user_id, *params)
+            with self._lock:
+                # 계산하는 동안 들어온 더 새로운 결과를 덮어쓰지 않는다
+                old = self._results.get(user_id)
+                if old is None or old[0] <= version:
+                    self._results[user_id] = (version, params, result)
+            self.last_error = None
+        except Exception as e:
+            # 이전 결과를 그대로 두고 다음 get() 에서 다시 시도
+            self.last_error = e
+        finally:
+            with self._lock:
+                self._pending.pop(user_id, None)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+import warnings
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+from diary_db import DB_PATH, purge_expired, reclaim_blobs
+from diary_repo import MEDIA_DIR, DiaryRepository
+from diary_shard import DIRECTORY_NAME, shard_blob_dir
+
+# ================== 공통 상수 ==================
+TRASH_RETENTION_DAYS = 30      # 휴지통 보관 기간
+PURGE_INTERVAL_S = 10 * 60     # 정리 주기
+PURGE_BATCH = 200              # 한 트랜잭션에 지울 일기/파일 수(쓰기 락을 오래 잡지 않도록)
+SWEEP_GRACE_S = 3600           # 이보다 최근에 생긴 파일은 올리는 중일 수 있어 건드리지 않음
+
+def purge_trash(db, retention_days=TRASH_RETENTION_DAYS, batch=PURGE_BATCH):
+    """보관 기간이 지난 휴지통 일기와 참조가 끊긴 파일을 batch 개씩 나눠 지운다.
+
+    돌려주는 값: {"entries", "files", "bytes", "failed": [(경로, 오류)]}
+    """
+    before = (datetime.utcnow() - timedelta(days=retention_days)).isoformat()
+    report = {"entries": 0, "files": 0, "bytes": 0, "failed": []}
+    while True:
+        n = purge_expired(db, before, batch)
+        report["entries"] += n
+        if n < batch:
+            break
+    failed = set()
+    while True:
+        removed, reclaimed, errors = reclaim_blobs(db, batch)
+        report["files"] += len(removed)
+        report["bytes"] += reclaimed
+        new_errors = [(p, e) for p, e in errors if p not in failed]
+        failed.update(p for p, _ in errors)
+        report["failed"] += new_errors
+        # 못 지운 파일만 남았으면 이번 주기는 끝
+        if len(removed) + len(errors) < batch or not removed:
+            break
+    for path, e in report["failed"]:
+        warnings.warn(f"미디어 파일을 지우지 못했습니다: {path}: {e}")
+    return report
+
+class TrashPurger(threading.Thread):
+    """interval_s 마다 purge_trash 를 돌리는 백그라운드 스레드. 버튼 처리에서는 파일을 지우지 않는다.
+
+    db 는 DiaryDB 하나, 또는 (샤드 모드에서) 정리할 DB 목록을 돌려주는 함수.
+    """
+
+    def __init__(self, db, interval_s=PURGE_INTERVAL_S, retention_days=TRASH_RETENTION_DAYS,
+                 batch=PURGE_BATCH):
+        super().__init__(name="diary-purger", daemon=True)
+        self._dbs = db if callable(db) else (lambda: [db])
+        self.interval_s = interval_s
+        self.retention_days = retention_days
+        self.batch = batch
+        self.last_report = None
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                report = {"entries": 0, "files": 0, "bytes": 0, "failed": []}
+                for db in self._dbs():
+                    for k, v in purge_trash(db, self.retention_days, self.batch).items():
+                        report[k] += v
+                self.last_report = report
+                self.last_error = None
+            except Exception as e:
+                # 다음 주기에 다시 시도
+                self.last_error = e
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+
+    def wake(self):
+        # 영구 삭제 직후처럼 바로 정리하고 싶을 때
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+# ================== 고아 파일 정리(mark-and-sweep) ==================
+def _live_paths(conn):
+    live = set()
+    for row in conn.execute("SELECT path, thumb_path, preview_path FROM files"):
+        live.update(os.path.abspath(p) for p in row if p)
+    return live
+
+def _skip_foreign_shards(root, dirnames, owned):
+    # 샤드 모드에서는 media/blobs/shard-<이름> 마다 그 샤드 DB 의 파일만 있다.
+    # 넘겨받지 않은 샤드의 폴더는 그 샤드의 files 표를 모르므로 들어가지 않는다.
+    dirnames[:] = [d for d in dirnames
+                   if not d.startswith("shard-") or os.path.abspath(os.path.join(root, d)) in owned]
+
+def sweep_orphans(db, media_dir=MEDIA_DIR, grace_s=SWEEP_GRACE_S, dry_run=False):
+    """media_dir 를 files 표와 비교해 어디에서도 참조하지 않는 파일을 지운다.
+
+    db 는 DiaryDB 하나 또는 목록. 샤드 모드라면 모든 샤드를 넘겨야 media 전체를 정리한다
+    (넘기지 않은 샤드의 저장소 폴더는 건너뛴다).
+    표시(mark): 모든 DB 의 files 에서 원본/썸네일/미리보기 경로를 모은다.
+    쓸기(sweep): media_dir 아래에서 표시되지 않았고 grace_s 보다 오래된 파일을 고른 뒤,
+    모든 DB 의 쓰기 락을 잡고 한 번 더 표시해 그 사이 붙은 파일을 빼고 지운다(blobs 행도 함께).
+    돌려주는 값: {"scanned", "orphans", "bytes", "missing", "failed"}
+    """
+    dbs = list(db) if isinstance(db, (list, tuple)) else [db]
+    owned = {os.path.abspath(d.blob_dir) for d in dbs}
+    live = set()
+    for d in dbs:
+        with d.reader() as conn:
+            live |= _live_paths(conn)
+    now = time.time()
+    candidates, scanned = [], 0
+    for root, dirnames, names in os.walk(media_dir):
+        _skip_foreign_shards(root, dirnames, owned)
+        for name in names:
+            path = os.path.join(root, name)
+            scanned += 1
+            if os.path.abspath(path) in live:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime >= grace_s:
+                candidates.append((path, st.st_size))
+    missing = sum(1 for p in live if p.startswith(os.path.abspath(media_dir) + os.sep) and not os.path.exists(p))
+
+    report = {"scanned": scanned, "orphans": 0, "bytes": 0, "missing": missing, "failed": []}
+    if dry_run:
+        report["orphans"] = len(candidates)
+        report["bytes"] = sum(size for _, size in candidates)
+        return report
+    with ExitStack() as stack:
+        conns = [stack.enter_context(d.writer()) for d in dbs]
+        live = set()
+        for conn in conns:
+            live |= _live_paths(conn)
+        removed = []
+        for path, size in candidates:
+            if os.path.abspath(path) in live:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                report["failed"].append((path, e))
+                continue
+            removed.append(path)
+            report["orphans"] += 1
+            report["bytes"] += size
+        for conn in conns:
+            conn.executemany("DELETE FROM blobs WHERE path=?", [(p,) for p in removed])
+    return report
+
+def open_dbs(db_path, media_dir=MEDIA_DIR):
+    """CLI 용: db_path 에 맞는 (저장소, 정리할 DB 목록, 쓸어 볼 폴더).
+
+    directory.db 면 그 폴더의 모든 샤드, shard-<이름>.db 하나면 그 샤드의 저장소 폴더만 본다.
+    """
+    name = os.path.basename(db_path)
+    if name == DIRECTORY_NAME:
+        repo = DiaryRepository(media_dir=media_dir, shard_dir=os.path.dirname(db_path) or ".").open()
+        return repo, repo.all_dbs(), media_dir
+    blob_dir, sweep_dir = os.path.join(media_dir, "blobs"), media_dir
+    if name.startswith("shard-") and name.endswith(".db"):
+        blob_dir = sweep_dir = shard_blob_dir(blob_dir, name[len("shard-"):-len(".db")])
+    repo = DiaryRepository(db_path, media_dir, blob_dir=blob_dir, shard_dir="").open()
+    return repo, repo.all_dbs(), sweep_dir
+
+# ================== CLI ==================
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="휴지통 비우기/고아 미디어 정리")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--media", default=MEDIA_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_purge = sub.add_parser("purge", help="보관 기간이 지난 휴지통 일기와 참조 없는 파일 지우기")
+    p_purge.add_argument("--days", type=int, default=TRASH_RETENTION_DAYS)
+    p_sweep = sub.add_parser("sweep", help="files 표에 없는 media 파일 찾아 지우기")
+    p_sweep.add_argument("--grace", type=int, default=SWEEP_GRACE_S, help="이 초보다 최근 파일은 건너뜀")
+    p_sweep.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    # directory.db 를 주면 모든 샤드를 함께 본다(샤드 하나만 보면 다른 샤드 파일이 고아로 보임)
+    repo, dbs, media_dir = open_dbs(args.db, args.media)
+    try:
+        if args.cmd == "purge":
+            r = {"entries": 0, "files": 0, "bytes": 0, "failed": []}
+            for db in dbs:
+                for k, v in purge_trash(db, args.days).items():
+                    r[k] += v
+            print(f"일기 {r['entries']}개, 파일 {r['files']}개 삭제 · {r['bytes'] / 1e6:.1f}MB 확보"
+                  f" · 실패 {len(r['failed'])}개")
+        else:
+            r = sweep_orphans(dbs, media_dir, args.grace, args.dry_run)
+            verb = "찾음(삭제 안 함)" if args.dry_run else "삭제"
+            print(f"{r['scanned']}개 파일 검사 · 고아 파일 {r['orphans']}개 {verb} · {r['bytes'] / 1e6:.1f}MB"
+                  f" · DB 에는 있지만 디스크에 없는 파일 {r['missing']}개")
+            for path, e in r["failed"]:
+                print(f"[실패] {path}: {e}")
+    finally:
+        repo.close()
+    return 1 if r["failed"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,336 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+# ================== 공통 상수 ==================
+# DIARY_TRACE=1 이면 시작부터 켜 두고 사이드바 패널도 보여준다. 꺼져 있으면 패널이 없다
+# (패널은 계측을 프로세스 전체로 켜고 끄며 다른 세션의 실행 기록도 보이므로 운영자만 연다).
+TRACE_ENABLED = os.environ.get("DIARY_TRACE", "") not in ("", "0")
+TRACE_DIR = os.environ.get("DIARY_TRACE_DIR", "trace")
+TRACE_LOG = "runs.jsonl"            # 한 번의 실행(rerun)이 한 줄
+TRACE_LOG_MAX_BYTES = 50 * 1024 * 1024  # 넘으면 runs.jsonl.1 로 돌리고 새로 시작(이전 .1 은 지움)
+PROM_FILE = "metrics.prom"          # node_exporter textfile collector 형식
+PROM_INTERVAL_S = 5                 # 메트릭 파일은 이 간격보다 자주 다시 쓰지 않음
+SQL_LABEL_MAX = 120                 # 메트릭 라벨에 넣는 SQL 길이
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_WS = re.compile(r"\s+")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"IN \((?:\?, ?)*\?\)", re.I)
+
+def sql_shape(sql):
+    # 같은 모양의 쿼리를 하나로 묶도록 공백과 리터럴을 정리
+    shape = _IN_LIST.sub("IN (…)", _LITERAL.sub("?", _WS.sub(" ", sql).strip()))
+    return shape if len(shape) <= SQL_LABEL_MAX else shape[:SQL_LABEL_MAX - 1] + "…"
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count", "rows")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.rows = 0
+
+    def observe(self, seconds, rows=0):
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        self.rows += max(rows or 0, 0)
+
+class Run:
+    """스크립트 한 번 실행(rerun) 동안 모인 구간/쿼리 기록."""
+
+    def __init__(self, app):
+        self.app = app
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.ts = datetime.utcnow().isoformat()
+        self.spans = []         # {"name", "ms", "depth"}
+        self.queries = []       # {"sql", "ms", "rows", "stmts", "span"}
+        self.stack = []
+        self.total_ms = None
+
+    def as_dict(self):
+        return {"ts": self.ts, "app": self.app, "run": self.id, "total_ms": self.total_ms,
+                "spans": self.spans, "queries": self.queries}
+
+# ================== 기록기 ==================
+class Recorder:
+    """프로세스 전체가 공유하는 계측 기록기.
+
+    실행 기록은 그 실행을 돌린 스레드(Streamlit 세션의 스크립트 스레드)에 묶이고,
+    실행 밖(작업자 스레드 등)에서 생긴 구간/쿼리는 누적 메트릭에만 들어간다.
+    """
+
+    def __init__(self, out_dir=TRACE_DIR, enabled=TRACE_ENABLED):
+        self.out_dir = out_dir
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._spans = defaultdict(_Histogram)       # (app, name)
+        self._queries = defaultdict(_Histogram)     # (app, sql_shape)
+        self._runs = defaultdict(_Histogram)        # app
+        self._last_prom = 0.0
+        self.last_runs = {}                         # app -> 마지막으로 끝난 Run(패널 표시용)
+
+    @property
+    def current(self):
+        return getattr(self._local, "run", None)
+
+    # ---- 실행 단위 ----
+    def begin_run(self, app):
+        # 직전 실행이 st.rerun() 등으로 끝나지 못했으면 여기서 마무리
+        if self.current is not None:
+            self.end_run()
+        self._local.run = Run(app) if self.enabled else None
+
+    def end_run(self):
+        run, self._local.run = self.current, None
+        if run is None:
+            return None
+        run.total_ms = (time.perf_counter() - run.started) * 1000
+        with self._lock:
+            self._runs[run.app].observe(run.total_ms / 1000)
+            for s in run.spans:
+                self._spans[(run.app, s["name"])].observe(s["ms"] / 1000)
+            for q in run.queries:
+                self._queries[(run.app, q["sql"])].observe(q["ms"] / 1000, q["rows"])
+            self.last_runs[run.app] = run
+        self._write_log(run)
+        self.write_prometheus()
+        return run
+
+    # ---- 구간 ----
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        run = self.current
+        depth = len(run.stack) if run else 0
+        if run:
+            run.stack.append(name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            if run:
+                run.stack.pop()
+                run.spans.append({"name": name, "ms": round(ms, 3), "depth": depth})
+            else:
+                with self._lock:
+                    self._spans[("-", name)].observe(ms / 1000)
+
+    def timed(self, name):
+        # 함수 전체를 구간으로 재는 데코레이터
+        def deco(fn):
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = fn.__name__, fn.__doc__, fn
+            return wrapper
+        return deco
+
+    # ---- 쿼리 ----
+    def start_query(self, sql):
+        # 실행 전에 기록을 만들어 두어야 trace callback 이 이 쿼리에 문장 수를 더할 수 있다
+        rec = {"sql": sql_shape(sql), "ms": 0.0, "rows": 0, "stmts": 0}
+        self._local.last_query = rec
+        return rec
+
+    def finish_query(self, rec, seconds, rowcount):
+        rec["ms"] += seconds * 1000
+        rec["rows"] += max(rowcount, 0)
+        run = self.current
+        if run:
+            rec["span"] = run.stack[-1] if run.stack else None
+            run.queries.append(rec)
+        else:
+            # 실행 밖 쿼리는 바로 누적(이후에 읽는 행 수는 반영되지 않음)
+            with self._lock:
+                self._queries[("-", rec["sql"])].observe(rec["ms"] / 1000, rec["rows"])
+        return rec
+
+    def statement(self, sql):
+        # set_trace_callback: SQLite 가 실제로 돌린 문장(트리거 본문 포함) 수를 직전 쿼리에 더함
+        rec = getattr(self._local, "last_query", None)
+        if rec is not None:
+            rec["stmts"] += 1
+
+    # ---- 출력 ----
+    def _write_log(self, run):
+        os.makedirs(self.out_dir, exist_ok=True)
+        line = json.dumps(run.as_dict(), ensure_ascii=False)
+        path = os.path.join(self.out_dir, TRACE_LOG)
+        with self._lock:
+            try:
+                if os.path.getsize(path) + len(line) >= TRACE_LOG_MAX_BYTES:
+                    os.replace(path, path + ".1")
+            except FileNotFoundError:
+                pass
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def prometheus_text(self):
+        def esc(v):
+            return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+        def hist(metric, help_, series):
+            out = [f"# HELP {metric} {help_}", f"# TYPE {metric} histogram"]
+            for labels, h in series:
+                lab = ",".join(f'{k}="{esc(v)}"' for k, v in labels)
+                for b, c in zip(BUCKETS, h.counts):
+                    out.append(f'{metric}_bucket{{{lab},le="{b}"}} {c}')
+                out.append(f'{metric}_bucket{{{lab},le="+Inf"}} {h.count}')
+                out.append(f"{metric}_sum{{{lab}}} {h.sum:.6f}")
+                out.append(f"{metric}_count{{{lab}}} {h.count}")
+            return out
+
+        with self._lock:
+            lines = hist("app_rerun_seconds", "Streamlit 스크립트 한 번 실행 시간",
+                         [((("app", a),), h) for a, h in sorted(self._runs.items())])
+            lines += hist("app_span_seconds", "이름 붙인 구간 시간",
+                          [((("app", a), ("span", n)), h) for (a, n), h in sorted(self._spans.items())])
+            lines += hist("sqlite_query_seconds", "쿼리 실행+읽기 시간",
+                          [((("app", a), ("sql", s)), h) for (a, s), h in sorted(self._queries.items())])
+            lines += ["# HELP sqlite_query_rows_total 쿼리가 돌려주거나 바꾼 행 수",
+                      "# TYPE sqlite_query_rows_total counter"]
+            lines += [f'sqlite_query_rows_total{{app="{esc(a)}",sql="{esc(s)}"}} {h.rows}'
+                      for (a, s), h in sorted(self._queries.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_prom < PROM_INTERVAL_S:
+            return
+        self._last_prom = now
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, PROM_FILE)
+        # 수집기가 반쯤 쓴 파일을 읽지 않도록 임시 파일에 쓰고 바꿔치기
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+RECORDER = Recorder()
+span = RECORDER.span
+timed = RECORDER.timed
+begin_run = RECORDER.begin_run
+end_run = RECORDER.end_run
+
+# ================== sqlite3 연결 ==================
+class TracedCursor(sqlite3.Cursor):
+    """실행 시간과 읽은 행 수를 직전 쿼리 기록에 더해 가는 커서."""
+
+    _rec = None
+
+    def execute(self, sql, parameters=()):
+        rec, t0 = RECORDER.start_query(sql), time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._rec = RECORDER.finish_query(rec, time.perf_counter() - t0, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        rec, t0 = RECORDER.start_query(sql), time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._rec = RECORDER.finish_query(rec, time.perf_counter() - t0, self.rowcount)
+
+    def _fetched(self, t0, n):
+        if self._rec is not None:
+            self._rec["ms"] += (time.perf_counter() - t0) * 1000
+            self._rec["rows"] += n
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        row = super().__next__()
+        self._fetched(t0, 1)
+        return row
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(t0, len(rows))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows))
+        return rows
+
+class TracedConnection(sqlite3.Connection):
+    """계측이 켜져 있을 때만 TracedCursor 와 trace callback 을 쓰는 연결.
+
+    꺼져 있으면 execute 한 번당 파이썬 호출 하나만 더해진다.
+    sqlite3.connect(..., factory=TracedConnection) 으로 만든다.
+    """
+
+    _traced = False
+
+    def _sync_trace(self):
+        if RECORDER.enabled != self._traced:
+            self.set_trace_callback(RECORDER.statement if RECORDER.enabled else None)
+            self._traced = RECORDER.enabled
+
+    def cursor(self, factory=None):
+        self._sync_trace()
+        if factory is None and RECORDER.enabled:
+            factory = TracedCursor
+        return super().cursor(factory) if factory else super().cursor()
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# ================== 디버그 패널 ==================
+def debug_sidebar(st, app):
+    """DIARY_TRACE 가 켜져 있을 때만 사이드바에 직전 실행의 계측 결과를 보여준다.
+
+    st 는 streamlit 모듈. 스크립트 맨 끝에서 부르면 그 실행의 end_run 도 같이 한다.
+    방문자가 주소(?debug=1)로 여는 길은 없다.
+    """
+    run = end_run()
+    if not TRACE_ENABLED:
+        return
+    with st.sidebar.expander("성능 추적", expanded=RECORDER.enabled):
+        on = st.checkbox("계측 켜기(프로세스 전체)", value=RECORDER.enabled, key="__trace_on")
+        if on != RECORDER.enabled:
+            RECORDER.enabled = on
+            st.rerun()
+        run = run or RECORDER.last_runs.get(app)
+        if run is None:
+            st.caption("아직 기록된 실행이 없습니다. 계측을 켜고 화면을 한 번 다시 그려 보세요.")
+            return
+        sql_ms = sum(q["ms"] for q in run.queries)
+        st.caption(f"직전 실행 {run.total_ms:.1f} ms · 쿼리 {len(run.queries)}개 {sql_ms:.1f} ms")
+        if run.spans:
+            st.dataframe([{"구간": "· " * s["depth"] + s["name"], "ms": round(s["ms"], 1)} for s in run.spans],
+                         hide_index=True, use_container_width=True)
+        if run.queries:
+            top = sorted(run.queries, key=lambda q: q["ms"], reverse=True)[:10]
+            st.dataframe([{"ms": round(q["ms"], 2), "행": q["rows"], "문장": q["stmts"],
+                           "구간": q.get("span"), "SQL": q["sql"]} for q in top],
+                         hide_index=True, use_container_width=True)
+        st.caption(f"기록: {os.path.join(RECORDER.out_dir, TRACE_LOG)}, {os.path.join(RECORDER.out_dir, PROM_FILE)}")
@@ -4,10 +4,13 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta, date
 
+from instrument import begin_run, debug_sidebar, span
+
 # =========================
 # 기본 설정
 # =========================
 st.set_page_config(page_title="공부 관리 사이트", page_icon="⏱️", layout="wide")
+begin_run("study")
 
 # 밝고 귀엽고 화려한 커스텀 테마(CSS 주입) - 라임색 배제
 THEME_COLORS = {
@@ -302,7 +305,7 @@ tab_timer, tab_calendar, tab_room, tab_shop, tab_settings = st.tabs(["타이머"
 # =========================
 # 타이머 탭
 # =========================
-with tab_timer:
+with tab_timer, span("tab.timer"):
     safe_autorefresh(interval_ms=1000, key="timer_tick")
 
     st.markdown("### 타이머")
@@ -426,7 +429,7 @@ with tab_timer:
 # =========================
 # 캘린더 탭
 # =========================
-with tab_calendar:
+with tab_calendar, span("tab.calendar"):
     st.markdown("### 캘린더(월별 열 지도)")
     df_all = get_sessions_df()
     daily_df = build_daily_stats(df_all)
@@ -491,7 +494,7 @@ with tab_calendar:
 # =========================
 # 참여방 탭(고정 3개 방: 곰/여우/올빼미)
 # =========================
-with tab_room:
+with tab_room, span("tab.room"):
     st.markdown("### 참여방")
     st.caption("원하는 방을 선택해 참여하세요. 방 생성 기능은 없으며, ‘곰/여우/올빼미’ 기본 방만 운영됩니다.")
 
@@ -557,7 +560,7 @@ with tab_room:
 # =========================
 # 상점 탭
 # =========================
-with tab_shop:
+with tab_shop, span("tab.shop"):
     st.markdown("### 코인 상점 ✨")
     top1, top2 = st.columns([1,1])
     with top1:
@@ -622,7 +625,7 @@ with tab_shop:
 # =========================
 # 설정 탭
 # =========================
-with tab_settings:
+with tab_settings, span("tab.settings"):
     st.markdown("### 설정")
     st.text_input("닉네임", key="nickname")
     st.number_input("일일 목표(분)", min_value=30, max_value=600, step=10, key="daily_goal_min")
@@ -668,3 +671,5 @@ with tab_settings:
 
 # 적용된 테마 반영
 update_theme_by_equipped()
+
+debug_sidebar(st, "study")
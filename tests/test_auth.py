@@ -0,0 +1,87 @@
+import pytest
+
+from diary_auth import (MAX_FAILS_PER_EMAIL, MAX_FAILS_PER_IP, AuthService, LoginThrottle, LoginThrottled,
+                         client_address)
+from diary_db import DiaryDB, get_user_by_email, update_password_hash
+
+@pytest.fixture
+def auth(tmp_path):
+    db = DiaryDB(str(tmp_path / "diary.db"), blob_dir=str(tmp_path / "blobs"))
+    service = AuthService(db, b"secret", rounds=4)
+    yield service
+    db.close()
+
+def test_forwarded_for_is_ignored_without_trusted_proxy():
+    assert client_address("10.0.0.9", "1.2.3.4") == "10.0.0.9"
+    assert client_address(None, "1.2.3.4") is None
+
+def test_forwarded_for_uses_hop_added_by_trusted_proxy():
+    # 클라이언트가 넣은 왼쪽 값이 아니라 프록시가 붙인 오른쪽 값
+    assert client_address("10.0.0.1", "6.6.6.6, 5.5.5.5", trusted_hops=1) == "5.5.5.5"
+    assert client_address("10.0.0.1", "6.6.6.6, 5.5.5.5, 10.0.0.2", trusted_hops=2) == "5.5.5.5"
+    assert client_address("10.0.0.1", "", trusted_hops=1) == "10.0.0.1"
+
+def test_unknown_ip_does_not_share_a_bucket(auth):
+    auth.register("victim@x", "v", "pw")
+    # 주소를 모르는 방문자들이 여러 계정으로 틀려도 다른 계정은 막히지 않는다
+    for i in range(MAX_FAILS_PER_IP + 1):
+        assert auth.login(f"nobody{i}@x", "bad", None) is None
+    assert auth.login("victim@x", "pw", None) is not None
+
+def test_known_ip_and_account_are_throttled(auth):
+    for i in range(MAX_FAILS_PER_IP):
+        auth.login(f"nobody{i}@x", "bad", "1.2.3.4")
+    with pytest.raises(LoginThrottled):
+        auth.login("other@x", "bad", "1.2.3.4")
+    for _ in range(MAX_FAILS_PER_EMAIL):
+        auth.login("victim@x", "bad", None)
+    with pytest.raises(LoginThrottled):
+        auth.login("victim@x", "bad", None)
+
+def test_token_stops_working_after_logout(auth):
+    user_id = auth.register("a@x", "a", "pw")
+    token = auth.issue_token(auth.login("a@x", "pw"))
+    assert auth.resume(token)[0] == user_id
+    auth.logout(user_id)
+    assert auth.resume(token) is None
+    assert auth.resume(auth.issue_token(auth.login("a@x", "pw")))[0] == user_id
+
+def test_token_stops_working_after_password_change(auth):
+    user_id = auth.register("a@x", "a", "pw")
+    token = auth.issue_token(auth.login("a@x", "pw"))
+    auth.change_password(user_id, "new")
+    assert auth.resume(token) is None
+    assert auth.login("a@x", "pw") is None
+    assert auth.login("a@x", "new")[0] == user_id
+
+def test_rehash_on_login_keeps_session(auth):
+    user_id = auth.register("a@x", "a", "pw")
+    token = auth.issue_token(auth.login("a@x", "pw"))
+    stronger = AuthService(auth.db, b"secret", rounds=5)
+    stronger.login("a@x", "pw")
+    stronger._pool.shutdown(wait=True)
+    assert stronger.resume(token)[0] == user_id
+
+def test_late_rehash_does_not_undo_password_change(auth):
+    # 로그인 때 읽은 해시로 다시 해시한 결과가 비밀번호 변경 뒤에 도착한 경우
+    user_id = auth.register("a@x", "a", "pw")
+    stale = get_user_by_email(auth.db, "a@x")[3]
+    auth.change_password(user_id, "new")
+    assert not update_password_hash(auth.db, user_id, auth.hasher.hash("pw"), stale)
+    assert auth.login("a@x", "pw") is None
+    assert auth.login("a@x", "new")[0] == user_id
+
+def test_throttle_forgets_stale_and_excess_keys(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("diary_auth.time.monotonic", lambda: now[0])
+    throttle = LoginThrottle(window_s=10, prune_every=3, max_keys=2)
+    throttle.record_failure("a")
+    throttle.record_failure("b")
+    now[0] = 20.0
+    throttle.record_failure("c")    # 세 번째 기록: 창이 지난 a, b 는 정리된다
+    assert list(throttle._fails) == ["c"]
+    for key in ("d", "e"):
+        throttle.record_failure(key)
+    # 상한을 넘으면 가장 오래 조용했던 c 를 잊는다
+    assert list(throttle._fails) == ["d", "e"]
+    assert throttle.retry_after("e", 1) > 0
@@ -0,0 +1,26 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+from diary_backup import compressed_snapshot
+
+def test_snapshot_of_missing_db_is_refused(tmp_path):
+    missing = tmp_path / "diary.db"
+    with pytest.raises(FileNotFoundError):
+        compressed_snapshot(str(missing), str(tmp_path / "out"))
+    assert not missing.exists()
+    assert os.listdir(tmp_path / "out") == []
+
+def test_snapshot_keeps_rows(tmp_path):
+    src = tmp_path / "diary.db"
+    with sqlite3.connect(src) as conn:
+        conn.execute("CREATE TABLE t(x)")
+        conn.execute("INSERT INTO t VALUES (1)")
+    out = compressed_snapshot(str(src), str(tmp_path / "out"))
+    restored = tmp_path / "restored.db"
+    with gzip.open(out, "rb") as f:
+        restored.write_bytes(f.read())
+    with sqlite3.connect(restored) as conn:
+        assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
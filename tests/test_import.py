@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from diary_db import DiaryDB, create_user
+from diary_import import ImportAborted, import_entries
+
+def _source(tmp_path, records):
+    path = tmp_path / "src.jsonl"
+    path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in records), encoding="utf-8")
+    return str(path)
+
+def test_corrupt_attachment_keeps_committed_batches_and_resumes(tmp_path):
+    media = tmp_path / "media"
+    media.mkdir()
+    (media / "broken.jpg").write_bytes(b"not an image")
+    (media / "a.mp3").write_bytes(b"audio")
+    records = [{"d": "2025-01-01", "mood": "happy", "content": "하나"},
+               {"d": "2025-01-02", "mood": "happy", "content": "둘", "files": ["broken.jpg"]},
+               {"d": "2025-01-03", "mood": "happy", "content": "셋", "files": ["a.mp3"]}]
+    src = _source(tmp_path, records)
+    db = DiaryDB(str(tmp_path / "diary.db"), blob_dir=str(tmp_path / "blobs"))
+    try:
+        user_id = create_user(db, "a@x", "a", None)
+        with pytest.raises(ImportAborted) as info:
+            import_entries(db, user_id, src, str(media), batch_size=1, staging_dir=str(tmp_path / "staging"))
+        assert info.value.records == (2, 2) and info.value.committed == 1
+        assert "broken.jpg" in str(info.value)
+
+        # 다시 실행해도 저장된 첫 기록은 건너뛰고(중복 없음) 같은 기록에서 멈춘다
+        with pytest.raises(ImportAborted) as info:
+            import_entries(db, user_id, src, str(media), batch_size=1, staging_dir=str(tmp_path / "staging"))
+        assert info.value.committed == 1
+        with db.reader() as conn:
+            assert conn.execute("SELECT content FROM entries").fetchall() == [("하나",)]
+        assert list((tmp_path / "staging").iterdir()) == []
+    finally:
+        db.close()
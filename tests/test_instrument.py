@@ -0,0 +1,31 @@
+import os
+
+import instrument
+from instrument import TRACE_LOG, Recorder, debug_sidebar
+
+class _Run:
+    def as_dict(self):
+        return {"app": "diary", "ms": 1.0}
+
+class _NoUI:
+    # 패널을 그리려 하면 실패하는 streamlit 대역
+    query_params = {"debug": "1"}
+
+    def __getattr__(self, name):
+        raise AssertionError(f"st.{name} 를 쓰면 안 됨")
+
+def test_debug_query_param_alone_does_not_open_panel(monkeypatch):
+    monkeypatch.setattr(instrument, "TRACE_ENABLED", False)
+    enabled = instrument.RECORDER.enabled
+    debug_sidebar(_NoUI(), "diary")
+    assert instrument.RECORDER.enabled == enabled
+
+def test_run_log_rotates_by_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrument, "TRACE_LOG_MAX_BYTES", 100)
+    rec = Recorder(out_dir=str(tmp_path), enabled=True)
+    for _ in range(10):
+        rec._write_log(_Run())
+    path = tmp_path / TRACE_LOG
+    assert os.path.getsize(path) < 100
+    assert os.path.getsize(str(path) + ".1") < 100
+    assert sorted(os.listdir(tmp_path)) == [TRACE_LOG, TRACE_LOG + ".1"]
@@ -0,0 +1,51 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from diary_media import BadImage, process_uploads
+
+class _Upload(io.BytesIO):
+    # streamlit UploadedFile 처럼 name 이 있는 파일 객체
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+def _png(edge):
+    buf = io.BytesIO()
+    Image.new("RGB", (edge, edge), "red").save(buf, "PNG")
+    return buf.getvalue()
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(2) as p:
+        yield p
+
+def test_broken_image_is_reported_and_staging_is_cleaned(tmp_path, pool):
+    images = [_Upload("ok.png", _png(1600)), _Upload("broken.jpg", b"not an image")]
+    audios = [_Upload("a.mp3", b"audio")]
+    with pytest.raises(BadImage, match="broken.jpg"):
+        process_uploads(pool, images, audios, str(tmp_path), str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+def test_failed_submit_cleans_finished_work(tmp_path):
+    pool = ThreadPoolExecutor(1)
+    submit = pool.submit
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("pool closed")
+        return submit(*args)
+
+    pool.submit = flaky
+    try:
+        with pytest.raises(RuntimeError):
+            process_uploads(pool, [_Upload("ok.png", _png(400))], [_Upload("a.mp3", b"audio")],
+                            str(tmp_path), str(tmp_path))
+    finally:
+        pool.shutdown()
+    assert os.listdir(tmp_path) == []
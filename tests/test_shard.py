@@ -0,0 +1,38 @@
+import threading
+
+from diary_repo import DiaryRepository
+
+def _writers():
+    return sum(1 for t in threading.enumerate() if t.name == "diary-writer")
+
+def test_idle_shards_are_released_and_reopen(tmp_path):
+    # 사용자마다 파일 하나: 열린 샤드는 max_open 을 넘지 않고, 닫힌 샤드도 다시 쓸 수 있다
+    repo = DiaryRepository(media_dir=str(tmp_path / "media"), shard_dir=str(tmp_path / "shards"),
+                           shard_count=0).open()
+    try:
+        repo._shards.max_open = 2
+        before = _writers()
+        users = [repo.create_user(f"u{i}@x", f"u{i}", "h") for i in range(5)]
+        for u in users:
+            repo.save_entry(u, "2025-01-01", "happy", 3, "", f"entry {u}")
+        assert _writers() - before <= 2
+        first = repo.db_for(users[0])
+        assert any(f"entry {users[0]}" in e for e in repo.get_entries(users[0]))
+        assert first is repo.db_for(users[0]) and first.is_open
+        assert sum(db.is_open for db in repo._shards._shards.values()) <= 2
+    finally:
+        repo.close()
+
+def test_busy_shard_is_not_released(tmp_path):
+    repo = DiaryRepository(media_dir=str(tmp_path / "media"), shard_dir=str(tmp_path / "shards"),
+                           shard_count=0).open()
+    try:
+        a = repo.create_user("a@x", "a", "h")
+        db = repo.db_for(a)
+        with db.reader():
+            assert db.release() is False
+        assert db.release() is True and not db.is_open
+        repo.save_entry(a, "2025-01-01", "happy", 3, "", "after release")
+        assert db.is_open
+    finally:
+        repo.close()
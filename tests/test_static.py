@@ -0,0 +1,43 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from diary_db import blob_path
+from diary_static import MediaServer
+
+SHA = "ab" * 32
+
+@pytest.fixture
+def server(tmp_path):
+    path = blob_path(str(tmp_path), SHA, ".mp3")
+    (tmp_path / "ab" / "ab").mkdir(parents=True)
+    with open(path, "wb") as f:
+        f.write(b"audio")
+    srv = MediaServer(str(tmp_path), b"secret", port=0, public_url="http://127.0.0.1:0").start()
+    srv.public_url = f"http://127.0.0.1:{srv.port}"
+    yield srv, path
+    srv.stop()
+
+def _status(url):
+    try:
+        with urllib.request.urlopen(url) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def test_signed_url_is_served(server):
+    srv, path = server
+    assert _status(srv.url_for(path)) == 200
+
+def test_unsigned_or_forged_url_is_refused(server):
+    srv, path = server
+    url = srv.url_for(path)
+    assert _status(url.split("?")[0]) == 403
+    assert _status(url[:-4] + "AAAA") == 403
+    other = MediaServer(srv.blob_dir, b"other", public_url=srv.public_url)
+    assert _status(other.url_for(path)) == 403
+
+def test_requires_public_url(tmp_path):
+    with pytest.raises(ValueError):
+        MediaServer(str(tmp_path), b"secret", port=0, public_url="").start()
@@ -0,0 +1,55 @@
+import os
+
+from diary_repo import DiaryRepository
+from diary_trash import open_dbs, sweep_orphans
+
+def _attach(repo, user_id, tmp_path, name, data):
+    # 작업 파일 하나를 첨부한 일기 저장(저장소로 옮겨진 경로를 돌려줌)
+    src = tmp_path / name
+    src.write_bytes(data)
+    entry_id = repo.save_entry(user_id, "2025-01-01", "happy", 3, "", "x",
+                               audios=[(str(src), name)])
+    return repo.get_files(entry_id, user_id)[0][1]
+
+def _sharded(tmp_path):
+    media = tmp_path / "media"
+    repo = DiaryRepository(media_dir=str(media), shard_dir=str(tmp_path / "shards"), shard_count=2).open()
+    a = repo.create_user("a@x", "a", "h")
+    b = repo.create_user("b@x", "b", "h")
+    paths = [_attach(repo, a, tmp_path, "a1.mp3", b"a1"), _attach(repo, a, tmp_path, "a2.mp3", b"a2"),
+             _attach(repo, b, tmp_path, "b1.mp3", b"b1")]
+    return repo, media, a, b, paths
+
+def test_sweep_keeps_files_of_every_shard(tmp_path):
+    repo, media, a, b, paths = _sharded(tmp_path)
+    try:
+        assert repo.db_for(a) is not repo.db_for(b)
+        orphan = os.path.join(os.path.dirname(paths[0]), "f" * 64 + ".mp3")
+        with open(orphan, "wb") as f:
+            f.write(b"orphan")
+        r = sweep_orphans(repo.all_dbs(), str(media), grace_s=0)
+        assert r["orphans"] == 1 and r["failed"] == []
+        assert not os.path.exists(orphan)
+        assert all(os.path.exists(p) for p in paths)
+    finally:
+        repo.close()
+
+def test_sweep_of_one_shard_leaves_other_shards_alone(tmp_path):
+    repo, media, a, b, paths = _sharded(tmp_path)
+    try:
+        r = sweep_orphans(repo.db_for(a), str(media), grace_s=0)
+        assert r["orphans"] == 0
+        assert all(os.path.exists(p) for p in paths)
+    finally:
+        repo.close()
+
+def test_cli_dbs_cover_all_shards(tmp_path):
+    repo, media, a, b, paths = _sharded(tmp_path)
+    shard_path = repo.db_for(a).db_path
+    repo.close()
+    for db_path in (tmp_path / "shards" / "directory.db", shard_path):
+        cli_repo, dbs, sweep_dir = open_dbs(str(db_path), str(media))
+        try:
+            assert sweep_orphans(dbs, sweep_dir, grace_s=0, dry_run=True)["orphans"] == 0
+        finally:
+            cli_repo.close()